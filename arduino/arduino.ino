@@ -3,8 +3,33 @@
 #define READY_PIN 7
 #define WAIT_PIN 4
 
+// the rate the sketch starts at; the host must connect at this rate (see --baud and --negotiate)
+#define SERIAL_BAUD 9600
+
+// the acknowledgement sent before switching rates, followed by the new rate (4 bytes, little-endian)
+#define BAUD_ACK_LOW 0x23
+#define BAUD_ACK_HIGH 0xBA
+
+// how long to wait between controller polls, in milliseconds; the library needs a pause between polls
+// this caps the update rate at about 1000 / (POLL_DELAY_MS + the time to send a packet) per second, so a faster
+// --baud only helps if this is lowered too (many controllers are happy with a few milliseconds)
+#define POLL_DELAY_MS 30
+
+// the wire format to send: 1 is the original 20-byte packet, 2 is the compact 8-byte packet with a sequence number and CRC
+// the host detects either format automatically
+#define WIRE_FORMAT 2
+
+#if WIRE_FORMAT == 2
+#define PACKET_WIDTH 8
+#else
+#define PACKET_WIDTH 20
+#endif
+
 N64Controller c(2);
 
+// the sequence number of the next v2 packet, so the host can tell when packets were dropped
+unsigned char sequence = 0;
+
 // a struct to contain packet data
 struct controller_packet {
   const char MAGIC_NUMBER_LOW = 0x23;
@@ -43,6 +68,95 @@ struct controller_packet {
   }
 };
 
+// computes the CRC-8 (polynomial 0x07) of some bytes
+unsigned char crc8(const unsigned char* bytes, int len) {
+  unsigned char crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= bytes[i];
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+// a struct to contain v2 packet data
+// the buttons are packed into a 14-bit mask (little-endian), in the order L, R, Z, D_up, D_down, D_left, D_right,
+// A, B, C_up, C_down, C_left, C_right, Start
+struct controller_packet_v2 {
+  const unsigned char MAGIC_NUMBER_LOW = 0x23;
+  const unsigned char MAGIC_NUMBER_HIGH = 0xC2;
+
+  unsigned char data[8];
+  controller_packet_v2(N64Controller* c, unsigned char seq) {
+    unsigned int buttons = 0;
+    buttons |= (c->L() ? 1 : 0) << 0;
+    buttons |= (c->R() ? 1 : 0) << 1;
+    buttons |= (c->Z() ? 1 : 0) << 2;
+    buttons |= (c->D_up() ? 1 : 0) << 3;
+    buttons |= (c->D_down() ? 1 : 0) << 4;
+    buttons |= (c->D_left() ? 1 : 0) << 5;
+    buttons |= (c->D_right() ? 1 : 0) << 6;
+    buttons |= (c->A() ? 1 : 0) << 7;
+    buttons |= (c->B() ? 1 : 0) << 8;
+    buttons |= (c->C_up() ? 1 : 0) << 9;
+    buttons |= (c->C_down() ? 1 : 0) << 10;
+    buttons |= (c->C_left() ? 1 : 0) << 11;
+    buttons |= (c->C_right() ? 1 : 0) << 12;
+    buttons |= (c->Start() ? 1 : 0) << 13;
+
+    data[0] = MAGIC_NUMBER_LOW;
+    data[1] = MAGIC_NUMBER_HIGH;
+    data[2] = seq;
+    data[3] = buttons & 0xFF;
+    data[4] = (buttons >> 8) & 0xFF;
+    data[5] = (unsigned char)c->axis_x();
+    data[6] = (unsigned char)c->axis_y();
+    data[7] = crc8(data + 2, 5);
+  }
+};
+
+// checks whether we can run at the requested rate
+bool supported_baud(unsigned long baud) {
+  switch (baud) {
+    case 9600:
+    case 19200:
+    case 38400:
+    case 57600:
+    case 115200:
+    case 230400:
+    case 250000:
+    case 500000:
+    case 1000000:
+    case 2000000:
+      return true;
+    default:
+      return false;
+  }
+}
+
+// handles a baud rate request from the host: 'b' followed by the rate (4 bytes, little-endian)
+void change_baud() {
+  unsigned char rate[4];
+  if (Serial.readBytes(rate, 4) != 4) {
+    return;
+  }
+
+  unsigned long baud = (unsigned long)rate[0] | ((unsigned long)rate[1] << 8) | ((unsigned long)rate[2] << 16) | ((unsigned long)rate[3] << 24);
+  if (!supported_baud(baud)) {
+    return;
+  }
+
+  // acknowledge at the old rate, and wait for it to be sent before switching
+  Serial.write(BAUD_ACK_LOW);
+  Serial.write(BAUD_ACK_HIGH);
+  Serial.write(rate, 4);
+  Serial.flush();
+
+  Serial.end();
+  Serial.begin(baud);
+}
+
 void setup() {
   // start up the LEDs
   pinMode(READY_PIN, OUTPUT);
@@ -51,7 +165,7 @@ void setup() {
   digitalWrite(WAIT_PIN, HIGH);
 
   // begin our serial transmission
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUD);
   c.begin();
 
   // flush the serial input buffer (just in case)
@@ -66,21 +180,25 @@ void setup() {
 
 void loop() {
   // poll the controller and fetch button presses
-  delay(30);  // the library currently requires the delay in the main loop
+  delay(POLL_DELAY_MS);  // the library currently requires the delay in the main loop
   c.update();
 
   // use the controller_packet struct to fetch and send data
+#if WIRE_FORMAT == 2
+  controller_packet_v2 packet(&c, sequence++);
+#else
   controller_packet packet(&c);
+#endif
 
   // write the data contained in our packet struct
-  int len = Serial.write(packet.data, 20);
+  int len = Serial.write((const uint8_t*)packet.data, PACKET_WIDTH);
 
   // verify that the bytes were sent
-  if (len != 20) {
+  if (len != PACKET_WIDTH) {
     // if there was an error, try to rectify it
     digitalWrite(WAIT_PIN, HIGH);
     if (len != 0) {
-      int remainder = 20 - len;
+      int remainder = PACKET_WIDTH - len;
       for (int i = 0; i < remainder; i++) {
         Serial.write(0);
       }
@@ -101,5 +219,9 @@ void loop() {
       digitalWrite(WAIT_PIN, LOW);
       digitalWrite(READY_PIN, HIGH);
     }
+    // the host may ask us to switch to a faster rate
+    else if (c == 'b') {
+      change_baud();
+    }
   }
 }
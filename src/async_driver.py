@@ -0,0 +1,525 @@
+"""
+N64 Converter
+async_driver.py
+Copyright 2020 Riley Lannon
+
+An asyncio-based driver core.
+The serial connection is made non-blocking and watched with loop.add_reader, and decoded controller state is
+published as an async stream. Output sinks (keyboard, mouse, logging, ...) each subscribe to the stream
+independently, with latest-value-wins semantics, so a slow sink skips frames rather than delaying the others.
+The output backends block (xdotool spawns a process for each update), so each sink makes its backend calls on its
+own worker thread, and the event loop only ever waits for them; connecting to the board happens off the loop too.
+Each stage keeps its own latency statistics, measured from the moment the data was read.
+
+Since add_reader needs a selectable file descriptor, this is not available on Windows.
+"""
+
+import asyncio
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import serial
+
+import comm
+import frame_parser
+import mouse_output
+import mouse_pos
+import serial_packet
+import supervisor
+
+# The number of recent latency samples kept for each stage
+LATENCY_SAMPLES = 1000
+
+
+class LatencyStats:
+    """ Keeps recent latency samples for a stage """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, seconds):
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self):
+        """ Gets a one-line summary of the recent samples """
+        if not self.samples:
+            return f"{self.name}: no samples"
+        samples = sorted(self.samples)
+        count = len(samples)
+        return (
+            f"{self.name}: {self.count} frames, p50 {samples[count // 2] * 1000:.3f} ms, "
+            f"p99 {samples[min(count - 1, int(count * 0.99))] * 1000:.3f} ms, max {samples[-1] * 1000:.3f} ms"
+        )
+
+
+class Frame:
+    """ A decoded packet, along with when its data was read
+
+        buttons holds the state the outputs use, which may have a filtered stick; packet.buttons is as it arrived
+    """
+    __slots__ = ("packet", "received", "buttons")
+
+    def __init__(self, packet, received, buttons=None):
+        self.packet = packet
+        self.received = received
+        self.buttons = buttons if buttons is not None else packet.buttons
+
+
+class Subscription:
+    """ One subscriber's view of a ControllerStream; iterate over it with async for
+
+        Only the newest frame is held, so a slow subscriber skips frames rather than falling behind
+    """
+
+    def __init__(self):
+        self.superseded = 0
+        self._frame = None
+        self._closed = False
+        self._event = asyncio.Event()
+
+    def _put(self, frame):
+        if self._frame is not None:
+            self.superseded += 1
+        self._frame = frame
+        self._event.set()
+
+    def _close(self):
+        self._closed = True
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self._frame is None:
+            if self._closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            await self._event.wait()
+        frame = self._frame
+        self._frame = None
+        return frame
+
+
+class ControllerStream:
+    """ Reads packets from a serial connection on the event loop and publishes them to subscribers """
+
+    def __init__(self, conn, stick_filter=None):
+        """ Creates the stream; call start() to begin reading
+
+            :param conn:
+                The open serial connection
+
+            :param stick_filter:
+                A stick_filter.StickFilter the stick is passed through once, before frames go to the subscribers
+        """
+        self.conn = conn
+        self.stick_filter = stick_filter
+        self.parser = frame_parser.FrameParser()
+        self.enabled = True
+        self.error = None
+        self.read_latency = LatencyStats("read")
+        self._subscribers = []
+        self._loop = None
+        self._closed = None
+
+    def start(self):
+        """ Starts watching the connection; must be called from within the event loop """
+        self._loop = asyncio.get_running_loop()
+        self._closed = self._loop.create_future()
+
+        # reads must never block the loop
+        self.conn.timeout = 0
+        self._loop.add_reader(self.conn.fileno(), self._on_readable)
+
+    def subscribe(self):
+        """ Creates a new subscription to the stream
+
+            :returns:
+                The Subscription
+        """
+        subscription = Subscription()
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Ends a subscription """
+        self._subscribers.remove(subscription)
+        subscription._close()
+
+    def _on_readable(self):
+        received = perf_counter()
+        try:
+            data = self.conn.read(max(1, self.conn.in_waiting))
+            if not data:
+                # the fd was readable but held nothing, which means the device went away
+                raise serial.SerialException("device disconnected")
+        except Exception as e:
+            self.close(e)
+            return
+
+        packets = self.parser.feed(data)
+        if not packets:
+            return
+
+        # only the newest packet matters
+        packet = packets[-1]
+        self.enabled = comm.update_enabled(self.conn, packet, self.enabled)
+
+        # only publish if the controller is enabled -- else, ignore the events
+        if self.enabled:
+            buttons = packet.buttons
+            if self.stick_filter is not None:
+                buttons = self.stick_filter.apply(buttons, received)
+            frame = Frame(packet, received, buttons)
+            for subscription in self._subscribers:
+                subscription._put(frame)
+        self.read_latency.add(perf_counter() - received)
+
+    def close(self, error=None):
+        """ Stops reading and ends every subscription
+
+            :param error:
+                The error that ended the stream, if any
+        """
+        if self._closed is None or self._closed.done():
+            return
+        self.error = error
+        self._loop.remove_reader(self.conn.fileno())
+        for subscription in self._subscribers:
+            subscription._close()
+        self._closed.set_result(error)
+
+    async def wait_closed(self):
+        """ Waits until the stream has ended
+
+            :returns:
+                The error that ended the stream, if any
+        """
+        return await self._closed
+
+
+class Sink:
+    """ The base for output sinks; subclasses implement handle()
+
+        Each sink has a single worker thread for its blocking calls (see call()), so its calls stay in order,
+        and a slow sink never holds up the event loop or any other sink
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyStats(name)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-sink")
+
+    async def call(self, function, *args):
+        """ Runs a blocking function on the sink's worker thread, and waits for it without blocking the loop """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def run(self, subscription):
+        """ Handles frames from a subscription until it ends """
+        async for frame in subscription:
+            try:
+                await self.handle(frame)
+            except Exception as e:
+                print(f"An error occurred in the {self.name} sink:", e)
+            self.latency.add(perf_counter() - frame.received)
+
+    async def handle(self, frame):
+        raise NotImplementedError
+
+    async def release(self):
+        """ Returns any held outputs to rest; called when the connection is lost or we exit """
+        pass
+
+    def close(self):
+        """ Stops the sink's worker thread, once it has finished what it was given """
+        self.executor.shutdown(wait=True)
+
+
+class KeyboardSink(Sink):
+    """ Drives key presses through a backend's update_keys """
+
+    def __init__(self, update_keys, config):
+        super().__init__("keyboard")
+        self.update_keys = update_keys
+        self.config = config
+        self.pressed_buttons = serial_packet.Buttons()
+
+    def _update(self, buttons):
+        self.update_keys(self.pressed_buttons, buttons, self.config)
+        self.pressed_buttons.copy_from(buttons)
+
+    async def handle(self, frame):
+        await self.call(self._update, frame.buttons)
+
+    async def release(self):
+        await self.call(self._update, serial_packet.Buttons())
+
+
+class MouseSink(Sink):
+    """ Drives the mouse through a mouse_output.MouseOutput
+
+        The MouseOutput has its own worker thread, which drops moves that do nothing and combines moves the
+        backend couldn't keep up with, so handing a frame over never blocks; the sink's latency is to that handover
+    """
+
+    def __init__(self, update_mouse, use_absolute=False, base_pos=(0, 0), move_mouse=None):
+        super().__init__("mouse")
+        self.output = mouse_output.MouseOutput(update_mouse, move_mouse, use_absolute, base_pos)
+        self.output.start()
+
+    @property
+    def base_pos(self):
+        return self.output.base_pos
+
+    @base_pos.setter
+    def base_pos(self, base_pos):
+        self.output.base_pos = base_pos
+
+    async def handle(self, frame):
+        self.output.submit(frame.buttons)
+
+    async def release(self):
+        self.output.reset()
+
+    def close(self):
+        self.output.stop()
+        print(self.output.report())
+        super().close()
+
+
+class LogSink(Sink):
+    """ Logs every change in controller state """
+
+    def __init__(self, file=sys.stdout):
+        super().__init__("log")
+        self.file = file
+        self.last = None
+
+    async def handle(self, frame):
+        buttons = frame.packet.buttons
+        state = (buttons.mask, buttons.x_axis, buttons.y_axis)
+        if state != self.last:
+            self.last = state
+            pressed = [name for bit, name in enumerate(serial_packet.BUTTON_NAMES) if state[0] & (1 << bit)]
+            print(f"[{frame.received:.6f}] buttons: {' '.join(pressed) or '-'}, stick: ({state[1]}, {state[2]})", file=self.file)
+
+
+async def calibrate(stream):
+    """ Waits for the start button, and reads the mouse position as the base position for absolute mode
+
+        :returns:
+            The base position, or None if the stream ended first
+    """
+    print("Move the mouse to a good known zero point and hit start")
+    subscription = stream.subscribe()
+    try:
+        async for frame in subscription:
+            if frame.buttons.start:
+                # reading the position may block (pyautogui), so keep it off the loop
+                base_pos = await asyncio.get_running_loop().run_in_executor(None, mouse_pos.read_current_mouse_position)
+                print(f"Using {base_pos} as base position")
+                return base_pos
+    finally:
+        if subscription in stream._subscribers:
+            stream.unsubscribe(subscription)
+    return None
+
+
+def _open_in_thread(connect):
+    """ Calls connect on a daemon thread, since it blocks until the board is found
+
+        A plain thread is used rather than an executor, so a connect that never returns can't hold up the
+        loop's shutdown (or the interpreter's exit)
+
+        :returns:
+            A future for the connection; if it is cancelled, the connection is closed once it is made
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(conn, error):
+        if future.cancelled():
+            # nobody is waiting for the connection any more
+            if conn is not None:
+                conn.close()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(conn)
+
+    def target():
+        conn, error = None, None
+        try:
+            conn = connect()
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(deliver, conn, error)
+        except RuntimeError:
+            # the loop has already closed
+            if conn is not None:
+                conn.close()
+
+    threading.Thread(target=target, name="connect", daemon=True).start()
+    return future
+
+
+async def _release(sinks):
+    """ Releases each sink's outputs; one failing doesn't stop the others """
+    for sink in sinks:
+        try:
+            await sink.release()
+        except Exception as e:
+            print(f"An error occurred releasing the {sink.name} sink:", e)
+
+
+async def _connect(connect):
+    """ Calls connect until it succeeds, without blocking the loop """
+    while True:
+        try:
+            return await _open_in_thread(connect)
+        except Exception as e:
+            # the device node may exist before it is ready to be opened
+            print("Could not connect:", e)
+            await asyncio.sleep(supervisor.RETRY_INTERVAL)
+
+
+async def drive(connect, sinks, setup=None, stop=None, stick_filter=None):
+    """ Connects and feeds every sink until ^C (or stop is set), reconnecting whenever the connection is lost
+
+        :param connect:
+            A function that finds the board and returns an open serial connection, waiting if necessary
+
+        :param sinks:
+            The Sinks to drive
+
+        :param setup:
+            An async function run with the first stream before any sink starts, such as calibration;
+            if it returns False (because the connection was lost), it is retried on the next connection
+
+        :param stop:
+            An asyncio.Event which ends the driver when set
+
+        :param stick_filter:
+            A stick_filter.StickFilter the stick is passed through once, before the frames reach any sink
+
+        :returns:
+            The ControllerStream of the last connection
+    """
+    stream = None
+    try:
+        while stop is None or not stop.is_set():
+            # wait for the board, but give up if we're stopped in the meantime
+            connecting = asyncio.ensure_future(_connect(connect))
+            if stop is not None:
+                stopped = asyncio.ensure_future(stop.wait())
+                await asyncio.wait([connecting, stopped], return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                if not connecting.done():
+                    connecting.cancel()
+                    break
+            stream = ControllerStream(await connecting, stick_filter)
+            stream.start()
+            if setup is not None:
+                if await setup(stream) is False:
+                    stream.close()
+                    continue
+                setup = None
+
+            tasks = [asyncio.create_task(sink.run(stream.subscribe())) for sink in sinks]
+            print("Ready.")
+
+            closed = asyncio.ensure_future(stream.wait_closed())
+            if stop is not None:
+                stopped = asyncio.ensure_future(stop.wait())
+                await asyncio.wait([closed, stopped], return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                stream.close()
+            error = await closed
+            await asyncio.gather(*tasks)
+
+            if error is not None:
+                print("Connection lost:", error)
+            await _release(sinks)
+            try:
+                stream.conn.close()
+            except Exception:
+                pass
+    finally:
+        if stream is not None:
+            await _release(sinks)
+        for sink in sinks:
+            sink.close()
+        if stream is not None:
+            stream.close()
+            print()
+            print(stream.read_latency.summary())
+            print("Parser:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in stream.parser.stats().items()))
+            for sink in sinks:
+                print(sink.latency.summary())
+    return stream
+
+
+def run(config, update_keys, update_mouse, board_id: str, use_absolute: bool = False,
+        baud: int = comm.DEFAULT_BAUD, negotiate: bool = False, log: bool = False, stick_filter=None, move_mouse=None):
+    """ Runs the asyncio driver until ^C
+
+        :param config:
+            The controller configuration, compiled into a dispatch.DispatchTable with the backend's resolve_key
+
+        :param update_keys:
+            The backend's function for updating key presses
+
+        :param update_mouse:
+            The backend's function for updating the mouse, or None if update_keys drives the stick itself
+
+        :param board_id:
+            The board's VID:PID, as in n64.py's vid_pid table
+
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position
+
+        :param baud:
+            The serial baud rate
+
+        :param negotiate:
+            Whether to ask the Arduino to switch to baud
+
+        :param log:
+            Whether to log every change in controller state
+
+        :param stick_filter:
+            A stick_filter.StickFilter the stick is passed through before it reaches the outputs, if any
+
+        :param move_mouse:
+            The backend's function for moving the mouse by a relative amount, so moves it falls behind on can be
+            combined
+    """
+    sinks = [KeyboardSink(update_keys, config)]
+    mouse_sink = None
+    if update_mouse is not None:
+        mouse_sink = MouseSink(update_mouse, use_absolute, move_mouse=move_mouse)
+        sinks.append(mouse_sink)
+    if log:
+        sinks.append(LogSink())
+
+    async def setup(stream):
+        base_pos = await calibrate(stream)
+        if base_pos is None:
+            return False
+        mouse_sink.base_pos = base_pos
+
+    try:
+        asyncio.run(drive(
+            lambda: comm.open_connection(board_id, baud, negotiate), sinks,
+            setup if use_absolute and mouse_sink is not None else None, stick_filter=stick_filter
+        ))
+    except KeyboardInterrupt:
+        print("Exiting...")
@@ -0,0 +1,8 @@
+"""
+N64 Converter
+benchmarks
+Copyright 2020 Riley Lannon
+
+Benchmarks for the converter's hot paths.
+Run them from the src directory, e.g. `python -m benchmarks.backend_latency`
+"""
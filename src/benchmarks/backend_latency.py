@@ -0,0 +1,169 @@
+"""
+N64 Converter
+benchmarks/backend_latency.py
+Copyright 2020 Riley Lannon
+
+Measures the per-packet latency of the Linux output backends.
+Each backend is driven with the same synthetic stream of button presses and stick movements,
+and the time spent in update_keys + update_mouse is reported for every packet.
+With --chords, several buttons are pressed and released together instead, and the time to inject each chord
+in one batch is compared against injecting its keys one at a time.
+
+Note this injects real input events, so run it with a harmless window focused (or under Xvfb).
+"""
+
+import argparse
+import importlib
+from time import perf_counter
+
+import dispatch
+import serial_packet
+
+# the default Mupen64Plus configuration, as in n64.py
+DEFAULT_CONFIG = ['x','c','z','w','s','a','d',0,0,'Shift_L','Control_L','i','k','j','l','Return']
+
+BACKENDS = {
+    "xdotool": "linux_functions",
+    "uinput": "uinput_functions",
+    "xtest": "xtest_functions",
+}
+
+
+def synthetic_packets(count):
+    """ Generates a stream of packet data that toggles one button and sweeps the stick each packet
+
+        :param count:
+            The number of packets to generate
+
+        :returns:
+            A list of Buttons objects
+    """
+    packets = []
+    for n in range(count):
+        data = [0] * 16
+        # toggle a different button every other packet so key edges are always generated
+        button = (n // 2) % 16
+        if button not in (7, 8):
+            data[button] = n % 2
+        data[7] = (n % 160) - 80
+        data[8] = 80 - (n % 160)
+
+        buttons = serial_packet.Buttons()
+        buttons.update(data)
+        packets.append(buttons)
+    return packets
+
+
+def chord_packets(count, size):
+    """ Generates a stream of packet data that alternately presses and releases a chord of buttons
+
+        :param count:
+            The number of packets to generate
+
+        :param size:
+            The number of buttons in each chord
+
+        :returns:
+            A list of Buttons objects
+    """
+    packets = []
+    for n in range(count):
+        mask = 0
+        if n % 2 == 0:
+            # a different chord each time, so every key is exercised
+            for i in range(size):
+                mask |= 1 << ((n // 2 + i) % len(serial_packet.BUTTON_NAMES))
+        packets.append(serial_packet.Buttons(mask))
+    return packets
+
+
+def run_keys(module, config, packets, batched):
+    """ Drives a backend's key updates with the given packets
+
+        :param batched:
+            Whether each packet's changes are sent in one update_keys call, or one call per changed key
+
+        :returns:
+            A list of per-packet latencies, in seconds
+    """
+    pressed = serial_packet.Buttons()
+    timings = []
+    for packet in packets:
+        start = perf_counter()
+        if batched:
+            module.update_keys(pressed, packet, config)
+            pressed.copy_from(packet)
+        else:
+            changed = pressed.mask ^ packet.mask
+            while changed:
+                bit = changed & -changed
+                changed ^= bit
+                step = serial_packet.Buttons(pressed.mask ^ bit)
+                module.update_keys(pressed, step, config)
+                pressed.copy_from(step)
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def run_backend(module, config, packets):
+    """ Drives a backend with the given packets
+
+        :returns:
+            A list of per-packet latencies, in seconds
+    """
+    pressed = serial_packet.Buttons()
+    timings = []
+    for packet in packets:
+        start = perf_counter()
+        module.update_keys(pressed, packet, config)
+        module.update_mouse(packet, False, (0, 0))
+        timings.append(perf_counter() - start)
+        pressed.copy_from(packet)
+
+    # release anything still held
+    module.update_keys(pressed, serial_packet.Buttons(), config)
+    return timings
+
+
+def report(name, timings):
+    """ Prints a one-line summary of the latencies """
+    timings = sorted(timings)
+    count = len(timings)
+    print(
+        f"{name:>8}: {count} packets, "
+        f"mean {sum(timings) / count * 1000:.3f} ms, "
+        f"p50 {timings[count // 2] * 1000:.3f} ms, "
+        f"p99 {timings[min(count - 1, int(count * 0.99))] * 1000:.3f} ms, "
+        f"max {timings[-1] * 1000:.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latency of the Linux output backends")
+    parser.add_argument("-n", "--packets", type=int, default=500, help="The number of packets to send")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=list(BACKENDS.keys()),
+        help="A backend to measure; may be given more than once (default: all)"
+    )
+    parser.add_argument(
+        "--chords",
+        type=int,
+        metavar="SIZE",
+        help="Measure key injection for chords of this many buttons, batched and one key at a time"
+    )
+    args = parser.parse_args()
+
+    packets = chord_packets(args.packets, args.chords) if args.chords else synthetic_packets(args.packets)
+    for name in args.backend or BACKENDS.keys():
+        try:
+            module = importlib.import_module(BACKENDS[name])
+            config = dispatch.compile_table(DEFAULT_CONFIG, module.resolve_key)
+            if args.chords:
+                report(name, run_keys(module, config, packets, batched=True))
+                report("per-key", run_keys(module, config, packets, batched=False))
+            else:
+                report(name, run_backend(module, config, packets))
+        except Exception as e:
+            print(f"{name:>8}: unavailable ({e})")
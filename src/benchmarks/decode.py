@@ -0,0 +1,81 @@
+"""
+N64 Converter
+benchmarks/decode.py
+Copyright 2020 Riley Lannon
+
+Compares the frames/sec of the per-packet SerialPacket.update path against the bulk decode_frames decoder,
+for either wire format.
+"""
+
+import argparse
+import random
+from time import perf_counter
+
+import serial_packet
+
+
+def synthetic_frame(rng):
+    """ Builds one valid 20-byte frame with random buttons and stick position """
+    data = [rng.randint(0, 1) for _ in range(16)]
+    data[7] = rng.randint(-128, 127)
+    data[8] = rng.randint(-128, 127)
+    checksum = sum(1 for value in data if value)
+    return bytes([0x23, 0xC0]) + bytes(value & 0xFF for value in data) + checksum.to_bytes(2, "little")
+
+
+def synthetic_frame_v2(rng, sequence):
+    """ Builds one valid 8-byte v2 frame with random buttons and stick position """
+    body = bytes([sequence & 0xFF, rng.randrange(256), rng.randrange(64), rng.randrange(256), rng.randrange(256)])
+    return serial_packet.SerialPacket.V2_MAGIC_NUMBER + body + bytes([serial_packet.crc8(body)])
+
+
+def synthetic_stream(count, seed=0, version=1):
+    """ Builds a buffer holding count concatenated frames """
+    rng = random.Random(seed)
+    if version == 2:
+        return b"".join(synthetic_frame_v2(rng, sequence) for sequence in range(count))
+    return b"".join(synthetic_frame(rng) for _ in range(count))
+
+
+def frame_width(stream):
+    """ Gets the width of the frames in a stream, from the first magic number """
+    return serial_packet.SerialPacket.FRAME_WIDTHS[stream[1]]
+
+
+def per_packet(stream):
+    """ Decodes the stream one SerialPacket at a time, as the driver loop does """
+    size = frame_width(stream)
+    packet = serial_packet.SerialPacket()
+    for offset in range(0, len(stream), size):
+        packet.update(stream[offset:offset + size])
+
+
+def bulk(stream):
+    """ Decodes the whole stream with one call """
+    serial_packet.decode_frames(stream)
+
+
+def frames_per_second(function, stream, repeat):
+    """ Runs a decoder over the stream several times and returns the best rate """
+    count = len(stream) // frame_width(stream)
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        function(stream)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-packet and bulk frame decoding")
+    parser.add_argument("-n", "--frames", type=int, default=10000, help="The number of frames in the stream")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="The number of runs; the best is reported")
+    parser.add_argument("-f", "--format", type=int, choices=[1, 2], default=2, help="The wire format of the frames")
+    args = parser.parse_args()
+
+    stream = synthetic_stream(args.frames, version=args.format)
+    single = frames_per_second(per_packet, stream, args.repeat)
+    batch = frames_per_second(bulk, stream, args.repeat)
+    print(f"per-packet: {single:,.0f} frames/sec")
+    print(f"bulk:       {batch:,.0f} frames/sec ({batch / single:.1f}x)")
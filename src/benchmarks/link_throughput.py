@@ -0,0 +1,123 @@
+"""
+N64 Converter
+benchmarks/link_throughput.py
+Copyright 2020 Riley Lannon
+
+Measures the serial link at one or more baud rates.
+
+In loopback mode (the default), frames are written to the port and read back, so the port must echo its output:
+a USB-serial adapter with TX and RX jumpered, or pyserial's virtual 'loop://' port (which ignores the baud rate).
+Each frame carries a sequence number in its axes, so the report includes the end-to-end latency of every frame.
+
+In board mode, the frames sent by the Arduino are counted for each rate (negotiating the rate if needed),
+giving the frames/sec the sketch actually achieves.
+"""
+
+import argparse
+import threading
+from time import perf_counter, sleep
+
+import serial
+
+import comm
+import frame_parser
+import serial_packet
+
+
+def sequenced_frame(sequence):
+    """ Builds a valid frame carrying a 16-bit sequence number in its axis bytes """
+    data = [0] * 16
+    data[7] = sequence & 0xFF
+    data[8] = (sequence >> 8) & 0xFF
+    checksum = sum(1 for value in data if value)
+    return serial_packet.SerialPacket.MAGIC_NUMBER + bytes(data) + checksum.to_bytes(2, "little")
+
+
+def frame_sequence(packet):
+    """ Gets the sequence number back out of a packet """
+    return (packet.buttons.x_axis & 0xFF) | ((packet.buttons.y_axis & 0xFF) << 8)
+
+
+def loopback(con, seconds):
+    """ Writes frames as fast as the port accepts them while reading them back
+
+        :returns:
+            A tuple of the frames/sec received and the sorted list of latencies, in seconds
+    """
+    sent = {}
+    running = True
+
+    def writer():
+        sequence = 0
+        while running:
+            sent[sequence & 0xFFFF] = perf_counter()
+            con.write(sequenced_frame(sequence))
+            con.flush()
+            sequence += 1
+
+    thread = threading.Thread(target=writer, daemon=True)
+    parser = frame_parser.FrameParser()
+    latencies = []
+
+    start = perf_counter()
+    thread.start()
+    while perf_counter() - start < seconds:
+        data = con.read(max(1, con.in_waiting))
+        now = perf_counter()
+        for packet in parser.feed(data):
+            written = sent.get(frame_sequence(packet))
+            if written is not None:
+                latencies.append(now - written)
+    elapsed = perf_counter() - start
+    running = False
+    thread.join(timeout=1)
+
+    return (len(latencies) / elapsed, sorted(latencies))
+
+
+def from_board(con, seconds):
+    """ Counts the frames sent by the Arduino
+
+        :returns:
+            The frames/sec received
+    """
+    parser = frame_parser.FrameParser()
+    con.reset_input_buffer()
+    count = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        count += len(parser.feed(con.read(max(1, con.in_waiting))))
+    return count / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure frames/sec and latency over the serial link")
+    parser.add_argument("-p", "--port", type=str, default="loop://", help="The serial port or pyserial URL")
+    parser.add_argument("--baud", type=int, action="append", help="A baud rate to test; may be given more than once")
+    parser.add_argument("-t", "--seconds", type=float, default=2.0, help="How long to run each rate")
+    parser.add_argument("--board", action="store_true", help="Count frames sent by an Arduino instead of looping back")
+    args = parser.parse_args()
+
+    for baud in args.baud or [comm.DEFAULT_BAUD, 115200]:
+        if args.board:
+            # the board always starts at its default rate, and resets when we open the port
+            con = serial.serial_for_url(args.port, comm.DEFAULT_BAUD, timeout=0.1)
+            sleep(2)
+            if not comm.negotiate_baud(con, baud):
+                print(f"{baud:>8} baud: not accepted by the board")
+                con.close()
+                continue
+            print(f"{baud:>8} baud: {from_board(con, args.seconds):,.1f} frames/sec")
+        else:
+            con = serial.serial_for_url(args.port, baud, timeout=0.1)
+            rate, latencies = loopback(con, args.seconds)
+            if latencies:
+                count = len(latencies)
+                print(
+                    f"{baud:>8} baud: {rate:,.1f} frames/sec, "
+                    f"latency p50 {latencies[count // 2] * 1000:.2f} ms, "
+                    f"p99 {latencies[min(count - 1, int(count * 0.99))] * 1000:.2f} ms"
+                )
+            else:
+                print(f"{baud:>8} baud: no frames received")
+        con.close()
@@ -0,0 +1,149 @@
+"""
+N64 Converter
+benchmarks/parser_fuzz.py
+Copyright 2020 Riley Lannon
+
+A fuzz and throughput harness for the FrameParser.
+A synthetic stream of frames is damaged at random (bit flips, dropped bytes and inserted garbage) and fed
+to the parser in random chunk sizes. Every frame that was left intact must come out of the parser, and no damaged
+data may be accepted as a frame, beyond what the checksum can't catch:
+    * The v1 checksum only counts the non-zero data bytes, so damage that keeps the count (e.g. a flipped axis bit)
+      passes it. Any false accept fails a v1 run, so v1 runs are expected to fail; that is what the v2 format fixes.
+    * A CRC-8 passes about 1 in 256 damaged frames by chance, so a v2 run allows that many false accepts, and an
+      intact frame may only be lost to one of them (a damaged frame that passed and ran on into it).
+A recorded raw serial stream may be supplied instead, in which case only the statistics and throughput are reported.
+"""
+
+import argparse
+import random
+import sys
+from time import perf_counter
+
+import frame_parser
+import serial_packet
+from benchmarks.decode import synthetic_frame, synthetic_frame_v2
+
+
+def damaged_stream(count, damage_rate, rng, version=1):
+    """ Builds a stream of frames, some of which are damaged
+
+        :returns:
+            A tuple containing the stream, the list of frames left intact, in order, and the number of damaged frames
+    """
+    stream = bytearray()
+    intact = []
+    damaged = 0
+    for sequence in range(count):
+        frame = bytearray(synthetic_frame(rng) if version == 1 else synthetic_frame_v2(rng, sequence))
+        if rng.random() < damage_rate:
+            damaged += 1
+            kind = rng.choice(("flip", "drop", "insert"))
+            if kind == "flip":
+                frame[rng.randrange(len(frame))] ^= 1 << rng.randrange(8)
+            elif kind == "drop":
+                start = rng.randrange(len(frame))
+                del frame[start:start + rng.randint(1, 4)]
+            else:
+                stream += bytes(rng.randrange(256) for _ in range(rng.randint(1, 30)))
+                intact.append(bytes(frame))
+        else:
+            intact.append(bytes(frame))
+        stream += frame
+    return bytes(stream), intact, damaged
+
+
+def feed_in_chunks(parser, stream, rng, max_chunk):
+    """ Feeds the stream to the parser in random chunk sizes, as a serial port would deliver it
+
+        :returns:
+            The packets parsed, and the time spent parsing
+    """
+    packets = []
+    elapsed = 0.0
+    position = 0
+    while position < len(stream):
+        size = rng.randint(1, max_chunk)
+        chunk = stream[position:position + size]
+        position += size
+
+        start = perf_counter()
+        packets += parser.feed(chunk)
+        elapsed += perf_counter() - start
+    return packets, elapsed
+
+
+def decoded(frame):
+    """ Decodes a frame that is known to be valid, for comparing against the parser's output """
+    packet = serial_packet.SerialPacket()
+    packet.update(frame)
+    return list(packet.buttons)
+
+
+def missing_frames(intact, packets):
+    """ Counts the intact frames that the parser did not return, in order
+
+        Packets that don't match any upcoming frame are false accepts: damaged data that happened to pass the checksum.
+        Each of these may swallow the start of the next real frame, so they are counted too
+
+        :returns:
+            A tuple of the number of intact frames lost and the number of false accepts
+    """
+    expected = [decoded(frame) for frame in intact]
+    found = 0
+    false_accepts = 0
+    index = 0
+    for packet in packets:
+        # look ahead for the frame this packet matches; anything skipped over was lost
+        try:
+            match = expected.index(list(packet.buttons), index)
+        except ValueError:
+            false_accepts += 1
+            continue
+        found += 1
+        index = match + 1
+    return (len(expected) - found, false_accepts)
+
+
+def passed(version, damaged, missing, false_accepts):
+    """ Checks a run's losses and false accepts against what the format's checksum can catch (see above) """
+    if version == 1:
+        return not missing and not false_accepts
+    allowed = -(-damaged // 256)
+    return false_accepts <= allowed and missing <= false_accepts
+
+
+def report(parser, frames, total_bytes, elapsed):
+    """ Prints the parser statistics and throughput """
+    print("Parser:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in parser.stats().items()))
+    print(f"Throughput: {frames / elapsed:,.0f} frames/sec, {total_bytes / elapsed / 1e6:.2f} MB/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz and benchmark the serial frame parser")
+    parser.add_argument("-n", "--frames", type=int, default=20000, help="The number of synthetic frames")
+    parser.add_argument("-d", "--damage", type=float, default=0.05, help="The fraction of frames to damage")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="The random seed")
+    parser.add_argument("--chunk", type=int, default=64, help="The largest chunk fed to the parser at once")
+    parser.add_argument("-f", "--format", type=int, choices=[1, 2], default=2, help="The wire format of the synthetic frames")
+    parser.add_argument("--recording", type=str, help="A file containing a raw serial stream to parse instead")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    if args.recording:
+        with open(args.recording, "rb") as file:
+            stream = file.read()
+        fp = frame_parser.FrameParser()
+        packets, elapsed = feed_in_chunks(fp, stream, rng, args.chunk)
+        report(fp, len(packets), len(stream), elapsed)
+        sys.exit(0)
+
+    stream, intact, damaged = damaged_stream(args.frames, args.damage, rng, args.format)
+    fp = frame_parser.FrameParser()
+    packets, elapsed = feed_in_chunks(fp, stream, rng, args.chunk)
+    report(fp, len(packets), len(stream), elapsed)
+
+    missing, false_accepts = missing_frames(intact, packets)
+    print(f"Intact frames: {len(intact)}, recovered: {len(intact) - missing}, lost: {missing}, false accepts: {false_accepts}")
+
+    sys.exit(0 if passed(args.format, damaged, missing, false_accepts) else 1)
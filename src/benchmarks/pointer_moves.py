@@ -0,0 +1,101 @@
+"""
+N64 Converter
+benchmarks/pointer_moves.py
+Copyright 2020 Riley Lannon
+
+Measures how many mouse moves per second the xdotool and XTest backends can send, in relative and absolute mode.
+Each xdotool move spawns a process that connects to the X server, while XTest reuses one connection for every move.
+
+This moves the real pointer, so run it under Xvfb, either with xvfb-run or with --xvfb to start a server:
+    xvfb-run python -m benchmarks.pointer_moves
+    python -m benchmarks.pointer_moves --xvfb
+"""
+
+import argparse
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+from time import perf_counter
+
+import serial_packet
+
+BACKENDS = {
+    "xdotool": "linux_functions",
+    "xtest": "xtest_functions",
+}
+
+# The display used by --xvfb
+XVFB_DISPLAY = ":99"
+
+
+def start_xvfb(display=XVFB_DISPLAY):
+    """ Starts an Xvfb server and points DISPLAY at it
+
+        :raises Exception:
+            If Xvfb is not installed
+
+        :returns:
+            The server's Popen
+    """
+    if shutil.which("Xvfb") is None:
+        raise Exception("Xvfb is not installed")
+    server = subprocess.Popen(["Xvfb", display, "-screen", "0", "1920x1080x24"], stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+
+    # give the server a moment to start accepting connections
+    time.sleep(1)
+    return server
+
+
+def sweep(count):
+    """ Generates stick positions that sweep back and forth, so every move goes somewhere new """
+    packets = []
+    for n in range(count):
+        packets.append(serial_packet.Buttons(0, (n % 160) - 80, 80 - (n % 160)))
+    return packets
+
+
+def moves_per_second(module, packets, use_absolute):
+    """ Sends a move for every packet through a backend
+
+        :returns:
+            The moves sent per second
+    """
+    base_pos = (960, 540)
+    start = perf_counter()
+    for packet in packets:
+        module.update_mouse(packet, use_absolute, base_pos)
+    return len(packets) / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the mouse moves/sec of the xdotool and XTest backends")
+    parser.add_argument("-n", "--moves", type=int, default=500, help="The number of moves to send in each mode")
+    parser.add_argument("--xvfb", action="store_true", help=f"Start an Xvfb server on {XVFB_DISPLAY} to run against")
+    args = parser.parse_args()
+
+    server = None
+    if args.xvfb:
+        try:
+            server = start_xvfb()
+        except Exception as e:
+            print("Error:", e)
+            sys.exit(1)
+
+    try:
+        packets = sweep(args.moves)
+        for name, module_name in BACKENDS.items():
+            try:
+                module = importlib.import_module(module_name)
+                relative = moves_per_second(module, packets, False)
+                absolute = moves_per_second(module, packets, True)
+                print(f"{name:>8}: relative {relative:>9,.0f} moves/sec, absolute {absolute:>9,.0f} moves/sec")
+            except Exception as e:
+                print(f"{name:>8}: unavailable ({e})")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
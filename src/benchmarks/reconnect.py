@@ -0,0 +1,144 @@
+"""
+N64 Converter
+benchmarks/reconnect.py
+Copyright 2020 Riley Lannon
+
+Exercises the connection supervisor against a fake board on a pseudo-terminal.
+The fake board streams packets with A held down; it is then "unplugged" (its pty is closed) and plugged back in
+on a new pty. The harness checks that the held key was released during the outage, that packets resume afterwards,
+and reports the reconnect latency. Exits non-zero on failure. Linux/macOS only.
+"""
+
+import argparse
+import os
+import sys
+import threading
+from time import monotonic, sleep
+
+import serial
+
+import comm
+import serial_packet
+
+
+class FakeBoard:
+    """ Streams v2 packets into a pseudo-terminal, as an Arduino would """
+
+    def __init__(self, rate):
+        self.period = 1 / rate
+        self.buttons = serial_packet.Buttons(mask=1 << serial_packet.BUTTON_NAMES.index("a"))
+        self.plugged = threading.Event()
+        self.master = None
+        self.port = None
+        self._running = True
+        self._sequence = 0
+        threading.Thread(target=self._stream, daemon=True).start()
+
+    def plug(self):
+        """ Connects the board on a new pty """
+        master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.master = master
+        self.plugged.set()
+
+    def unplug(self):
+        """ Disconnects the board; reads on the other end fail """
+        self.plugged.clear()
+        master, self.master = self.master, None
+        os.close(master)
+        os.close(self._slave)
+
+    def stop(self):
+        self._running = False
+
+    def _stream(self):
+        while self._running:
+            master = self.master
+            if master is not None:
+                body = bytes([self._sequence & 0xFF, self.buttons.mask & 0xFF, self.buttons.mask >> 8, 0, 0])
+                try:
+                    os.write(master, serial_packet.SerialPacket.V2_MAGIC_NUMBER + body + bytes([serial_packet.crc8(body)]))
+                except OSError:
+                    pass
+                self._sequence += 1
+            sleep(self.period)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test reconnection against a pty-based fake board")
+    parser.add_argument("--rate", type=int, default=200, help="The packets/sec sent by the fake board")
+    parser.add_argument("--outage", type=float, default=0.5, help="How long the board stays unplugged, in seconds")
+    parser.add_argument("--cycles", type=int, default=3, help="The number of unplug/replug cycles")
+    args = parser.parse_args()
+
+    board = FakeBoard(args.rate)
+    board.plug()
+
+    def connect():
+        board.plugged.wait()
+        return serial.Serial(board.port, timeout=3)
+
+    # a backend that records the keys it holds and the packets it sees
+    # packets are counted here rather than in update_mouse, since moves of a stick at rest are never sent
+    held = set()
+    events = []
+    packets = []
+
+    def update_keys(pressed_buttons, packet, config):
+        packets.append(monotonic())
+        changed = pressed_buttons.mask ^ packet.mask
+        for bit in range(14):
+            if changed & (1 << bit):
+                key = config[serial_packet.PACKET_INDICES[bit]]
+                if packet.mask & (1 << bit):
+                    held.add(key)
+                else:
+                    held.discard(key)
+                events.append((monotonic(), key, bool(packet.mask & (1 << bit))))
+
+    def update_mouse(buttons, use_absolute, base_pos):
+        pass
+
+    stop = threading.Event()
+    config = [str(i) for i in range(16)]
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(comm.drive(connect, config, update_keys, update_mouse, stop=stop)),
+        daemon=True
+    )
+    thread.start()
+
+    failures = []
+    resume_latencies = []
+    a_key = config[serial_packet.PACKET_INDICES[serial_packet.BUTTON_NAMES.index("a")]]
+    for cycle in range(args.cycles):
+        sleep(0.5)
+        if a_key not in held:
+            failures.append(f"cycle {cycle}: A was not held before unplugging")
+
+        board.unplug()
+        sleep(args.outage)
+        if a_key in held:
+            failures.append(f"cycle {cycle}: A was still held while unplugged")
+
+        count = len(packets)
+        plugged = monotonic()
+        board.plug()
+        sleep(0.5)
+        if len(packets) == count:
+            failures.append(f"cycle {cycle}: no packets after replugging")
+        else:
+            resume_latencies.append(packets[count] - plugged)
+
+    stop.set()
+    thread.join(timeout=3)
+    board.stop()
+
+    print()
+    print(f"Reconnects: {result.get('reconnects')}")
+    if resume_latencies:
+        print(f"Replug to first packet: mean {sum(resume_latencies) / len(resume_latencies) * 1000:.1f} ms, max {max(resume_latencies) * 1000:.1f} ms")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures or result.get("reconnects") != args.cycles else 0)
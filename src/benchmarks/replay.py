@@ -0,0 +1,125 @@
+"""
+N64 Converter
+benchmarks/replay.py
+Copyright 2020 Riley Lannon
+
+Replays a recorded session (see session_log.py) through read_packet and the decoding path, with output going
+to a null or counting sink instead of the keyboard and mouse, so throughput and latency can be measured
+repeatably without a controller attached.
+Record a session with `n64.py --record session.log`, or synthesize one with --synthesize.
+"""
+
+import argparse
+import random
+import sys
+from time import perf_counter
+
+import serial
+
+import comm
+import frame_parser
+import mouse_pos
+import serial_packet
+import session_log
+from benchmarks.decode import synthetic_frame_v2
+
+
+class CountingSink:
+    """ Stands in for an output backend, counting what it would have done """
+
+    def __init__(self):
+        self.key_events = 0
+        self.mouse_moves = 0
+
+    def update_keys(self, pressed_buttons, packet, config):
+        changed = pressed_buttons.mask ^ packet.mask
+        while changed:
+            changed &= changed - 1
+            self.key_events += 1
+
+    def update_mouse(self, incoming, use_absolute=False, base_pos=(0, 0)):
+        x, y = mouse_pos.get_mouse_pos(incoming.x_axis, incoming.y_axis)
+        if x or y:
+            self.mouse_moves += 1
+
+
+class NullSink:
+    """ Stands in for an output backend, doing nothing """
+
+    def update_keys(self, pressed_buttons, packet, config):
+        pass
+
+    def update_mouse(self, incoming, use_absolute=False, base_pos=(0, 0)):
+        pass
+
+
+def synthesize(path, count, rate, seed=0):
+    """ Writes a session log of count synthetic v2 frames, arriving rate times per second """
+    rng = random.Random(seed)
+    writer = session_log.SessionWriter(path)
+    for sequence in range(count):
+        writer.write(synthetic_frame_v2(rng, sequence), sequence / rate)
+    writer.close()
+
+
+def replay(records, sink, realtime=False):
+    """ Feeds a recording through read_packet and the sink, as the driver loop would
+
+        :returns:
+            A tuple of the number of packets handled, the total time, the per-packet latencies in seconds,
+            and the parser
+    """
+    con = session_log.ReplayConnection(records, realtime)
+    parser = frame_parser.FrameParser()
+    pressed_buttons = serial_packet.Buttons()
+    enabled = True
+    packets = 0
+    latencies = []
+
+    start = perf_counter()
+    while True:
+        began = perf_counter()
+        try:
+            packet, enabled = comm.read_packet(con, enabled, parser)
+        except serial.SerialException:
+            break
+        packets += 1
+        if enabled:
+            sink.update_keys(pressed_buttons, packet.buttons, None)
+            pressed_buttons.copy_from(packet.buttons)
+            sink.update_mouse(packet.buttons)
+        if not realtime:
+            # in real time, most of the wait is for the data to "arrive"
+            latencies.append(perf_counter() - began)
+    return packets, perf_counter() - start, latencies, parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded serial session through the decoding path")
+    parser.add_argument("log", type=str, help="The session log to replay")
+    parser.add_argument("--synthesize", type=int, metavar="FRAMES", help="First write a synthetic log of this many frames")
+    parser.add_argument("--rate", type=int, default=1000, help="With --synthesize, the packets/sec of the synthetic log")
+    parser.add_argument("--realtime", action="store_true", help="Replay at the recorded pace, rather than maximum speed")
+    parser.add_argument("--sink", choices=("null", "counting"), default="counting", help="Where the output goes")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.log, args.synthesize, args.rate)
+
+    records = session_log.read_log(args.log)
+    sink = CountingSink() if args.sink == "counting" else NullSink()
+    packets, elapsed, latencies, frames = replay(records, sink, args.realtime)
+
+    print(f"Replayed {len(records)} reads, {packets} packets in {elapsed:.3f} s ({packets / max(elapsed, 1e-9):.0f} packets/sec)")
+    if latencies:
+        latencies.sort()
+        count = len(latencies)
+        print(
+            f"Per-packet: p50 {latencies[count // 2] * 1e6:.1f} us, "
+            f"p99 {latencies[min(count - 1, int(count * 0.99))] * 1e6:.1f} us, max {latencies[-1] * 1e6:.1f} us"
+        )
+    print("Parser:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in frames.stats().items()))
+    if isinstance(sink, CountingSink):
+        print(f"Key events: {sink.key_events}, mouse moves: {sink.mouse_moves}")
+    if packets == 0:
+        sys.exit(1)
@@ -0,0 +1,186 @@
+"""
+N64 Converter
+benchmarks/stick_trace.py
+Copyright 2020 Riley Lannon
+
+Runs stick traces through the adaptive stick filter (see stick_filter.py) at several settings, and reports how
+many mouse events each setting emits, along with the latency it adds.
+A trace is taken from a recorded session (see session_log.py), or synthesized: a centered stick with sensor jitter,
+broken up by flicks to the edge and slow sweeps.
+
+The added latency is measured once per flick: the time from the raw stick leaving the center (passing
+FLICK_THRESHOLD) to the filtered stick doing the same. The synthetic sweeps stay inside the threshold, so only flicks
+are measured.
+"""
+
+import argparse
+import math
+import random
+from time import perf_counter
+
+import frame_parser
+import mouse_pos
+import session_log
+import stick_filter
+
+# The filter settings compared by default, as (min_cutoff, beta)
+SETTINGS = ((0.5, 0.01), (1.0, 0.05), (2.0, 0.1), (5.0, 0.2))
+
+# The stick travel (from center) that marks a flick
+FLICK_THRESHOLD = 40
+
+# How far the synthetic slow sweeps travel; kept inside FLICK_THRESHOLD so they aren't measured as flicks
+SWEEP_AMPLITUDE = 35
+
+
+def synthetic_trace(seconds, rate, seed=0):
+    """ Generates a stick trace
+
+        :param seconds:
+            The length of the trace
+
+        :param rate:
+            The packets per second
+
+        :returns:
+            A list of (timestamp in seconds, x, y) tuples
+    """
+    rng = random.Random(seed)
+    trace = []
+    count = int(seconds * rate)
+    n = 0
+    while n < count:
+        # a stretch of rest, where the stick sits at center and jitters
+        for _ in range(int(rng.uniform(0.3, 1.0) * rate)):
+            trace.append((n / rate, round(rng.gauss(0, 0.7)), round(rng.gauss(0, 0.7))))
+            n += 1
+
+        if rng.random() < 0.5:
+            # a flick: straight to the edge, held briefly, then released
+            angle = rng.uniform(0, 2 * math.pi)
+            held = int(rng.uniform(0.1, 0.3) * rate)
+            for i in range(held):
+                reach = min(1.0, (i + 1) / max(1, int(0.02 * rate)))
+                trace.append((n / rate, round(80 * reach * math.cos(angle)), round(80 * reach * math.sin(angle))))
+                n += 1
+        else:
+            # a slow sweep, short of the flick threshold
+            length = int(rng.uniform(0.5, 1.5) * rate)
+            for i in range(length):
+                phase = math.pi * i / length
+                trace.append((n / rate, round(SWEEP_AMPLITUDE * math.sin(phase)) + round(rng.gauss(0, 0.7)), round(rng.gauss(0, 0.7))))
+                n += 1
+    return trace[:count]
+
+
+def recorded_trace(path):
+    """ Extracts the stick trace from a session log
+
+        :returns:
+            A list of (timestamp in seconds, x, y) tuples, one per packet
+    """
+    parser = frame_parser.FrameParser()
+    trace = []
+    for timestamp, data in session_log.read_log(path):
+        for packet in parser.feed(data):
+            trace.append((timestamp, packet.buttons.x_axis, packet.buttons.y_axis))
+    return trace
+
+
+def count_events(positions, use_absolute):
+    """ Counts the mouse events the positions would produce, skipping those that wouldn't move the mouse """
+    events = 0
+    last_target = None
+    for x, y in positions:
+        if use_absolute:
+            target = mouse_pos.get_absolute_pos(x, y, (0, 0))
+            if target != last_target:
+                events += 1
+                last_target = target
+        elif mouse_pos.get_mouse_pos(x, y) != (0, 0):
+            events += 1
+    return events
+
+
+def flick_lags(trace, positions):
+    """ Measures how long the filtered positions take to follow each flick
+
+        Each flick is measured once, from the raw stick crossing the threshold; the next flick only starts after
+        the raw stick comes back inside it. A flick the filtered stick never follows isn't counted
+
+        :returns:
+            A list of the lags, in seconds
+    """
+    lags = []
+    onset = None
+    armed = True
+    for (timestamp, x, y), (filtered_x, filtered_y) in zip(trace, positions):
+        raw_out = math.hypot(x, y) > FLICK_THRESHOLD
+        if not raw_out:
+            # the flick is over, whether or not the filtered stick followed it
+            armed = True
+            onset = None
+            continue
+
+        if armed:
+            onset = timestamp
+            armed = False
+        if onset is not None and math.hypot(filtered_x, filtered_y) > FLICK_THRESHOLD:
+            lags.append(timestamp - onset)
+            onset = None
+    return lags
+
+
+def evaluate(trace, setting, use_absolute):
+    """ Runs a trace through the filter with a setting
+
+        :param setting:
+            A (min_cutoff, beta) pair, or None for no filter
+
+        :returns:
+            A tuple of the events emitted, the flick lags in seconds, and the filter's cost per packet in seconds
+    """
+    if setting is None:
+        positions = [(x, y) for _, x, y in trace]
+        cost = 0.0
+    else:
+        stick = stick_filter.StickFilter(*setting)
+        start = perf_counter()
+        positions = [stick.filter(x, y, timestamp) for timestamp, x, y in trace]
+        cost = (perf_counter() - start) / max(1, len(trace))
+    return count_events(positions, use_absolute), flick_lags(trace, positions), cost
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare mouse events and latency across stick filter settings")
+    parser.add_argument("logs", type=str, nargs="*", help="Session logs to take the stick traces from (default: synthetic)")
+    parser.add_argument("--seconds", type=float, default=60, help="The length of the synthetic trace")
+    parser.add_argument("--rate", type=int, default=500, help="The packets/sec of the synthetic trace")
+    parser.add_argument("--absolute", action="store_true", help="Count events as absolute mode would")
+    parser.add_argument(
+        "--setting",
+        type=float,
+        nargs=2,
+        action="append",
+        metavar=("MIN_CUTOFF", "BETA"),
+        help="A filter setting to compare; may be given more than once (default: a range of settings)"
+    )
+    args = parser.parse_args()
+
+    traces = [(path, recorded_trace(path)) for path in args.logs]
+    if not traces:
+        traces = [("synthetic", synthetic_trace(args.seconds, args.rate))]
+
+    for name, trace in traces:
+        print(f"{name}: {len(trace)} packets")
+        raw_events = None
+        for setting in [None] + [tuple(s) for s in (args.setting or SETTINGS)]:
+            events, lags, cost = evaluate(trace, setting, args.absolute)
+            if raw_events is None:
+                raw_events = events
+            label = "unfiltered" if setting is None else f"min_cutoff {setting[0]:g}, beta {setting[1]:g}"
+            lag = f"lag mean {sum(lags) / len(lags) * 1000:.2f} ms, max {max(lags) * 1000:.1f} ms" if lags else "no flicks"
+            print(
+                f"  {label:28} {events:>7} events ({events / max(1, raw_events):6.1%}), {lag}, "
+                f"{cost * 1e6:.1f} us/packet"
+            )
@@ -0,0 +1,350 @@
+"""
+N64 Converter
+benchmarks/suite.py
+Copyright 2020 Riley Lannon
+
+A benchmark suite for the hot paths: packet decoding, button state, key diffing, stick conversion,
+configuration loading, and publishing the shared controller state. Everything runs on synthetic frames, and the output backends are mocked so no
+keys or mouse movements are actually sent, so the suite runs headless on any platform.
+
+Results can be saved as a JSON baseline, and later runs compared against it:
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --compare baseline.json --threshold 0.1
+A comparison exits non-zero if any benchmark is slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import types
+from time import perf_counter
+from unittest import mock
+
+import controller_config
+import dispatch
+import mouse_pos
+import serial_packet
+import shared_state
+from benchmarks.decode import synthetic_frame, synthetic_frame_v2
+
+# The number of distinct synthetic inputs each benchmark cycles through
+SAMPLES = 1000
+
+# The default configuration files, next to the scripts
+CONFIG_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frames_v1(rng):
+    return [synthetic_frame(rng) for _ in range(SAMPLES)]
+
+
+def _frames_v2(rng):
+    return [synthetic_frame_v2(rng, sequence) for sequence in range(SAMPLES)]
+
+
+def _button_states(rng):
+    """ Builds decoded Buttons with random presses, most changing only a button or two from the last """
+    states = []
+    mask = 0
+    for _ in range(SAMPLES):
+        # flip a few bits at a time, as real play does
+        for _ in range(rng.randint(0, 3)):
+            mask ^= 1 << rng.randrange(len(serial_packet.BUTTON_NAMES))
+        states.append(serial_packet.Buttons(mask, rng.randint(-128, 127), rng.randint(-128, 127)))
+    return states
+
+
+def _fake_windows_modules():
+    """ Builds stand-ins for pydirectinput and pywin32, which only exist on Windows """
+    mapping = {chr(ord("a") + i): 0x10 + i for i in range(26)}
+    pydirectinput = types.SimpleNamespace(FAILSAFE=True, KEYBOARD_MAPPING=mapping, keyDown=lambda key: None, keyUp=lambda key: None)
+    win32api = types.SimpleNamespace(mouse_event=lambda *args: None)
+    win32con = types.SimpleNamespace(MOUSEEVENTF_MOVE=0x0001, MOUSEEVENTF_ABSOLUTE=0x8000)
+    return {"pydirectinput": pydirectinput, "win32api": win32api, "win32con": win32con}
+
+
+def _load_backend(name):
+    """ Imports an output backend with its output mocked out
+
+        :returns:
+            The backend module, or None if it can't be loaded here
+    """
+    if name == "linux_functions":
+        import linux_functions
+        linux_functions.subprocess = types.SimpleNamespace(call=lambda args: 0)
+        return linux_functions
+
+    if name == "win_functions":
+        with mock.patch.dict(sys.modules, _fake_windows_modules()):
+            sys.modules.pop("win_functions", None)
+            win_functions = importlib.import_module("win_functions")
+        win_functions._send_input = lambda inputs, count: None
+        return win_functions
+
+    if name == "uinput_functions":
+        try:
+            import uinput_functions
+        except ImportError:
+            return None
+        uinput_functions.get_device = lambda: types.SimpleNamespace(write=lambda *args: None, syn=lambda: None)
+        return uinput_functions
+
+    if name == "gamepad_functions":
+        try:
+            import gamepad_functions
+        except ImportError:
+            return None
+        gamepad_functions.get_device = lambda: types.SimpleNamespace(write=lambda *args: None, syn=lambda: None)
+        return gamepad_functions
+
+    return None
+
+
+# Each benchmark takes a random.Random and returns a function that runs one pass, along with the operations per pass
+
+def bench_serial_packet_update_v1(rng):
+    frames = _frames_v1(rng)
+    packet = serial_packet.SerialPacket()
+
+    def run():
+        for frame in frames:
+            packet.update(frame)
+    return run, len(frames)
+
+
+def bench_serial_packet_update_v2(rng):
+    frames = _frames_v2(rng)
+    packet = serial_packet.SerialPacket()
+
+    def run():
+        for frame in frames:
+            packet.update(frame)
+    return run, len(frames)
+
+
+def bench_buttons_update(rng):
+    values = [list(state) for state in _button_states(rng)]
+    buttons = serial_packet.Buttons()
+
+    def run():
+        for value in values:
+            buttons.update(value)
+    return run, len(values)
+
+
+def bench_buttons_iter(rng):
+    states = _button_states(rng)
+
+    def run():
+        for state in states:
+            list(state)
+    return run, len(states)
+
+
+def _bench_update_keys(backend_name):
+    def bench(rng):
+        backend = _load_backend(backend_name)
+        if backend is None:
+            return None
+        states = _button_states(rng)
+        keys = getattr(backend, "DEFAULT_CONFIG", [chr(ord("a") + i) for i in range(16)])
+        config = dispatch.compile_table(keys, backend.resolve_key)
+        pressed = serial_packet.Buttons()
+
+        def run():
+            for state in states:
+                backend.update_keys(pressed, state, config)
+                pressed.copy_from(state)
+        return run, len(states)
+    return bench
+
+
+bench_update_keys_xdotool = _bench_update_keys("linux_functions")
+bench_update_keys_windows = _bench_update_keys("win_functions")
+bench_update_keys_uinput = _bench_update_keys("uinput_functions")
+bench_update_keys_gamepad = _bench_update_keys("gamepad_functions")
+
+
+def bench_get_mouse_pos(rng):
+    positions = [(rng.randint(-128, 127), rng.randint(-128, 127)) for _ in range(SAMPLES)]
+
+    def run():
+        for x, y in positions:
+            mouse_pos.get_mouse_pos(x, y)
+    return run, len(positions)
+
+
+def bench_get_absolute_pos(rng):
+    positions = [(rng.randint(-128, 127), rng.randint(-128, 127)) for _ in range(SAMPLES)]
+    base_pos = (960, 540)
+
+    def run():
+        for x, y in positions:
+            mouse_pos.get_absolute_pos(x, y, base_pos)
+    return run, len(positions)
+
+
+def bench_config_load(rng):
+    path = os.path.join(CONFIG_DIRECTORY, "mupen64plus.cfg")
+
+    def run():
+        controller_config.Configuration(path).__list__()
+    return run, 1
+
+
+def bench_config_load_radial_curve(rng):
+    with open(os.path.join(CONFIG_DIRECTORY, "mupen64plus.cfg")) as f:
+        data = json.load(f)
+    data["CURVE"] = {"deadzone": 4, "radial": True, "exponent": 1.5}
+    handle, path = tempfile.mkstemp(suffix=".cfg")
+    with os.fdopen(handle, "w") as f:
+        json.dump(data, f)
+
+    def run():
+        controller_config.Configuration(path)
+    return run, 1, lambda: os.unlink(path)
+
+
+def bench_shared_state_publish(rng):
+    states = _button_states(rng)
+    handle, path = tempfile.mkstemp(suffix=".state")
+    os.close(handle)
+    publisher = shared_state.StatePublisher(path)
+
+    def run():
+        for state in states:
+            publisher.publish(state)
+
+    def cleanup():
+        publisher.close()
+        os.unlink(path)
+    return run, len(states), cleanup
+
+
+def bench_shared_state_read(rng):
+    handle, path = tempfile.mkstemp(suffix=".state")
+    os.close(handle)
+    publisher = shared_state.StatePublisher(path)
+    publisher.publish(serial_packet.Buttons(1, 2, 3))
+    reader = shared_state.StateReader(path)
+
+    def run():
+        for _ in range(SAMPLES):
+            reader.read()
+
+    def cleanup():
+        reader.close()
+        publisher.close()
+        os.unlink(path)
+    return run, SAMPLES, cleanup
+
+
+BENCHMARKS = {
+    name[len("bench_"):]: function for name, function in globals().items() if name.startswith("bench_")
+}
+
+
+def measure(benchmark, repeat, min_time):
+    """ Runs a benchmark, repeating each pass until it takes at least min_time
+
+        A benchmark returns (run, operations), with a third element if it has anything to clean up afterwards
+        (e.g. temporary files), or None if it can't run here
+
+        :returns:
+            The best operations per second over repeat runs, or None if the benchmark can't run here
+    """
+    setup = benchmark(random.Random(0))
+    if setup is None:
+        return None
+    run, operations = setup[:2]
+    try:
+        return _time(run, operations, repeat, min_time)
+    finally:
+        if len(setup) > 2:
+            setup[2]()
+
+
+def _time(run, operations, repeat, min_time):
+    """ Times a benchmark's run function, returning the best operations per second """
+    # find how many passes make a long enough run to time reliably
+    passes = 1
+    while True:
+        start = perf_counter()
+        for _ in range(passes):
+            run()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time:
+            break
+        passes *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = perf_counter()
+        for _ in range(passes):
+            run()
+        best = min(best, perf_counter() - start)
+    return operations * passes / best
+
+
+def compare(results, baseline, threshold):
+    """ Compares results against a baseline
+
+        :returns:
+            The names of the benchmarks that regressed by more than the threshold
+    """
+    regressions = []
+    for name, rate in results.items():
+        previous = baseline.get(name)
+        if rate is None or not previous:
+            continue
+        change = rate / previous - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:32} {previous:>14,.0f} -> {rate:>14,.0f} ops/sec ({change:+.1%}){flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the decode, diff and injection hot paths")
+    parser.add_argument("-k", "--filter", type=str, default="", help="Only run benchmarks whose names contain this")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="The number of timed runs; the best is kept")
+    parser.add_argument("--min-time", type=float, default=0.05, help="The least time each timed run takes, in seconds")
+    parser.add_argument("-o", "--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=str, metavar="BASELINE", help="Compare against a JSON file of earlier results")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The slowdown counted as a regression (default 0.1, 10%%)")
+    args = parser.parse_args()
+
+    results = {}
+    for name, benchmark in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(benchmark, args.repeat, args.min_time)
+        if results[name] is None:
+            print(f"{name:32} skipped (not available here)")
+        elif not args.compare:
+            print(f"{name:32} {results[name]:>14,.0f} ops/sec")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "benchmarks": {name: rate for name, rate in results.items() if rate is not None},
+            }, f, indent=4)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["benchmarks"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions.")
@@ -0,0 +1,133 @@
+"""
+N64 Converter
+benchmarks/udp_loopback.py
+Copyright 2020 Riley Lannon
+
+Runs the network sender and receiver (see network.py) against each other over loopback, with a simulated board
+on a pseudo-terminal, so no controller, second machine or real network is needed.
+A relay between them can drop and reorder datagrams, to check that the receiver's loss and reordering counts
+match what was done to the stream. The receiver's output goes to a counting sink.
+
+Pseudo-terminals are only available on Linux and macOS.
+"""
+
+import argparse
+import random
+import select
+import socket
+import threading
+from time import sleep
+
+import serial
+
+import network
+from benchmarks.reconnect import FakeBoard
+from benchmarks.replay import CountingSink
+
+
+class LossyRelay(threading.Thread):
+    """ Forwards datagrams from the sender to the receiver, dropping and reordering some, and passes reports back """
+
+    def __init__(self, target, loss=0.0, reorder=0.0, seed=0):
+        """ Binds the relay to a free loopback port; call start() to begin relaying
+
+            :param target:
+                The receiver's (host, port)
+
+            :param loss:
+                The fraction of states to drop
+
+            :param reorder:
+                The fraction of states to hold back and send after the next one
+        """
+        super().__init__(name="LossyRelay", daemon=True)
+        self.target = target
+        self.loss = loss
+        self.reorder = reorder
+        self.rng = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+
+        # what was done to the stream
+        self.forwarded = 0
+        self.dropped = 0
+        self.reordered = 0
+
+        self._sender = None
+        self._held = None
+        self._running = True
+
+    def run(self):
+        while self._running:
+            if not select.select([self.sock], [], [], 0.1)[0]:
+                continue
+            data, address = self.sock.recvfrom(64)
+            if address == self.target:
+                if self._sender is not None:
+                    self.sock.sendto(data, self._sender)
+                continue
+
+            self._sender = address
+            if self.rng.random() < self.loss:
+                self.dropped += 1
+                continue
+            if self._held is None and self.rng.random() < self.reorder:
+                self._held = data
+                continue
+
+            self.sock.sendto(data, self.target)
+            self.forwarded += 1
+            if self._held is not None:
+                # the held state goes out after a newer one
+                self.sock.sendto(self._held, self.target)
+                self.forwarded += 1
+                self.reordered += 1
+                self._held = None
+
+    def stop(self):
+        self._running = False
+        self.join(timeout=1)
+        self.sock.close()
+
+
+def free_port():
+    """ Finds a free UDP port on loopback """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a simulated board over loopback UDP, through a lossy relay")
+    parser.add_argument("--seconds", type=float, default=3, help="How long to stream for")
+    parser.add_argument("--rate", type=int, default=500, help="The simulated board's packets/sec")
+    parser.add_argument("--loss", type=float, default=0.0, help="The fraction of datagrams the relay drops")
+    parser.add_argument("--reorder", type=float, default=0.0, help="The fraction of datagrams the relay delivers late")
+    args = parser.parse_args()
+
+    board = FakeBoard(args.rate)
+    board.plug()
+
+    port = free_port()
+    relay = LossyRelay(("127.0.0.1", port), args.loss, args.reorder)
+    relay.start()
+
+    stop = threading.Event()
+    reports = []
+    sender = threading.Thread(
+        target=lambda: reports.append(network.send(lambda: serial.Serial(board.port, timeout=3), relay.address, stop)),
+        daemon=True
+    )
+
+    # the sender starts once the receiver is listening, and stops before it so nothing is left in flight
+    sink = CountingSink()
+    threading.Timer(0.2, sender.start).start()
+    threading.Timer(args.seconds, stop.set).start()
+    stream_stats = network.receive(None, sink.update_keys, sink.update_mouse, port, host="127.0.0.1", stop=stop)
+    sender.join(timeout=2)
+    relay.stop()
+    board.stop()
+
+    print(f"Relay: forwarded {relay.forwarded}, dropped {relay.dropped}, reordered {relay.reordered}")
+    print(f"Receiver counted: lost {stream_stats.lost}, reordered {stream_stats.reordered}")
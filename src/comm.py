@@ -11,230 +11,508 @@ This will take the signals generated by the arduino (sent over serial) and conve
 
 # libraries
 import serial
-import serial.tools.list_ports
-import sys
-import glob
+import json
+import signal
 import threading
-from time import sleep
+from time import monotonic, perf_counter
 
 # todo: the windows and linux modules can actually be condensed because the only difference
 ## between them is the drive functtion
 
 # custom modules
 import serial_packet
+import supervisor
+import frame_parser
+import output_worker
+import mouse_output
+import discovery
+import motion
 import mouse_pos
+import session_log
+import shared_state
 
-def serial_ports():
-    """ Lists serial port names
+# The rate the Arduino sketch starts at (SERIAL_BAUD in arduino.ino); baud negotiation always begins here
+DEFAULT_BAUD = 9600
+
+# The bytes that begin the Arduino's acknowledgement of a baud rate change; the new rate follows as 4 bytes, little-endian
+BAUD_ACK = b"\x23\xBA"
+
+# The parser used by read_packet when one isn't supplied
+_default_parser = frame_parser.FrameParser()
+
+
+def update_enabled(con, packet, enabled):
+    """ Checks a packet for the enable/disable key combos
+
+        The controller is disabled with L+R+Z+D_DOWN+C_DOWN, as that's a very unusual/uncomfortable position,
+        and re-enabled with the start button
+
+        :param con:
+            The serial connection (or anything with a write method), used to tell the Arduino to update its LEDs
+
+        :param packet:
+            The incoming packet
+
+        :param enabled:
+            Whether the controller is currently enabled
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
         :returns:
-            A list of the serial ports available on the system
+            Whether the controller is enabled after this packet
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+    if enabled and (packet.buttons.l and packet.buttons.r and packet.buttons.z and packet.buttons.d_down and packet.buttons.c_down):
+        enabled = False
+        # send a byte to the arduino (to control LED)
+        con.write(b'd')
+    elif (not enabled) and packet.buttons.start:
+        enabled = True
+        # send a byte to the arduino (to control LED)
+        con.write(b'r')
+    return enabled
+
+
+def negotiate_baud(con, baud, timeout=3):
+    """ Asks the Arduino to switch to a new baud rate, and switches the connection once it agrees
 
+        The request is 'b' followed by the rate as 4 bytes, little-endian. The Arduino echoes the rate after BAUD_ACK,
+        waits for its output to drain, and then switches. Since opening the port resets most boards, the request is
+        only sent once the sketch is up (when its packets start arriving), and then we wait for the answer.
 
-def read_packet(con, enabled):
+        :param con:
+            The serial connection, open at the Arduino's current rate
+
+        :param baud:
+            The rate to switch to
+
+        :param timeout:
+            How long to keep trying, in seconds
+
+        :returns:
+            Whether the Arduino agreed to the new rate
+    """
+    if con.baudrate == baud:
+        return True
+
+    ack = BAUD_ACK + baud.to_bytes(4, "little")
+    deadline = monotonic() + timeout
+
+    # wait for the sketch to start sending, so it's there to hear the request
+    while not con.read(max(1, con.in_waiting)):
+        if monotonic() >= deadline:
+            return False
+
+    # a request already on its way is never repeated; a second one could arrive after the switch, at the wrong rate
+    con.write(b"b" + baud.to_bytes(4, "little"))
+    con.flush()
+
+    # watch the incoming data (which is likely full of packets) for the acknowledgement
+    received = bytearray()
+    while monotonic() < deadline:
+        received += con.read(max(1, con.in_waiting))
+        if ack in received:
+            con.baudrate = baud
+            con.reset_input_buffer()
+            return True
+        # we only need enough history to catch an acknowledgement split across reads
+        del received[:-len(ack)]
+
+    return False
+
+
+def read_packet(con, enabled, parser=None):
     """ Reads a single packet from the serial connection
 
+        Bytes are fed through a FrameParser, so if the data is misaligned or corrupted,
+        we pick back up at the next valid frame rather than stalling to hunt for the magic number
+
         :param con:
             The serial connection
-        
-        :param packet:
-            The incoming packet
 
         :param enabled:
             Whether the controller is enabled
+
+        :param parser:
+            The FrameParser holding any partial frame from previous reads; uses a shared parser if not given
         
         :returns:
             A tuple containing:
-              * the SerialPacket object
+              * the SerialPacket object (empty if no valid packet arrived before the read timed out)
               * whether the controller is enabled
     """
+    if parser is None:
+        parser = _default_parser
 
-    # update our packet information
-    data = con.read(serial_packet.SerialPacket.size());
-    packet = serial_packet.SerialPacket()
-    try:
-        packet.update(data)
-        if enabled and (packet.buttons.l and packet.buttons.r and packet.buttons.z and packet.buttons.d_down and packet.buttons.c_down):
-            enabled = False
-            # send a byte to the arduino (to control LED)
-            con.write(b'd')
-        elif (not enabled) and packet.buttons.start:
-            enabled = True
-            # send a byte to the arduino (to control LED)
-            con.write(b'r')
-    except Exception as e:
-        # If we encountered a data error, reset our input buffer
-        print("An error occurred:", e)
-        fixed = False
-        while not fixed:
-            # check for a magic number, one byte at a time
-            # reading one at a time prevents us from being stuck in a loop where we are one byte off
-            val = con.read(1)
-            if val == b'\x23':
-                val = con.read(1)
-                if val == b'\xC0':
-                    print("Data realigned")
-                    fixed = True
-                    # Ignore the rest of the data in the block and start fresh with the next one
-                    val = con.read(serial_packet.SerialPacket.size() - serial_packet.SerialPacket.magic_number_size())
-    
+    # read until we have a full packet, taking everything that is already waiting
+    packets = []
+    while not packets:
+        data = con.read(max(con.in_waiting, 1))
+        if not data:
+            return (serial_packet.SerialPacket(), enabled)
+        packets = parser.feed(data)
+
+    # only the newest packet matters
+    packet = packets[-1]
+    enabled = update_enabled(con, packet, enabled)
     return (packet, enabled)
 
 
-def run(config: list, update_keys, update_mouse, board_id: str, use_absolute: bool= False):
-    """ The main function, containing the actual driver loop
+def open_connection(board_id: str, baud: int = DEFAULT_BAUD, negotiate: bool = False):
+    """ Finds the Arduino and opens a serial connection to it
 
-        :param config:
-            The controller configuration, expressed as a Configuration object
-    """
+        :param board_id:
+            The board's VID:PID, as in n64.py's vid_pid table
 
-    # todo: this continues to poll, but requires sleep(1) to get all ports
-    # # why exactly is 1 the magic number? And is there a better way to do this?
+        :param baud:
+            The serial baud rate
 
-    # we must first connect to the Arduino via serial
-    # view which connections are available
-    listed_ports = list(serial.tools.list_ports.comports())
-    
-    # now, get one with an arduino connected to it
+        :param negotiate:
+            Whether to connect at DEFAULT_BAUD and ask the Arduino to switch to baud,
+            rather than assuming the sketch was built for it
+
+        :returns:
+            The open serial connection
+    """
+    # we must first find the Arduino; this waits (without polling) until it is connected
     print("Searching for Arduino...")
-    waited = False  # we will need to wait before we call serial_ports if we connect while the program is running
-    arduino_port = ""
-    while arduino_port == "":
-        for port in listed_ports:
-            # Windows systems will report the arduino connected to the port,
-            if "Arduino" in port.__str__():
-                arduino_port = port.__str__()
-                break
-            # But on Linux systems, we may have to look for the board's VID:PID
-            elif board_id in port.hwid:
-                arduino_port = port.__str__()
-                break
-        
-        # if we didn't find a port, update the list
-        if arduino_port == "":
-            waited = True
-            listed_ports = list(serial.tools.list_ports.comports())
-    
-    print("Found Arduino on port ",arduino_port,".",sep="")
+    to_connect_name = discovery.wait_for_port(board_id)
+    print("Found Arduino on port ", to_connect_name, ".", sep="")
     print("Connecting...")
-    
-    # if we had to wait for the user to connect the Arduino, sleep for a second
-    # this is so serial_ports() can connect as a serial port
-    if waited:
-        sleep(1)
-    
-    # get the actual name of the port (such as 'COM5' or 'COM7') that the OS expects
-    all_ports = serial_ports()
-    to_connect_name = ""
-    for port in all_ports:
-        if port in arduino_port:
-            to_connect_name = port
-    if to_connect_name == "":
-        raise Exception(f"Could not find port {port}")
 
     # connect to the serial port
-    conn = serial.Serial(to_connect_name, 9600, timeout=3)
+    conn = serial.Serial(to_connect_name, DEFAULT_BAUD if negotiate else baud, timeout=3)
     if not conn.is_open:
         conn.open()
     print("Connected on port", to_connect_name, ".", sep="")
-    
-    # create the SerialPacket object to contain our incoming data
-    packet = serial_packet.SerialPacket()
 
-    # create an object to store controller data
-    pressed_buttons = serial_packet.Buttons()
+    # agree on a faster rate with the Arduino, if requested
+    if negotiate and baud != DEFAULT_BAUD:
+        if negotiate_baud(conn, baud):
+            print(f"Switched to {baud} baud.")
+        else:
+            print(f"The Arduino did not accept {baud} baud; staying at {DEFAULT_BAUD}.")
 
     # Reset the serial buffers
     conn.reset_input_buffer()
     conn.reset_output_buffer()
 
+    return conn
+
+
+def run(config, update_keys, update_mouse, board_id: str, use_absolute: bool= False, baud: int = DEFAULT_BAUD, negotiate: bool = False,
+        move_mouse=None, mouse_rate: int = 0, mouse_speed: float = motion.DEFAULT_SPEED, record: str = None,
+        probes=None, stats_interval: float = 0, stats_json: str = None, watcher=None, stick_filter=None,
+        publish: str = None):
+    """ The main function, which connects to the Arduino and runs the driver loop
+
+        :param config:
+            The controller configuration, compiled into a dispatch.DispatchTable with the backend's resolve_key
+
+        :param board_id:
+            The board's VID:PID, as in n64.py's vid_pid table
+
+        :param baud:
+            The serial baud rate
+
+        :param negotiate:
+            Whether to connect at DEFAULT_BAUD and ask the Arduino to switch to baud,
+            rather than assuming the sketch was built for it
+
+        :param record:
+            If given, the path of a session log to record the raw serial data into (see session_log.py)
+
+        :param publish:
+            If given, the path of a file to publish the latest controller state into, for other processes to read
+            (see shared_state.py)
+
+        See drive() for the remaining parameters
+    """
+    connect = lambda: open_connection(board_id, baud, negotiate)
+
+    writer = None
+    if record is not None:
+        writer = session_log.SessionWriter(record)
+        print(f"Recording to {record}")
+        open_board = connect
+        connect = lambda: session_log.RecordingConnection(open_board(), writer)
+
+    publisher = None
+    if publish is not None:
+        publisher = shared_state.StatePublisher(publish)
+        print(f"Publishing the controller state to {publish}")
+
+    try:
+        drive(
+            connect, config, update_keys, update_mouse, use_absolute, move_mouse, mouse_rate, mouse_speed,
+            probes=probes, stats_interval=stats_interval, stats_json=stats_json, watcher=watcher,
+            stick_filter=stick_filter, publisher=publisher
+        )
+    finally:
+        if publisher is not None:
+            publisher.close()
+        if writer is not None:
+            writer.close()
+            print(f"Recorded {writer.records} reads to {record}")
+
+
+def drive(connect, config, update_keys, update_mouse, use_absolute: bool = False,
+        move_mouse=None, mouse_rate: int = 0, mouse_speed: float = motion.DEFAULT_SPEED, stop=None,
+        probes=None, stats_interval: float = 0, stats_json: str = None, watcher=None, stick_filter=None,
+        publisher=None):
+    """ The actual driver loop
+
+        If the connection is lost, any held keys are released and the board is reconnected using the same
+        configuration and calibration
+
+        :param connect:
+            A function that finds the board and returns an open serial connection, waiting if necessary
+
+        :param config:
+            The controller configuration, compiled into a dispatch.DispatchTable with the backend's resolve_key
+
+        :param update_keys:
+            The backend's function for updating key presses
+
+        :param update_mouse:
+            The backend's function for updating the mouse, or None if the backend drives the stick itself
+            in update_keys (as the gamepad backend does), in which case there is no mouse stage at all
+
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position
+
+        :param move_mouse:
+            The backend's function for moving the mouse by a relative amount; needed for mouse_rate
+
+        :param mouse_rate:
+            If non-zero (and not in absolute mode), the mouse is moved this many times per second by a MotionScheduler
+            rather than once per packet
+
+        :param mouse_speed:
+            The MotionScheduler speed
+
+        :param stop:
+            A threading.Event that ends the loop when set; otherwise the loop runs until ^C
+
+        :param probes:
+            A stats.Probes to record the latency of each stage into; no timing is done without one
+
+        :param stats_interval:
+            If non-zero (and probes are given), print a line of statistics this often, in seconds
+
+        :param stats_json:
+            If given (along with probes), the path the statistics are written to as JSON on exit and on SIGUSR1;
+            without it, SIGUSR1 prints them instead
+
+        :param watcher:
+            A dispatch.ConfigWatcher whose load function returns a (DispatchTable, StickFilter or None) pair;
+            each configuration it reloads replaces config and stick_filter without restarting
+
+        :param stick_filter:
+            A stick_filter.StickFilter the stick position is passed through before it is output, if any
+
+        :param publisher:
+            A shared_state.StatePublisher each decoded state is published to, if any
+
+        :returns:
+            The connection statistics, as a dictionary
+    """
+
+    # create an object to store controller data
+    pressed_buttons = serial_packet.Buttons()
+
+    # reloaded configurations wait here until the key worker (for the table) and the main loop (for the
+    # stick filter) pick them up
+    reloaded = []
+    refiltered = []
+
+    def on_reload(loaded):
+        table, new_filter = loaded
+        reloaded.append(table)
+        refiltered.append(new_filter)
+
+    # drive the keyboard and mouse from persistent worker threads
+    # in order to allow combo joystick and button actions, they must be driven simultaneously
+    def drive_keys(buttons, received=None):
+        nonlocal config
+        if reloaded:
+            # swap between packets, releasing everything held under the old configuration first
+            new_config = reloaded.pop()
+            reloaded.clear()
+            update_keys(pressed_buttons, serial_packet.Buttons(), config)
+            pressed_buttons.set_state(0, 0, 0)
+            config = new_config
+
+        if probes is None:
+            update_keys(pressed_buttons, buttons, config)
+            # update the currently pressed buttons
+            pressed_buttons.copy_from(buttons)
+            return
+
+        start = perf_counter()
+        changed = pressed_buttons.mask ^ buttons.mask
+        diffed = perf_counter()
+        update_keys(pressed_buttons, buttons, config)
+        pressed_buttons.copy_from(buttons)
+        done = perf_counter()
+
+        probes.record("diff", diffed - start)
+        if changed:
+            probes.record("keys", done - diffed)
+        if received is not None:
+            probes.record("end_to_end", done - received)
+
+    def timed(function):
+        # wraps a mouse function so its calls are recorded as the mouse stage
+        if probes is None:
+            return function
+
+        def wrapper(*args):
+            start = perf_counter()
+            function(*args)
+            probes.record("mouse", perf_counter() - start)
+        return wrapper
+
+    key_worker = output_worker.OutputWorker(drive_keys, name="KeyWorker")
+    # in relative mode, the mouse may be moved on its own clock
+    scheduler = None
+    if mouse_rate and not use_absolute and update_mouse is not None:
+        scheduler = motion.MotionScheduler(timed(move_mouse), mouse_rate, mouse_speed)
+
+    # otherwise, it follows the packets; moves that do nothing are dropped here, and relative moves are combined
+    # if the backend falls behind
+    mouse_stage = None
+    if update_mouse is not None and scheduler is None:
+        mouse_stage = mouse_output.MouseOutput(timed(update_mouse), timed(move_mouse) if move_mouse else None, use_absolute)
+
+    def release_all():
+        # make sure nothing is left held down while the board is away
+        key_worker.submit(serial_packet.Buttons())
+        key_worker.wait_idle(timeout=1)
+        if mouse_stage is not None:
+            mouse_stage.reset()
+        if scheduler is not None:
+            scheduler.set_stick(0, 0)
+
+    # Connect, and start reading packets on a dedicated thread
+    # it blocks on the serial connection, so we don't burn a core while waiting for data
+    conn = supervisor.ConnectionSupervisor(connect, on_disconnect=release_all, probes=probes)
+    conn.open()
+
+    def dump_stats(*_):
+        if stats_json is not None:
+            probes.dump(stats_json, conn.stats())
+        else:
+            print(json.dumps(probes.snapshot(conn.stats())))
+
+    # statistics can be requested at any time with SIGUSR1 (signals can only be handled on the main thread)
+    previous_handler = None
+    use_signal = probes is not None and hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread()
+    if use_signal:
+        previous_handler = signal.signal(signal.SIGUSR1, dump_stats)
+    next_report = monotonic() + stats_interval
+
     # Calibrate the controller, if necessary
     base_pos = (0, 0)
-    if use_absolute:
+    if use_absolute and mouse_stage is not None:
         print("Move the mouse to a good known zero point and hit start")
         calibrated = False
         while not calibrated:
-            # Read the packet
-            packet = read_packet(conn, True)[0]
-            if (packet.buttons.start):
+            # Wait for the next packet
+            packet = conn.latest(timeout=0.5)
+            if packet is not None and packet.buttons.start:
                 base_pos = mouse_pos.read_current_mouse_position()
                 print(f"Using {base_pos} as base position")
                 calibrated = True
-            continue
+        mouse_stage.base_pos = base_pos
     
     # We are now ready to roll
+    if watcher is not None:
+        watcher.watch(on_reload)
+    key_worker.start()
+    if mouse_stage is not None:
+        mouse_stage.start()
+    if scheduler is not None:
+        scheduler.start()
     print("Ready.")
 
     # allow us to enable and disable the controller from updating with key combos
     # for now, make it L+R+Z+D_DOWN+C_DOWN, as that's a very unusual/uncomfortable position
     # and make the re-enable the start button
     enabled = True
-    
+
     # utilize a sentinel variable for the main loop
     quit = False
 
     # our main program loop -- this will process the arduino's serial data and drive the kbd/mouse
     while not quit:
         try:
-            # set up keyboard and mouse threads
-            # in order to allow combo joystick and button actions, they must be driven simultaneously
-            mouse_thread = threading.Thread(target=update_mouse, args=(packet.buttons, use_absolute, base_pos))
-
-            # wait to read until we have enough data in the buffer (the size of one packet)
-            if conn.in_waiting >= serial_packet.SerialPacket.size():
-                # get the packet
-                # data = conn.read(serial_packet.SerialPacket.size());
-                temp = read_packet(conn, enabled)
-                packet = temp[0]
-                enabled = temp[1]
-
-                # perform our updates
-                try:
-                    # only perform updates if the controller is enabled -- else, ignore the events
-                    if enabled:
-                        # update the keystrokes and current button data
-                        # update_keys(pressed_buttons, packet.buttons, default_config)
-                        # update_mouse_absolute(zero_position, packet.buttons)
-                        
-                        # start the threads
-                        #kbd_thread.start()
-                        mouse_thread.start()
-                        update_keys(pressed_buttons, packet.buttons, config)
-
-                        # wait for the threads to finish
-                        #kbd_thread.join()
-                        mouse_thread.join()
-
-                        # update the list of currently pressed buttons
-                        pressed_buttons.update(list(packet.buttons))
-                except Exception as e:
-                    print("An error occurred when trying to drive the kbd/mouse: ", e)
+            if stop is not None and stop.is_set():
+                break
+
+            if probes is not None and stats_interval and monotonic() >= next_report:
+                print(probes.line(conn.stats()))
+                next_report = monotonic() + stats_interval
+
+            # wait for the newest packet; anything older has already been superseded
+            # the timeout keeps us responsive to ^C
+            packet = conn.latest(timeout=0.5 if not stats_interval else min(0.5, stats_interval))
+            if packet is None:
+                continue
+            enabled = update_enabled(conn, packet, enabled)
+
+            # hand the packet to the output workers; keyboard and mouse are driven concurrently
+            # only perform updates if the controller is enabled -- else, ignore the events
+            if enabled:
+                buttons = packet.buttons
+                if refiltered:
+                    stick_filter = refiltered.pop()
+                    refiltered.clear()
+                if stick_filter is not None:
+                    start = perf_counter()
+                    buttons = stick_filter.apply(buttons, packet.received or start)
+                    if probes is not None:
+                        probes.record("filter", perf_counter() - start)
+
+                key_worker.submit(buttons, packet.received)
+                if scheduler is not None:
+                    scheduler.set_stick(buttons.x_axis, buttons.y_axis)
+                elif mouse_stage is not None:
+                    mouse_stage.submit(buttons)
+            elif scheduler is not None:
+                scheduler.set_stick(0, 0)
+
+            # publish after the outputs have their packet, so consumers never hold them up
+            if publisher is not None:
+                publisher.publish(packet.buttons)
         except KeyboardInterrupt:
             quit = True
     
-    # once we quit, close the connection
+    # once we quit, release everything and close the connection
     print()
     print("Exiting...")
+    release_all()
+    key_worker.stop()
+    if mouse_stage is not None:
+        mouse_stage.stop()
+    if watcher is not None:
+        watcher.stop()
     conn.close()
+
+    stats = conn.stats()
+    print("Packets:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in stats.items()))
+    if conn.reconnect_latencies:
+        latencies = conn.reconnect_latencies
+        print(f"Reconnect latency: mean {sum(latencies) / len(latencies) * 1000:.0f} ms, max {max(latencies) * 1000:.0f} ms")
+    print(f"{key_worker.name}: handled {key_worker.handled}, superseded {key_worker.superseded}")
+    if mouse_stage is not None:
+        print(mouse_stage.report())
+    if scheduler is not None:
+        scheduler.stop()
+        print(scheduler.timing_report())
+    if probes is not None:
+        print(probes.line(stats))
+        if stats_json is not None:
+            dump_stats()
+            print(f"Statistics written to {stats_json}")
+    if use_signal:
+        signal.signal(signal.SIGUSR1, previous_handler)
+
+    return stats
@@ -4,6 +4,10 @@
 import sys
 import json
 
+import dispatch
+import response_curve
+import stick_filter
+
 # The pydirectinput module uses different names for special keys; use a dictionary to convert them
 # Note this is only necessary if we are on windows -- Linux systems will use keysym
 keysym_to_windows = {
@@ -44,6 +48,21 @@ class Configuration:
             See the sample configuration file for a demo
             Note that special keys will automatically be converted for windows/pydirectinput
 
+            Instead of a single key, a button may be bound to a macro (a list of keys, pressed together in order)
+            or given turbo, as described in dispatch.py, e.g.
+                "A": ["Shift_L", "x"]
+                "B": {"keys": "Control_L", "turbo": 15}
+
+            The file may also give stick response curves for relative and absolute mode, under the keys
+            "CURVE" and "ABSOLUTE_CURVE"; each holds any of the fields in response_curve.CONFIG_FIELDS, e.g.
+                "CURVE": {"deadzone": 4, "radial": true, "exponent": 1.5, "sensitivity": [1.0, 0.8]}
+            These are left as None if not given, meaning the defaults in mouse_pos are used
+
+            An adaptive filter for the stick may be given under "FILTER", with any of the fields in
+            stick_filter.CONFIG_FIELDS, e.g.
+                "FILTER": {"min_cutoff": 1.0, "beta": 0.05}
+            This is left as None if not given, meaning the stick isn't filtered
+
             :param path:
                 The path to the config file (a text file)
         """
@@ -77,10 +96,22 @@ class Configuration:
                 raise Exception(f"No config found for button '{k}'")
 
             v = data[k]
-            if is_windows and v in keysym_to_windows.keys():
-                v = keysym_to_windows[v]
+            try:
+                dispatch.parse_binding(v)
+            except Exception as e:
+                raise Exception(f"Invalid config for button '{k}': {e}")
+
+            if is_windows:
+                v = dispatch.map_keys(v, lambda key: keysym_to_windows.get(key, key))
             
             self.buttons[k] = v
+
+        # compile the response curves, if any were given
+        self.curve = response_curve.from_config(data.get("CURVE"))
+        self.absolute_curve = response_curve.from_config(data.get("ABSOLUTE_CURVE"))
+
+        # and the stick filter
+        self.stick_filter = stick_filter.from_config(data.get("FILTER"))
     
     def __list__(self):
         """ Returns the configuration as a list that the script can use
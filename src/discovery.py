@@ -0,0 +1,223 @@
+"""
+N64 Converter
+discovery.py
+Copyright 2020 Riley Lannon
+
+Finds the serial port an Arduino is connected to.
+On Linux, the board's VID:PID is matched directly against the USB metadata in sysfs, so no port ever has to be
+opened to probe it. If the board isn't connected yet, we block on inotify events for /dev rather than polling,
+and pick the port up as soon as udev has created it.
+Other platforms fall back to pyserial's port listing.
+"""
+
+import ctypes
+import os
+import select
+import struct
+import sys
+from time import monotonic, sleep
+
+# inotify flags, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# the fixed part of struct inotify_event: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct("iIII")
+
+SYS_TTY_PATH = "/sys/class/tty"
+DEV_PATH = "/dev"
+
+# How often to re-list ports on platforms without inotify, in seconds
+POLL_INTERVAL = 0.25
+
+
+def parse_board_id(board_id):
+    """ Splits a board ID of the form 'VID:PID=2341:0043' into its vendor and product IDs
+
+        :returns:
+            A tuple of the (vid, pid) as lowercase hex strings
+    """
+    ids = board_id.split("=")[-1].lower()
+    vid, pid = ids.split(":")
+    return (vid, pid)
+
+
+def _usb_ids(device_path):
+    """ Walks up from a tty's sysfs device to the USB device it belongs to
+
+        :returns:
+            A tuple of the (vid, pid), or None if the tty isn't a USB device
+    """
+    path = os.path.realpath(device_path)
+    while path != os.path.dirname(path):
+        try:
+            with open(os.path.join(path, "idVendor")) as vendor, open(os.path.join(path, "idProduct")) as product:
+                return (vendor.read().strip().lower(), product.read().strip().lower())
+        except OSError:
+            path = os.path.dirname(path)
+    return None
+
+
+def find_ports(board_ids):
+    """ Lists the device nodes of every connected board matching one of the given IDs (Linux only)
+
+        :param board_ids:
+            The board IDs to look for, as in n64.py's vid_pid table
+
+        :returns:
+            A list of (device node, board ID) tuples, sorted by device node
+    """
+    wanted = {parse_board_id(board_id): board_id for board_id in board_ids}
+
+    found = []
+    try:
+        names = os.listdir(SYS_TTY_PATH)
+    except OSError:
+        return found
+
+    for name in names:
+        device = os.path.join(SYS_TTY_PATH, name, "device")
+        if not os.path.exists(device):
+            continue
+        ids = _usb_ids(device)
+        if ids in wanted:
+            node = os.path.join(DEV_PATH, name)
+            # udev may not have created the node, or set its permissions, yet
+            if os.access(node, os.R_OK | os.W_OK):
+                found.append((node, wanted[ids]))
+    return sorted(found)
+
+
+def _open_inotify():
+    """ Starts watching /dev for new device nodes
+
+        :returns:
+            The inotify file descriptor, or None if inotify is unavailable
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, DEV_PATH.encode(), IN_CREATE | IN_ATTRIB | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def _tty_events(fd):
+    """ Reads the pending inotify events
+
+        :returns:
+            Whether any of them were for a tty node
+    """
+    try:
+        data = os.read(fd, 4096)
+    except BlockingIOError:
+        return False
+
+    offset = 0
+    tty = False
+    while offset < len(data):
+        _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b"\0")
+        offset += length
+        if name.startswith(b"tty"):
+            tty = True
+    return tty
+
+
+def _wait_linux(board_ids, timeout):
+    """ Waits for a matching board using sysfs and inotify
+
+        :returns:
+            The list of (device node, board ID) tuples found, or an empty list if we timed out
+    """
+    # start watching before we look, so a board plugged in between the two isn't missed
+    fd = _open_inotify()
+    try:
+        deadline = None if timeout is None else monotonic() + timeout
+        found = find_ports(board_ids)
+        while not found:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+
+            if fd is None:
+                # no inotify (e.g. a restricted container); fall back to checking periodically
+                sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+                found = find_ports(board_ids)
+                continue
+
+            # sleep until something happens in /dev, and only look again if it involved a tty
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready and _tty_events(fd):
+                found = find_ports(board_ids)
+        return found
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def _wait_listed(board_ids, timeout):
+    """ Waits for a matching board using pyserial's port listing (for Windows and macOS)
+
+        :returns:
+            The list of (device node, board ID) tuples found, or an empty list if we timed out
+    """
+    import serial.tools.list_ports
+
+    deadline = None if timeout is None else monotonic() + timeout
+    while True:
+        found = []
+        for port in serial.tools.list_ports.comports():
+            for board_id in board_ids:
+                # Windows systems will report the arduino connected to the port, but we may have to look for the VID:PID
+                if board_id in port.hwid or (len(board_ids) == 1 and "Arduino" in port.__str__()):
+                    found.append((port.device, board_id))
+                    break
+        if found:
+            return sorted(found)
+
+        if deadline is not None and monotonic() >= deadline:
+            return []
+        sleep(POLL_INTERVAL)
+
+
+def wait_for_ports(board_ids, timeout=None):
+    """ Waits until at least one board matching the given IDs is connected
+
+        :param board_ids:
+            The board IDs to look for, as in n64.py's vid_pid table
+
+        :param timeout:
+            The maximum time to wait, in seconds; None waits forever
+
+        :returns:
+            A list of (device node, board ID) tuples for every matching board, or an empty list if we timed out
+    """
+    if sys.platform.startswith("linux"):
+        return _wait_linux(board_ids, timeout)
+    return _wait_listed(board_ids, timeout)
+
+
+def wait_for_port(board_id, timeout=None):
+    """ Waits until a board matching the given ID is connected
+
+        :param board_id:
+            The board's ID, as in n64.py's vid_pid table
+
+        :param timeout:
+            The maximum time to wait, in seconds; None waits forever
+
+        :returns:
+            The device node (such as '/dev/ttyACM0' or 'COM5'), or None if we timed out
+    """
+    found = wait_for_ports([board_id], timeout)
+    return found[0][0] if found else None
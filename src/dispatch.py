@@ -0,0 +1,249 @@
+"""
+N64 Converter
+dispatch.py
+Copyright 2020 Riley Lannon
+
+Compiled button-to-key dispatch tables.
+A configuration is compiled once, through the output backend's resolve_key, into a table holding each button's
+pre-resolved key codes (a keysym for xdotool, an evdev code for uinput, a scan code for Windows), indexed by the
+button's bit in the Buttons mask. Turning a packet into key events then needs no name lookups at all.
+
+A button may be bound to:
+    * a single key:                 "x"
+    * a macro of keys, pressed in order and released in reverse:  ["Control_L", "s"]
+    * either of those with turbo, repeatedly pressing and releasing while held:  {"keys": "a", "turbo": 15}
+      where turbo is the number of presses per second
+
+The configuration file can also be watched, and a new table swapped in whenever it changes.
+"""
+
+import os
+import threading
+from time import perf_counter
+
+import serial_packet
+
+# How often the configuration file is checked for changes, in seconds
+WATCH_INTERVAL = 0.5
+
+
+def parse_binding(value):
+    """ Parses one button's binding from its configuration
+
+        :param value:
+            A key name, a list of key names, or a dictionary with "keys" and optionally "turbo"
+
+        :raises Exception:
+            If the binding is malformed
+
+        :returns:
+            A tuple of the key names, in press order, and the turbo rate in presses/sec (0 for none)
+    """
+    turbo = 0
+    if isinstance(value, dict):
+        for k in value.keys():
+            if k not in ("keys", "turbo"):
+                raise Exception(f"Unknown binding setting '{k}'")
+        turbo = value.get("turbo", 0)
+        if not isinstance(turbo, (int, float)) or turbo < 0:
+            raise Exception("Turbo must be a positive number of presses per second")
+        value = value.get("keys", [])
+
+    keys = (value,) if isinstance(value, str) else tuple(value)
+    if not keys or not all(isinstance(key, str) and key for key in keys):
+        raise Exception("A binding must be a key name or a list of key names")
+    return (keys, turbo)
+
+
+def map_keys(value, function):
+    """ Applies a function to every key name in a binding, keeping its form """
+    if isinstance(value, dict):
+        value = dict(value)
+        value["keys"] = map_keys(value.get("keys", []), function)
+        return value
+    if isinstance(value, str):
+        return function(value)
+    return [function(key) for key in value]
+
+
+class DispatchTable:
+    """ A compiled configuration
+
+        Tables hold the turbo state of their buttons, so each table must only be used by one thread at a time
+    """
+
+    def __init__(self, actions, turbo):
+        """ Creates the table; see compile_table()
+
+            :param actions:
+                For each button bit, the tuple of resolved key codes it presses
+
+            :param turbo:
+                For each button bit, its turbo rate in presses/sec, or 0
+        """
+        self.actions = tuple(tuple(codes) for codes in actions)
+        self.releases = tuple(tuple(reversed(codes)) for codes in self.actions)
+
+        # turbo buttons toggle every half period while held
+        self.turbo_mask = 0
+        self.half_periods = [0.0] * len(self.actions)
+        for index, rate in enumerate(turbo):
+            if rate:
+                self.turbo_mask |= 1 << index
+                self.half_periods[index] = 0.5 / rate
+
+        self._turbo_down = 0                        # turbo buttons whose keys are currently down
+        self._toggled = [0.0] * len(self.actions)   # when each turbo button last toggled
+
+    def edges(self, old_mask, new_mask):
+        """ Gets the key events for a change in button state
+
+            :param old_mask:
+                The mask of buttons pressed as of the last update
+
+            :param new_mask:
+                The mask of buttons pressed now
+
+            :returns:
+                A list of (key code, pressed) tuples, in the order they should be sent
+        """
+        events = []
+        changed = old_mask ^ new_mask
+        turbo_held = new_mask & self.turbo_mask
+        now = perf_counter() if (turbo_held or changed & self.turbo_mask) else 0.0
+
+        while changed:
+            # isolate the lowest changed bit
+            bit = changed & -changed
+            changed ^= bit
+            index = bit.bit_length() - 1
+
+            if new_mask & bit:
+                if bit & self.turbo_mask:
+                    self._turbo_down |= bit
+                    self._toggled[index] = now
+                for code in self.actions[index]:
+                    events.append((code, True))
+            else:
+                if bit & self.turbo_mask:
+                    if not self._turbo_down & bit:
+                        # released during the off half of the cycle; nothing is down
+                        continue
+                    self._turbo_down &= ~bit
+                for code in self.releases[index]:
+                    events.append((code, False))
+
+        # toggle the turbo buttons that were already held, once their half period has passed
+        held = turbo_held & old_mask
+        while held:
+            bit = held & -held
+            held ^= bit
+            index = bit.bit_length() - 1
+            if now - self._toggled[index] < self.half_periods[index]:
+                continue
+            self._toggled[index] = now
+
+            self._turbo_down ^= bit
+            if self._turbo_down & bit:
+                for code in self.actions[index]:
+                    events.append((code, True))
+            else:
+                for code in self.releases[index]:
+                    events.append((code, False))
+
+        return events
+
+
+def compile_table(config, resolve_key):
+    """ Compiles a configuration into a DispatchTable
+
+        :param config:
+            The configuration list, as from Configuration.__list__ (with the stick placeholders at 7 and 8)
+
+        :param resolve_key:
+            The backend's function converting a key name into the code it sends, returning None if it is unsupported
+
+        :raises Exception:
+            If a binding is malformed
+
+        :returns:
+            The DispatchTable
+    """
+    actions = []
+    turbo = []
+    for bit, name in enumerate(serial_packet.BUTTON_NAMES):
+        keys, rate = parse_binding(config[serial_packet.PACKET_INDICES[bit]])
+        codes = []
+        for key in keys:
+            code = resolve_key(key)
+            if code is None:
+                print(f"Warning: key '{key}' (bound to {name}) is not supported by this backend; ignoring it")
+            else:
+                codes.append(code)
+        actions.append(codes)
+        turbo.append(rate)
+    return DispatchTable(actions, turbo)
+
+
+class ConfigWatcher(threading.Thread):
+    """ Watches a configuration file, and reloads it whenever it changes
+
+        The file is checked with stat() rather than inotify, since editors often replace the file rather than
+        writing to it, and stat() works the same way on every platform
+    """
+
+    def __init__(self, path, load):
+        """ Creates the watcher; call start() to begin watching
+
+            :param path:
+                The configuration file
+
+            :param load:
+                A function taking the path and returning the reloaded configuration (e.g. a new DispatchTable);
+                if it raises, the error is printed and the current configuration is kept
+        """
+        super().__init__(name="ConfigWatcher", daemon=True)
+        self.path = path
+        self.load = load
+        self.reloads = 0
+        self.on_change = None
+        self._stopping = threading.Event()
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            info = os.stat(self.path)
+            return (info.st_mtime_ns, info.st_size, info.st_ino)
+        except OSError:
+            return None
+
+    def watch(self, on_change):
+        """ Starts watching
+
+            :param on_change:
+                The function called with each reloaded configuration
+        """
+        self.on_change = on_change
+        self.start()
+
+    def run(self):
+        while not self._stopping.wait(WATCH_INTERVAL):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+
+            try:
+                loaded = self.load(self.path)
+            except Exception as e:
+                print(f"Could not reload {self.path}:", e)
+                continue
+            self.reloads += 1
+            print(f"Reloaded {self.path}.")
+            self.on_change(loaded)
+
+    def stop(self):
+        """ Stops watching """
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout=1)
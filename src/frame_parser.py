@@ -0,0 +1,163 @@
+"""
+N64 Converter
+frame_parser.py
+Copyright 2020 Riley Lannon
+
+An incremental parser that frames a raw serial byte stream into SerialPackets (of either wire format).
+Bytes are fed in as they arrive and kept in a rolling buffer; the parser scans for the magic number
+with bytearray.find, so after line noise it recovers at the next valid frame boundary without any extra reads.
+"""
+
+import serial_packet
+
+
+class FrameParser:
+    """ Frames a byte stream into packets, resynchronizing on the magic number after bad data """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+        # statistics
+        self.frames = 0             # valid frames parsed
+        self.resyncs = 0            # times we had to skip data to find the next magic number
+        self.bad_checksums = 0      # frames that had a valid header but failed the checksum
+        self.bytes_skipped = 0      # bytes thrown away while resynchronizing
+        self.sequence_gaps = 0      # breaks in the sequence numbers of v2 frames
+        self.frames_lost = 0        # frames missing from those breaks
+
+        # the sequence number of the last v2 frame
+        self.last_sequence = None
+
+        # whether the last thing we saw was a valid frame; a resync is only counted once per run of bad data
+        self._in_sync = True
+
+    def feed(self, data):
+        """ Adds incoming bytes to the buffer and parses every complete frame
+
+            :param data:
+                The bytes read from the serial connection
+
+            :returns:
+                A list of the valid SerialPackets found, oldest first
+        """
+        buffer = self.buffer
+        buffer += data
+
+        # both wire formats share the first byte of the magic number; the second tells us the format (and so the width)
+        first = serial_packet.SerialPacket.MAGIC_NUMBER[0]
+        widths = serial_packet.SerialPacket.FRAME_WIDTHS
+        v2_second = serial_packet.SerialPacket.V2_MAGIC_NUMBER[1:]
+        packets = []
+        position = 0
+
+        while True:
+            start = buffer.find(first, position)
+            if start < 0:
+                self._skip(len(buffer) - position)
+                position = len(buffer)
+                break
+
+            self._skip(start - position)
+            position = start
+
+            # wait for the rest of the magic number
+            if start + 1 >= len(buffer):
+                break
+
+            size = widths.get(buffer[start + 1])
+            if size is None:
+                # not a magic number after all
+                self._skip(1)
+                position = start + 1
+                continue
+
+            # wait for the rest of the frame
+            if len(buffer) - start < size:
+                break
+
+            packet = serial_packet.SerialPacket()
+            try:
+                packet.update(bytes(buffer[start:start + size]))
+            except serial_packet.PacketError:
+                # the magic number was a false match or the frame was corrupted;
+                # search again from the next byte rather than discarding the whole frame
+                self.bad_checksums += 1
+                self._skip(1)
+                position = start + 1
+                continue
+
+            if packet.sequence is not None:
+                # a truncated frame can pass the CRC by chance, running on into the next frame; if a frame starts
+                # inside this one (its magic number may straddle the end) and is valid itself, this one was the
+                # damaged frame
+                inner = buffer.find(first, start + 1, start + size)
+                while inner >= 0 and buffer[inner + 1:inner + 2] not in (b"", v2_second):
+                    inner = buffer.find(first, inner + 1, start + size)
+                if inner >= 0:
+                    if len(buffer) - inner < size:
+                        # wait for the rest of the inner frame before deciding; this only happens when the frame
+                        # holds the first byte of a magic number, and the next frame completes it
+                        break
+                    if self._valid(buffer[inner:inner + size]):
+                        self.bad_checksums += 1
+                        self._skip(inner - start)
+                        position = inner
+                        continue
+
+            self._track_sequence(packet)
+            packets.append(packet)
+            self.frames += 1
+            self._in_sync = True
+            position = start + size
+
+        del buffer[:position]
+        return packets
+
+    @staticmethod
+    def _valid(frame):
+        """ Checks whether a complete frame passes validation """
+        try:
+            serial_packet.SerialPacket().update(bytes(frame))
+        except serial_packet.PacketError:
+            return False
+        return True
+
+    def _track_sequence(self, packet):
+        """ Checks a packet's sequence number (v2 only) for frames lost on the way """
+        if packet.sequence is None:
+            return
+
+        if self.last_sequence is not None:
+            missing = (packet.sequence - self.last_sequence - 1) & 0xFF
+            if missing:
+                self.sequence_gaps += 1
+                self.frames_lost += missing
+        self.last_sequence = packet.sequence
+
+    def _skip(self, count):
+        """ Records that count bytes were thrown away """
+        if count > 0:
+            if self._in_sync:
+                self.resyncs += 1
+                self._in_sync = False
+            self.bytes_skipped += count
+
+    def reset(self):
+        """ Discards any buffered data, and forgets the last sequence number """
+        self.buffer.clear()
+        self.last_sequence = None
+
+    def stats(self):
+        """ Gets the parser's statistics
+
+            :returns:
+                A dictionary of the counters
+        """
+        return {
+            "frames": self.frames,
+            "resyncs": self.resyncs,
+            "bad_checksums": self.bad_checksums,
+            "bytes_skipped": self.bytes_skipped,
+            "sequence_gaps": self.sequence_gaps,
+            "frames_lost": self.frames_lost,
+        }
@@ -0,0 +1,115 @@
+# gamepad_functions.py
+# Output through a virtual evdev gamepad, rather than the keyboard and mouse
+
+# utilize python-evdev to write to /dev/uinput, as in uinput_functions
+# the buttons become gamepad buttons and the stick becomes a real pair of analog axes (ABS_X/ABS_Y),
+# so the emulator sees the controller's full resolution and nothing goes through mouse emulation or calibration
+from evdev import UInput, AbsInfo, ecodes
+
+
+# The buttons the gamepad advertises; configurations may bind controller buttons to any of these by name
+BUTTONS = (
+    "BTN_SOUTH", "BTN_EAST", "BTN_NORTH", "BTN_WEST",
+    "BTN_TL", "BTN_TR", "BTN_TL2", "BTN_TR2",
+    "BTN_SELECT", "BTN_START", "BTN_MODE", "BTN_THUMBL", "BTN_THUMBR",
+    "BTN_DPAD_UP", "BTN_DPAD_DOWN", "BTN_DPAD_LEFT", "BTN_DPAD_RIGHT",
+    "BTN_TRIGGER_HAPPY1", "BTN_TRIGGER_HAPPY2", "BTN_TRIGGER_HAPPY3", "BTN_TRIGGER_HAPPY4",
+)
+
+# The default configuration, in the same order as a configuration list (with 0 for the stick)
+# The C buttons have no standard gamepad equivalent, so they get the extra "trigger happy" buttons
+DEFAULT_CONFIG = [
+    'BTN_TL', 'BTN_TR', 'BTN_TL2',
+    'BTN_DPAD_UP', 'BTN_DPAD_DOWN', 'BTN_DPAD_LEFT', 'BTN_DPAD_RIGHT',
+    0, 0,
+    'BTN_SOUTH', 'BTN_WEST',
+    'BTN_TRIGGER_HAPPY1', 'BTN_TRIGGER_HAPPY2', 'BTN_TRIGGER_HAPPY3', 'BTN_TRIGGER_HAPPY4',
+    'BTN_START'
+]
+
+# The range of the stick axes; the controller reports each axis as a signed byte
+AXIS_MIN = -128
+AXIS_MAX = 127
+
+# The device is created on first use and kept open for the lifetime of the process
+_device = None
+
+# The axis positions last written, so unchanged axes aren't written again
+_last_axes = None
+
+
+def resolve_key(key):
+    """ Converts a button name from the configuration into what update_keys sends
+
+        :param key:
+            The evdev button name, such as 'BTN_SOUTH'
+
+        :returns:
+            The evdev button code, or None if the gamepad doesn't have that button
+    """
+    if key not in BUTTONS:
+        return None
+    return ecodes.ecodes[key]
+
+
+def get_device():
+    """ Gets the virtual gamepad, creating it if necessary
+
+        :returns:
+            The UInput device
+    """
+    global _device
+    if _device is None:
+        axis = AbsInfo(value=0, min=AXIS_MIN, max=AXIS_MAX, fuzz=0, flat=0, resolution=0)
+        capabilities = {
+            ecodes.EV_KEY: [ecodes.ecodes[name] for name in BUTTONS],
+            ecodes.EV_ABS: [(ecodes.ABS_X, axis), (ecodes.ABS_Y, axis)],
+        }
+        _device = UInput(capabilities, name="N64 Converter Gamepad")
+    return _device
+
+
+def close():
+    """ Closes the virtual gamepad, if it was opened """
+    global _device, _last_axes
+    if _device is not None:
+        _device.close()
+        _device = None
+        _last_axes = None
+
+
+def update_keys(pressed_buttons, packet, config):
+    """ Updates the gamepad's buttons and stick
+
+        Every change in the packet, buttons and axes alike, is written as a single batch followed by one syn,
+        so the emulator never sees half of a frame
+
+        :param pressed_buttons:
+            The Buttons object containing *currently* pressed buttons
+
+        :param packet:
+            The incoming data
+
+        :param config:
+            The input configuration, compiled into a dispatch.DispatchTable with resolve_key
+    """
+    global _last_axes
+
+    events = config.edges(pressed_buttons.mask, packet.mask)
+
+    # evdev's y axis points down, while the controller's points up
+    axes = (packet.x_axis, max(AXIS_MIN, min(AXIS_MAX, -packet.y_axis)))
+    if not events and axes == _last_axes:
+        return
+
+    device = get_device()
+    for code, pressed in events:
+        device.write(ecodes.EV_KEY, code, 1 if pressed else 0)
+    if _last_axes is None or axes[0] != _last_axes[0]:
+        device.write(ecodes.EV_ABS, ecodes.ABS_X, axes[0])
+    if _last_axes is None or axes[1] != _last_axes[1]:
+        device.write(ecodes.EV_ABS, ecodes.ABS_Y, axes[1])
+    _last_axes = axes
+    device.syn()
+
+    return
@@ -6,9 +6,23 @@ import subprocess
 import mouse_pos
 
 
+def resolve_key(key):
+    """ Converts a key name from the configuration into what update_keys sends; xdotool takes keysyms directly
+
+        :param key:
+            The keysym name
+
+        :returns:
+            The keysym name
+    """
+    return key
+
+
 def update_keys(pressed_buttons, packet, config):
     """ Updates key presses
 
+        Every change in the packet is sent with a single xdotool process, chaining a keydown/keyup verb per key
+
         :param pressed_buttons:
             The Buttons object containing *currently* pressed keys
         
@@ -16,50 +30,62 @@ def update_keys(pressed_buttons, packet, config):
             The incoming data
         
         :param config:
-            The input configuration
+            The input configuration, compiled into a dispatch.DispatchTable with resolve_key
     """
-    # get the incoming and currently pressed keys
-    incoming = list(packet)
-    pressed = list(pressed_buttons)
-
-    # iterate through the lists
-    i = 0
-    while i < incoming.__len__():
-        # only look at keys that have different values
-        if pressed[i] != incoming[i]:
-            if i == 7 or i == 8:
-                pass
-            else:
-                if pressed[i]:
-                    # print(config[i], "is released")   # for debug
-                    subprocess.call(["xdotool","keyup",config[i]])
-                else:
-                    #print(config[i], "is pressed")  # for debug
-                    subprocess.call(["xdotool","keydown",config[i]])
-        # increment the index
-        i += 1
+    # only the buttons that changed since the last update (or are repeating) produce events
+    events = config.edges(pressed_buttons.mask, packet.mask)
+    if not events:
+        return
+
+    args = ["xdotool"]
+    for key, pressed in events:
+        # print(key, "is pressed" if pressed else "is released")  # for debug
+        args += ["keydown" if pressed else "keyup", key]
+
+    # spawning the process is most of the cost, so a chord costs the same as a single key
+    subprocess.call(args)
     
     return
 
 
-def update_mouse(incoming):
+def update_mouse(incoming, use_absolute=False, base_pos=(0, 0)):
     """ Updates the mouse position
 
         :param incoming:
             The incoming data
-    """
 
-    # cast to list type
-    incoming = list(incoming)
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position
+
+        :param base_pos:
+            The calibrated zero point, used in absolute mode
+    """
 
     # get the joystick positions
-    new_x_coord = incoming[7]
-    new_y_coord = incoming[8]
+    new_x_coord = incoming.x_axis
+    new_y_coord = incoming.y_axis
 
-    # get the change
-    tup = mouse_pos.get_mouse_pos(new_x_coord, new_y_coord)
-    
-    # drive the mouse
-    subprocess.call(["xdotool", "mousemove_relative", "--", tup[0].__str__(), tup[1].__str__()])
+    # act based on the mode
+    if use_absolute:
+        tup = mouse_pos.get_absolute_pos(new_x_coord, new_y_coord, base_pos)
+        subprocess.call(["xdotool", "mousemove", "--", tup[0].__str__(), tup[1].__str__()])
+    else:
+        # get the change
+        tup = mouse_pos.get_mouse_pos(new_x_coord, new_y_coord)
+
+        # drive the mouse
+        move_mouse(tup[0], tup[1])
 
     return
+
+
+def move_mouse(x_change, y_change):
+    """ Moves the mouse relative to its current position
+
+        :param x_change:
+            The number of pixels to move right
+
+        :param y_change:
+            The number of pixels to move down
+    """
+    subprocess.call(["xdotool", "mousemove_relative", "--", x_change.__str__(), y_change.__str__()])
@@ -0,0 +1,129 @@
+"""
+N64 Converter
+motion.py
+Copyright 2020 Riley Lannon
+
+A fixed-rate mouse motion scheduler for relative mode.
+Rather than moving the mouse once per serial packet (which ties cursor speed to the link speed and its jitter),
+the scheduler runs on its own clock and integrates the latest stick position over the real time elapsed.
+Fractions of a pixel are carried over between ticks, so slow movements stay smooth.
+"""
+
+import threading
+from time import perf_counter, sleep
+
+import mouse_pos
+
+
+# The default number of motion updates per second
+DEFAULT_RATE = 500
+
+# The default speed; the stick's per-packet delta (see mouse_pos.get_mouse_pos) is applied this many times per second
+# This matches moving once per packet with the Arduino polling every ~30 ms
+DEFAULT_SPEED = 30
+
+
+class MotionScheduler(threading.Thread):
+    """ Moves the mouse at a fixed rate, based on the latest stick position """
+
+    def __init__(self, move_mouse, rate=DEFAULT_RATE, speed=DEFAULT_SPEED):
+        """ Creates the scheduler; call start() to begin moving the mouse
+
+            :param move_mouse:
+                A function that moves the mouse by a relative (x, y) amount
+
+            :param rate:
+                The number of updates per second
+
+            :param speed:
+                The number of times per second the stick's per-packet delta is applied
+        """
+        super().__init__(name="MotionScheduler", daemon=True)
+        self.move_mouse = move_mouse
+        self.period = 1 / rate
+        self.speed = speed
+
+        # the latest stick position; written by the driver loop and read here as one tuple, so no lock is needed
+        self.stick = (0, 0)
+
+        # timing statistics, in seconds
+        self.ticks = 0
+        self.moves = 0
+        self.total_error = 0.0
+        self.max_error = 0.0
+        self.skipped = 0        # ticks abandoned because we were more than a whole period late
+
+        self._running = True
+
+    def set_stick(self, x_axis, y_axis):
+        """ Updates the stick position used for motion
+
+            :param x_axis:
+                The joystick's x axis
+
+            :param y_axis:
+                The joystick's y axis
+        """
+        self.stick = (x_axis, y_axis)
+
+    def run(self):
+        # the sub-pixel remainder carried between ticks
+        remainder_x = 0.0
+        remainder_y = 0.0
+
+        last = perf_counter()
+        deadline = last + self.period
+        while self._running:
+            delay = deadline - perf_counter()
+            if delay > 0:
+                sleep(delay)
+
+            now = perf_counter()
+            error = now - deadline
+            self.ticks += 1
+            self.total_error += error
+            self.max_error = max(self.max_error, error)
+
+            # integrate over the real time elapsed, so a late tick still moves the right distance
+            elapsed = now - last
+            last = now
+            change = mouse_pos.get_mouse_pos(*self.stick)
+            remainder_x += change[0] * self.speed * elapsed
+            remainder_y += change[1] * self.speed * elapsed
+
+            x_change = int(remainder_x)
+            y_change = int(remainder_y)
+            if x_change or y_change:
+                remainder_x -= x_change
+                remainder_y -= y_change
+                try:
+                    self.move_mouse(x_change, y_change)
+                    self.moves += 1
+                except Exception as e:
+                    print("An error occurred when trying to drive the mouse: ", e)
+
+            # stay on the original schedule, unless we have fallen so far behind that we'd have to catch up
+            deadline += self.period
+            if now - deadline > self.period:
+                missed = int((now - deadline) / self.period)
+                self.skipped += missed
+                deadline += missed * self.period
+
+    def timing_report(self):
+        """ Gets a summary of the timing achieved
+
+            :returns:
+                A string describing the tick rate and timing error
+        """
+        if self.ticks == 0:
+            return "MotionScheduler: no ticks"
+        return (
+            f"MotionScheduler: {self.ticks} ticks at {1 / self.period:.0f} Hz, {self.moves} moves, "
+            f"mean error {self.total_error / self.ticks * 1000:.3f} ms, max error {self.max_error * 1000:.3f} ms, "
+            f"skipped {self.skipped}"
+        )
+
+    def stop(self):
+        """ Stops the scheduler """
+        self._running = False
+        self.join(timeout=1)
@@ -0,0 +1,105 @@
+"""
+N64 Converter
+mouse_output.py
+Copyright 2020 Riley Lannon
+
+The mouse output stage.
+Stick positions are converted to mouse moves before they are handed to the backend, so moves that would do
+nothing (a stick at rest in relative mode, or an unchanged position in absolute mode) are dropped without
+costing an injection call. If the backend falls behind, relative moves waiting for it are added together into
+a single move rather than dropped, and absolute positions waiting for it are replaced by the newest.
+"""
+
+import mouse_pos
+import output_worker
+
+
+def _add_moves(pending, new):
+    # both are the (x_change, y_change) arguments for a move
+    return (pending[0] + new[0], pending[1] + new[1])
+
+
+class MouseOutput:
+    """ Drives a backend's mouse functions from a worker thread, suppressing redundant moves """
+
+    def __init__(self, update_mouse, move_mouse=None, use_absolute=False, base_pos=(0, 0)):
+        """ Creates the stage; call start() to begin moving the mouse
+
+            :param update_mouse:
+                The backend's function for updating the mouse
+
+            :param move_mouse:
+                The backend's function for moving the mouse by a relative amount; without it, relative moves
+                go through update_mouse and can't be combined
+
+            :param use_absolute:
+                Whether the joystick drives the absolute mouse position
+
+            :param base_pos:
+                The calibrated zero point, used in absolute mode
+        """
+        self.update_mouse = update_mouse
+        self.move_mouse = move_mouse
+        self.use_absolute = use_absolute
+        self.base_pos = base_pos
+
+        if use_absolute or move_mouse is None:
+            self.worker = output_worker.OutputWorker(self.update_mouse, name="MouseWorker")
+        else:
+            self.worker = output_worker.OutputWorker(self._move, name="MouseWorker", merge=_add_moves)
+
+        # statistics
+        self.suppressed = 0     # packets that would not have moved the mouse
+        self._last_target = None
+
+    @property
+    def emitted(self):
+        """ The number of moves sent to the backend """
+        return self.worker.handled
+
+    @property
+    def coalesced(self):
+        """ The number of moves combined with (or replaced by) a newer one while the backend was busy """
+        return self.worker.superseded
+
+    def start(self):
+        self.worker.start()
+
+    def submit(self, buttons):
+        """ Hands over the newest packet's buttons, unless it wouldn't move the mouse """
+        if self.use_absolute:
+            target = mouse_pos.get_absolute_pos(buttons.x_axis, buttons.y_axis, self.base_pos)
+            if target == self._last_target:
+                self.suppressed += 1
+                return
+            self._last_target = target
+            self.worker.submit(buttons, True, self.base_pos)
+            return
+
+        change = mouse_pos.get_mouse_pos(buttons.x_axis, buttons.y_axis)
+        if change[0] == 0 and change[1] == 0:
+            self.suppressed += 1
+            return
+        if self.move_mouse is None:
+            self.worker.submit(buttons, False, self.base_pos)
+        else:
+            self.worker.submit(change[0], change[1])
+
+    def _move(self, x_change, y_change):
+        # combined moves may cancel out
+        if x_change or y_change:
+            self.move_mouse(x_change, y_change)
+
+    def reset(self):
+        """ Forgets the last absolute position, so the next one is always sent (e.g. after a reconnect) """
+        self._last_target = None
+
+    def wait_idle(self, timeout=None):
+        return self.worker.wait_idle(timeout)
+
+    def stop(self):
+        self.worker.stop()
+
+    def report(self):
+        """ Gets a one-line summary of the stage's statistics """
+        return f"{self.worker.name}: emitted {self.emitted}, suppressed {self.suppressed}, coalesced {self.coalesced}"
@@ -3,17 +3,60 @@
 
 import sys
 
+import response_curve
+
+# The curves used to convert joystick positions; these are compiled into lookup tables, see response_curve
+# By default, relative mode passes the stick straight through,
+# and absolute mode halves it with a small deadzone
+DEFAULT_RELATIVE_CURVE = response_curve.ResponseCurve()
+DEFAULT_ABSOLUTE_CURVE = response_curve.ResponseCurve(deadzone=2, sensitivity=0.5)
+
+_relative_curve = DEFAULT_RELATIVE_CURVE
+_absolute_curve = DEFAULT_ABSOLUTE_CURVE
+
+# The output backend's function for reading the cursor position, if it has one; otherwise pyautogui is used
+_position_reader = None
+
+def set_position_reader(reader):
+    """ Sets the function used to read the cursor position, so calibration can use the backend's own connection
+
+        :param reader:
+            A function returning the cursor's (x, y), or None to use pyautogui
+    """
+    global _position_reader
+    _position_reader = reader
+
+
 def read_current_mouse_position():
     """ Reads the current mouse position on the user's screen
 
         :returns:
             A tuple with the (x, y) coordinates of the cursor
     """
+    if _position_reader is not None:
+        return _position_reader()
+
     import pyautogui
     pyautogui.FAILSAFE = False
     return pyautogui.position() 
 
 
+def set_curves(relative=None, absolute=None):
+    """ Sets the response curves used to convert joystick positions
+
+        :param relative:
+            The ResponseCurve for relative mode; None keeps the current curve
+
+        :param absolute:
+            The ResponseCurve for absolute mode; None keeps the current curve
+    """
+    global _relative_curve, _absolute_curve
+    if relative is not None:
+        _relative_curve = relative
+    if absolute is not None:
+        _absolute_curve = absolute
+
+
 def get_mouse_pos(new_x_coord, new_y_coord):
     """ Gets the updated mouse position
 
@@ -23,23 +66,7 @@ def get_mouse_pos(new_x_coord, new_y_coord):
         :param new_y_coord:
             The new y coordinate as reported by the controller
     """
-
-    x_change = 0
-    y_change = 0
-    
-    # if the joystick returned to its default position (0,0), stop mouse movement
-    if not (new_x_coord == 0 and new_y_coord == 0):
-        if new_x_coord == 0:
-            x_change = 0
-        else:
-            x_change = new_x_coord
-
-        if new_y_coord == 0:
-            y_change = 0
-        else:
-            y_change = -new_y_coord
-    
-    return (int(x_change), int(y_change))
+    return _relative_curve.lookup(new_x_coord, new_y_coord)
 
 
 def get_absolute_pos(x, y, base):
@@ -54,9 +81,5 @@ def get_absolute_pos(x, y, base):
         :param base:
             A tuple containing the base position
     """
-
-    # give a small deadzone
-    new_x = base[0] + (int(x / 2) if abs(x) > 2 else 0)
-    new_y = base[1] - (int(y / 2) if abs(y) > 2 else 0)
-
-    return (new_x, new_y)
+    change = _absolute_curve.lookup(x, y)
+    return (base[0] + change[0], base[1] + change[1])
@@ -0,0 +1,240 @@
+"""
+N64 Converter
+multi.py
+Copyright 2020 Riley Lannon
+
+Multi-controller mode: every matching board (of any supported type) is driven from one process.
+Rather than a thread or process per controller, all of the serial connections are serviced from a single
+selector loop, and each controller has its own configuration and statistics.
+Only one player's stick drives the mouse, since there is only one mouse to drive; it is driven through a
+mouse_output.MouseOutput, as in the single-controller driver, so moves that do nothing are skipped and relative moves
+the backend falls behind on are combined.
+"""
+
+import selectors
+from collections import deque
+from time import monotonic, perf_counter
+
+import serial
+
+import comm
+import discovery
+import frame_parser
+import mouse_output
+import serial_packet
+
+# How often to look for newly connected boards, in seconds
+RESCAN_INTERVAL = 2.0
+
+# The number of recent latency samples kept for each controller
+LATENCY_SAMPLES = 1000
+
+
+class Controller:
+    """ The state of one board and the player using it """
+
+    def __init__(self, player, port, conn, config):
+        self.player = player
+        self.port = port
+        self.conn = conn
+        self.config = config
+        self.parser = frame_parser.FrameParser()
+        self.pressed_buttons = serial_packet.Buttons()
+        self.enabled = True
+
+        # statistics
+        self.connected = monotonic()
+        self.packets = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)     # seconds from data arriving to the output being driven
+
+    def report(self):
+        """ Gets a one-line summary of the controller's statistics """
+        elapsed = max(monotonic() - self.connected, 1e-9)
+        summary = f"Player {self.player} ({self.port}): {self.packets} packets, {self.packets / elapsed:.1f} packets/sec"
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            count = len(latencies)
+            summary += (
+                f", latency p50 {latencies[count // 2] * 1000:.2f} ms"
+                f", p99 {latencies[min(count - 1, int(count * 0.99))] * 1000:.2f} ms"
+            )
+        stats = self.parser.stats()
+        return summary + f", resyncs {stats['resyncs']}, frames lost {stats['frames_lost']}"
+
+
+def open_port(port, baud, negotiate):
+    """ Opens a board's serial port for use in the selector loop
+
+        :returns:
+            The open, non-blocking serial connection
+    """
+    conn = serial.Serial(port, comm.DEFAULT_BAUD if negotiate else baud, timeout=0.1)
+    if negotiate and baud != comm.DEFAULT_BAUD and not comm.negotiate_baud(conn, baud):
+        print(f"The Arduino on {port} did not accept {baud} baud; staying at {comm.DEFAULT_BAUD}.")
+    conn.reset_input_buffer()
+    conn.reset_output_buffer()
+
+    # reads must never block the loop
+    conn.timeout = 0
+    return conn
+
+
+def run(configs, default_config, update_keys, update_mouse, board_ids, use_absolute=False,
+        baud=comm.DEFAULT_BAUD, negotiate=False, max_players=4, mouse_player=1, stick_filter=None, move_mouse=None):
+    """ Runs the multi-controller driver loop until ^C
+
+        :param configs:
+            The compiled configuration (a dispatch.DispatchTable) for each player, in player order
+
+        :param default_config:
+            The configuration for players beyond those in configs; since tables hold turbo state,
+            it should only be shared by players without turbo buttons
+
+        :param update_keys:
+            The backend's function for updating key presses
+
+        :param update_mouse:
+            The backend's function for updating the mouse
+
+        :param board_ids:
+            The IDs of every supported board type, as in n64.py's vid_pid table
+
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position (calibrated from the current mouse position)
+
+        :param baud:
+            The serial baud rate
+
+        :param negotiate:
+            Whether to ask each Arduino to switch to baud
+
+        :param max_players:
+            The most controllers to drive at once
+
+        :param mouse_player:
+            The player whose stick drives the mouse
+
+        :param stick_filter:
+            A stick_filter.StickFilter the mouse player's stick is passed through, if any
+
+        :param move_mouse:
+            The backend's function for moving the mouse by a relative amount, so moves it falls behind on can be
+            combined
+    """
+    selector = selectors.DefaultSelector()
+    controllers = {}    # by port
+
+    base_pos = (0, 0)
+    if use_absolute:
+        import mouse_pos
+        base_pos = mouse_pos.read_current_mouse_position()
+        print(f"Using {base_pos} as base position")
+
+    # the mouse is driven from its own worker, so the selector loop never waits on it
+    mouse_stage = mouse_output.MouseOutput(update_mouse, move_mouse, use_absolute, base_pos)
+
+    def free_player():
+        taken = {controller.player for controller in controllers.values()}
+        for player in range(1, max_players + 1):
+            if player not in taken:
+                return player
+        return None
+
+    def add_boards(found):
+        for port, board_id in found:
+            if port in controllers:
+                continue
+            player = free_player()
+            if player is None:
+                return
+            try:
+                conn = open_port(port, baud, negotiate)
+            except Exception as e:
+                print(f"Could not connect to {port}:", e)
+                continue
+
+            config = configs[player - 1] if player <= len(configs) else default_config
+            controller = Controller(player, port, conn, config)
+            controllers[port] = controller
+            selector.register(conn.fileno(), selectors.EVENT_READ, controller)
+            print(f"Player {player} connected on port {port} ({board_id}).")
+
+    def remove(controller, reason):
+        print(f"Player {controller.player} disconnected:", reason)
+        # make sure nothing is left held down
+        try:
+            update_keys(controller.pressed_buttons, serial_packet.Buttons(), controller.config)
+        except Exception as e:
+            print("An error occurred when releasing keys:", e)
+        if controller.player == mouse_player:
+            mouse_stage.reset()
+        selector.unregister(controller.conn.fileno())
+        try:
+            controller.conn.close()
+        except Exception:
+            pass
+        del controllers[controller.port]
+        print(controller.report())
+
+    def service(controller):
+        arrived = perf_counter()
+        data = controller.conn.read(max(1, controller.conn.in_waiting))
+        if not data:
+            # the fd was readable but held nothing, which means the device went away
+            raise serial.SerialException("device disconnected")
+
+        packets = controller.parser.feed(data)
+        if not packets:
+            return
+
+        # only the newest packet matters
+        packet = packets[-1]
+        controller.packets += len(packets)
+        controller.enabled = comm.update_enabled(controller.conn, packet, controller.enabled)
+        if not controller.enabled:
+            return
+
+        update_keys(controller.pressed_buttons, packet.buttons, controller.config)
+        controller.pressed_buttons.copy_from(packet.buttons)
+        if controller.player == mouse_player:
+            buttons = packet.buttons
+            if stick_filter is not None:
+                buttons = stick_filter.apply(buttons, arrived)
+            mouse_stage.submit(buttons)
+        controller.latencies.append(perf_counter() - arrived)
+
+    print("Searching for Arduinos...")
+    add_boards(discovery.wait_for_ports(board_ids))
+    mouse_stage.start()
+    print("Ready.")
+
+    last_scan = monotonic()
+    try:
+        while True:
+            for key, _ in selector.select(timeout=RESCAN_INTERVAL if controllers else 0.5):
+                controller = key.data
+                try:
+                    service(controller)
+                except (serial.SerialException, OSError) as e:
+                    remove(controller, e)
+                except Exception as e:
+                    print("An error occurred when trying to drive the kbd/mouse: ", e)
+
+            # pick up boards plugged in since we started; waits (without polling) if there are none at all
+            if not controllers:
+                print("Waiting for an Arduino...")
+                add_boards(discovery.wait_for_ports(board_ids))
+                last_scan = monotonic()
+            elif monotonic() - last_scan >= RESCAN_INTERVAL and len(controllers) < max_players:
+                add_boards(discovery.wait_for_ports(board_ids, timeout=0))
+                last_scan = monotonic()
+    except KeyboardInterrupt:
+        pass
+
+    print()
+    print("Exiting...")
+    for controller in list(controllers.values()):
+        remove(controller, "exiting")
+    selector.close()
+    mouse_stage.stop()
+    print(mouse_stage.report())
@@ -8,6 +8,12 @@ import sys
 import comm
 import argparse
 import controller_config
+import dispatch
+import motion
+import mouse_pos
+import network
+import shared_state
+import stats
 
 if __name__ == "__main__":
     # Define our VID:PID numbers for each board that we support
@@ -18,6 +24,8 @@ if __name__ == "__main__":
     # Create some named variables for functions
     update_keys = None
     update_mouse = None
+    move_mouse = None
+    resolve_key = None
 
     # Create a default keyboard configuration, putting in 0 for mouse x and y (handled separately)
     default_config = []
@@ -30,15 +38,13 @@ if __name__ == "__main__":
 
         update_keys = win_functions.update_keys
         update_mouse = win_functions.update_mouse
+        move_mouse = win_functions.move_mouse
+        resolve_key = win_functions.resolve_key
 
         # Give our custom Project64 config
         default_config = ['q','w','e','r','t','y','u',0,0,'i','o','a','s','d','f','g']
     elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        import linux_functions
-
-        update_keys = linux_functions.update_keys
-        update_mouse = linux_functions.update_mouse
-
+        # the output backend is chosen once the arguments are parsed
         # Give defaults for Mupen64Plus
         default_config = ['x','c','z','w','s','a','d',0,0,'Shift_L','Control_L','i','k','j','l','Return']
     else:
@@ -52,8 +58,8 @@ if __name__ == "__main__":
             '-c',
             '--config',
             type=str,
-            help="The path to the config file you wish to use",
-            default=""
+            action='append',
+            help="The path to the config file you wish to use; in multi-controller mode, give one per player"
         )
         parser.add_argument(
             "-b",
@@ -68,8 +74,174 @@ if __name__ == "__main__":
             action='store_true',
             help='Use the absolute mouse position (optimal performance; requires calibration)'
         )
+        parser.add_argument(
+            '-g',
+            '--gamepad',
+            action='store_true',
+            help="Appear as a virtual gamepad with an analog stick instead of a keyboard and mouse "
+                 "(Linux only; requires write access to /dev/uinput)"
+        )
+        parser.add_argument(
+            '--backend',
+            type=str,
+            choices=["xdotool", "uinput", "xtest"],
+            help="The output backend to use on Linux (uinput requires write access to /dev/uinput; xtest requires python-xlib)",
+            default="xdotool"
+        )
+        parser.add_argument(
+            '--baud',
+            type=int,
+            help="The serial baud rate; must match SERIAL_BAUD in the sketch unless --negotiate is given",
+            default=comm.DEFAULT_BAUD
+        )
+        parser.add_argument(
+            '--negotiate',
+            action='store_true',
+            help="Connect at the sketch's default rate and ask the Arduino to switch to --baud"
+        )
+        parser.add_argument(
+            '--mouse-rate',
+            type=int,
+            help="Move the mouse this many times per second on its own clock, rather than once per packet (relative mode only)",
+            default=0
+        )
+        parser.add_argument(
+            '--mouse-speed',
+            type=float,
+            help="With --mouse-rate, how many times per second the stick's per-packet movement is applied",
+            default=motion.DEFAULT_SPEED
+        )
+        parser.add_argument(
+            '--multi',
+            action='store_true',
+            help="Drive every connected board (of any supported type) as a separate player (not supported on Windows)"
+        )
+        parser.add_argument(
+            '--players',
+            type=int,
+            help="The most controllers to drive at once in multi-controller mode",
+            default=4
+        )
+        parser.add_argument(
+            '--mouse-player',
+            type=int,
+            help="In multi-controller mode, the player whose stick drives the mouse",
+            default=1
+        )
+        parser.add_argument(
+            '--record',
+            type=str,
+            help="Record the raw serial data into a session log at this path (gzip-compressed if it ends in .gz)"
+        )
+        parser.add_argument(
+            '--send',
+            type=str,
+            metavar='HOST[:PORT]',
+            help="Send the controller's states over UDP to a receiver on another machine, instead of driving this one"
+        )
+        parser.add_argument(
+            '--receive',
+            type=int,
+            nargs='?',
+            const=network.DEFAULT_PORT,
+            metavar='PORT',
+            help=f"Drive this machine with the states from a sender, listening on a UDP port (default {network.DEFAULT_PORT})"
+        )
+        parser.add_argument(
+            '--publish',
+            type=str,
+            nargs='?',
+            const=shared_state.DEFAULT_PATH,
+            metavar='PATH',
+            help=f"Publish the latest controller state to a shared memory file for other programs (default {shared_state.DEFAULT_PATH})"
+        )
+        parser.add_argument(
+            '--stats',
+            type=float,
+            nargs='?',
+            const=1.0,
+            default=0,
+            metavar='SECONDS',
+            help="Time each stage of the pipeline, and print a line of statistics every SECONDS (default 1)"
+        )
+        parser.add_argument(
+            '--stats-json',
+            type=str,
+            metavar='PATH',
+            help="Time each stage of the pipeline, and write the statistics to PATH as JSON on exit and on SIGUSR1"
+        )
+        parser.add_argument(
+            '--async',
+            dest='use_async',
+            action='store_true',
+            help="Use the asyncio driver, where each output runs as its own sink (not supported on Windows)"
+        )
+        parser.add_argument(
+            '--log',
+            action='store_true',
+            help="With --async, log every change in controller state"
+        )
         args = parser.parse_args()
 
+        if args.multi and sys.platform.startswith("win"):
+            print("Multi-controller mode is not supported on Windows")
+            exit()
+        if args.use_async and sys.platform.startswith("win"):
+            print("The asyncio driver is not supported on Windows")
+            exit()
+        if args.gamepad and sys.platform.startswith("win"):
+            print("Gamepad mode is not supported on Windows")
+            exit()
+        if args.gamepad and args.absolute:
+            print("Gamepad mode drives the stick directly; it can't be used with --absolute")
+            exit()
+        if args.gamepad and args.multi:
+            print("Gamepad mode is not supported in multi-controller mode")
+            exit()
+        if (args.send or args.receive) and (args.multi or args.use_async):
+            print("Network streaming can't be used with --multi or --async")
+            exit()
+        if args.send and args.receive:
+            print("Choose one of --send and --receive")
+            exit()
+        # these options are only carried out by the threaded driver (and the network receiver, which uses it)
+        driver_options = [
+            name for name, given in (
+                ("--record", args.record), ("--publish", args.publish), ("--stats", args.stats or args.stats_json),
+                ("--mouse-rate", args.mouse_rate)
+            ) if given
+        ]
+        for mode, enabled in (("--multi", args.multi), ("--async", args.use_async), ("--send", args.send)):
+            if enabled and driver_options:
+                print(f"{', '.join(driver_options)} can't be used with {mode}")
+                exit()
+        if args.log and not args.use_async:
+            print("--log is only used by the asyncio driver (--async)")
+            exit()
+
+        # Select the Linux output backend
+        if args.gamepad:
+            # the stick is written as gamepad axes along with the buttons, so there is no mouse stage
+            import gamepad_functions
+
+            update_keys = gamepad_functions.update_keys
+            resolve_key = gamepad_functions.resolve_key
+            default_config = gamepad_functions.DEFAULT_CONFIG
+        elif update_keys is None:
+            if args.backend == "uinput":
+                import uinput_functions as linux_backend
+            elif args.backend == "xtest":
+                import xtest_functions as linux_backend
+                # calibrate over the backend's connection, rather than through pyautogui
+                mouse_pos.set_position_reader(linux_backend.read_mouse_position)
+            else:
+                import linux_functions as linux_backend
+
+            update_keys = linux_backend.update_keys
+            update_mouse = linux_backend.update_mouse
+            move_mouse = linux_backend.move_mouse
+            resolve_key = linux_backend.resolve_key
+
         board_id = ""
         if args.board in vid_pid.keys():
             board_id = vid_pid[args.board]
@@ -77,21 +249,75 @@ if __name__ == "__main__":
             print("Board type not supported")
             exit()
 
-        # Get our configuration, if one was supplied
-        config = []
-        if (args.config):
+        # Get our configurations, if any were supplied (one per player in multi-controller mode)
+        configs = []
+        stick_filter = None
+        for player, path in enumerate(args.config or [], start=1):
             try:
-                cfg_obj = controller_config.Configuration(args.config)
-                config = cfg_obj.__list__()
+                cfg_obj = controller_config.Configuration(path)
+                configs.append(cfg_obj.__list__())
+                # only one player drives the mouse, so only their curves and filter are used
+                # (with a single controller, that is always the one configuration)
+                if player == (args.mouse_player if args.multi else 1):
+                    mouse_pos.set_curves(cfg_obj.curve, cfg_obj.absolute_curve)
+                    stick_filter = cfg_obj.stick_filter
             except Exception as e:
                 print("Error:", e)
                 print("Using default configuration.")
-                config = default_config
-        else:
-            config = default_config
+                configs.append(default_config)
 
         try:
-            comm.run(config, update_keys, update_mouse, board_id, args.absolute)
+            # compile every player's configuration into the backend's key codes, so no names are looked up per packet
+            # tables hold turbo state, so each player gets their own
+            players = args.players if args.multi else 1
+            tables = [
+                dispatch.compile_table(configs[player] if player < len(configs) else default_config, resolve_key)
+                for player in range(players)
+            ]
+
+            # the configuration file is reloaded whenever it changes
+            watcher = None
+            if args.config and not (args.multi or args.use_async):
+                def reload(path):
+                    cfg_obj = controller_config.Configuration(path)
+                    table = dispatch.compile_table(cfg_obj.__list__(), resolve_key)
+                    # sections removed from the file go back to their defaults
+                    mouse_pos.set_curves(
+                        cfg_obj.curve or mouse_pos.DEFAULT_RELATIVE_CURVE,
+                        cfg_obj.absolute_curve or mouse_pos.DEFAULT_ABSOLUTE_CURVE
+                    )
+                    return (table, cfg_obj.stick_filter)
+                watcher = dispatch.ConfigWatcher(args.config[0], reload)
+
+            if args.send:
+                network.run_sender(board_id, args.send, args.baud, args.negotiate)
+            elif args.receive:
+                network.receive(
+                    tables[0], update_keys, update_mouse, args.receive, args.absolute, "",
+                    move_mouse, args.mouse_rate, args.mouse_speed, None,
+                    stats.Probes() if args.stats or args.stats_json else None, args.stats, args.stats_json, watcher,
+                    stick_filter, args.record, args.publish
+                )
+            elif args.multi:
+                import multi
+                multi.run(
+                    tables, tables[-1], update_keys, update_mouse, list(vid_pid.values()), args.absolute,
+                    args.baud, args.negotiate, args.players, args.mouse_player, stick_filter,
+                    move_mouse
+                )
+            elif args.use_async:
+                import async_driver
+                async_driver.run(
+                    tables[0], update_keys, update_mouse, board_id, args.absolute, args.baud, args.negotiate, args.log,
+                    stick_filter, move_mouse
+                )
+            else:
+                comm.run(
+                    tables[0], update_keys, update_mouse, board_id, args.absolute, args.baud, args.negotiate,
+                    move_mouse, args.mouse_rate, args.mouse_speed, args.record,
+                    stats.Probes() if args.stats or args.stats_json else None, args.stats, args.stats_json, watcher,
+                    stick_filter, args.publish
+                )
         except KeyboardInterrupt:
             exit()
         except Exception as e:
@@ -0,0 +1,435 @@
+"""
+N64 Converter
+network.py
+Copyright 2020 Riley Lannon
+
+Streams controller states over UDP, so the board can be plugged into one machine and drive an emulator on another.
+
+The sender reads the board as the local driver does, and sends each validated state as a datagram holding a
+session ID (random for each run of the sender), a sequence number, and the time the state arrived from the board.
+Only the newest state is ever sent; anything that arrived while the last datagram was going out is skipped.
+
+The receiver stands in for the serial connection: it rebuilds each datagram into a v2 frame for the usual driver
+loop (see comm.drive), so every output backend and option works unchanged. Datagrams older than the newest one
+already received are dropped, so a reordered state never undoes a newer one.
+
+When the board has nothing new, the sender repeats the last state now and then as a heartbeat, so the receiver
+knows it is still there. Heartbeats keep the original arrival time and are flagged, so they never count as states
+received or as latency samples.
+
+Each datagram lets the receiver count lost and reordered states and measure the one-way latency. The receiver
+reports these back to the sender once a second, so both ends can print them. Latency is measured with the wall
+clock, so the two machines' clocks must be synchronized (e.g. with NTP) for it to mean anything. Over loopback it is
+exact.
+"""
+
+import random
+import select
+import socket
+import struct
+from time import monotonic, perf_counter, time_ns
+
+import serial
+
+import comm
+import motion
+import serial_packet
+import session_log
+import shared_state
+import stats
+import supervisor
+
+# The UDP port used when none is given
+DEFAULT_PORT = 6464
+
+# A controller state: magic number, session ID, sequence number, arrival time (ns since the epoch), button mask, axes,
+# and flags
+STATE_MAGIC_NUMBER = b"\x23\xD0"
+STATE = struct.Struct("<2sHIQHbbB")
+
+# The state flags; a heartbeat repeats the last state, rather than carrying a new one from the board
+HEARTBEAT = 0x01
+
+# The receiver's report: magic number, session ID, states received, lost, reordered, and p50/p99 latency in us
+REPORT_MAGIC_NUMBER = b"\x23\xD1"
+REPORT = struct.Struct("<2sHIIIII")
+
+# How often the receiver reports back to the sender, in seconds
+REPORT_INTERVAL = 1.0
+
+# How long the sender waits for a new state before sending the last one again, in seconds
+HEARTBEAT_INTERVAL = 0.25
+
+# How long the receiver waits without a state before treating the sender as gone and releasing everything, in seconds
+RELEASE_TIMEOUT = 1.0
+
+
+def parse_address(text, default_port=DEFAULT_PORT):
+    """ Splits a "host" or "host:port" string
+
+        :returns:
+            A (host, port) tuple
+    """
+    host, _, port = text.rpartition(":")
+    if host and port.isdigit():
+        return (host, int(port))
+    return (text, default_port)
+
+
+def encode_state(session, sequence, timestamp_ns, buttons, flags=0):
+    """ Builds a state datagram """
+    return STATE.pack(
+        STATE_MAGIC_NUMBER, session, sequence, timestamp_ns, buttons.mask, buttons.x_axis, buttons.y_axis, flags
+    )
+
+
+def decode_state(data):
+    """ Reads a state datagram
+
+        :raises serial_packet.PacketError:
+            If the datagram isn't a state
+
+        :returns:
+            A tuple of the session ID, sequence number, arrival time in ns, Buttons, and flags
+    """
+    if len(data) != STATE.size or data[:2] != STATE_MAGIC_NUMBER:
+        raise serial_packet.PacketError("Not a controller state datagram")
+    _, session, sequence, timestamp_ns, mask, x, y, flags = STATE.unpack(data)
+    return (session, sequence, timestamp_ns, serial_packet.Buttons(mask, x, y), flags)
+
+
+class StreamStats:
+    """ Counts lost and reordered states, and measures their one-way latency, on the receiving end """
+
+    def __init__(self):
+        self.latency = stats.Histogram()
+        self.received = 0       # valid states received, not counting heartbeats
+        self.heartbeats = 0     # heartbeats received
+        self.lost = 0           # states skipped in the sequence that never arrived
+        self.reordered = 0      # states that arrived after a newer one, and were dropped
+        self.duplicates = 0     # states that arrived more than once
+        self.invalid = 0        # datagrams that weren't states
+        self.restarts = 0       # times a new sender session began
+
+        self.session = None
+        self.highest = None     # the newest sequence number in this session
+
+    def record(self, session, sequence, timestamp_ns, arrived_ns, heartbeat=False):
+        """ Accounts for a received state
+
+            :param heartbeat:
+                Whether the state is a heartbeat; heartbeats are counted in the sequence, but not as states
+                received or in the latency
+
+            :returns:
+                Whether the state is the newest so far, and should be used
+        """
+        if heartbeat:
+            self.heartbeats += 1
+        else:
+            self.received += 1
+            # clocks that aren't synchronized may put the arrival before the send; count that as no latency
+            self.latency.record(max(0, arrived_ns - timestamp_ns) / 1e9)
+
+        if session != self.session:
+            if self.session is not None:
+                self.restarts += 1
+            self.session = session
+            self.highest = sequence
+            return True
+
+        if sequence > self.highest:
+            self.lost += sequence - self.highest - 1
+            self.highest = sequence
+            return True
+        if sequence == self.highest:
+            self.duplicates += 1
+            return False
+
+        # a state we had counted as lost turned up late
+        self.reordered += 1
+        if self.lost:
+            self.lost -= 1
+        return False
+
+    def report(self):
+        """ Gets a one-line summary of the statistics """
+        p50, p99 = self.latency.percentiles(0.5, 0.99) if self.latency.count else (0, 0)
+        return (
+            f"received {self.received}, heartbeats {self.heartbeats}, lost {self.lost}, reordered {self.reordered}, "
+            f"duplicates {self.duplicates}, "
+            f"invalid {self.invalid}, sender restarts {self.restarts}, "
+            f"latency p50 {p50} us, p99 {p99} us, max {self.latency.max} us"
+        )
+
+    def encode(self):
+        """ Builds the report datagram sent back to the sender """
+        p50, p99 = self.latency.percentiles(0.5, 0.99) if self.latency.count else (0, 0)
+        clamp = lambda value: min(value, 0xFFFFFFFF)
+        return REPORT.pack(
+            REPORT_MAGIC_NUMBER, self.session or 0, clamp(self.received), clamp(self.lost), clamp(self.reordered),
+            clamp(p50), clamp(p99)
+        )
+
+
+def send(connect, address, stop=None):
+    """ The sender loop: reads the board and sends each new state to the receiver, until ^C
+
+        :param connect:
+            A function that finds the board and returns an open serial connection, waiting if necessary
+
+        :param address:
+            The receiver's (host, port)
+
+        :param stop:
+            A threading.Event that ends the loop when set
+
+        :returns:
+            The last report from the receiver, as a dictionary, or None if none arrived
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    session = random.randrange(1, 0x10000)
+    sequence = 0
+    sent = 0
+    errors = 0
+    last_report = None
+
+    conn = supervisor.ConnectionSupervisor(connect)
+    conn.open()
+    print(f"Sending to {address[0]}:{address[1]}.")
+
+    last = None
+    quit = False
+    while not quit:
+        try:
+            if stop is not None and stop.is_set():
+                break
+
+            # only the newest state is sent; if nothing new arrives, the last state is repeated (with its
+            # original timestamp) as a heartbeat, so the receiver knows we're still here
+            packet = conn.latest(timeout=HEARTBEAT_INTERVAL)
+            flags = 0
+            if packet is not None:
+                # stamp the state with when it arrived from the board, not when it was sent
+                waited = perf_counter() - (packet.received or perf_counter())
+                last = (packet.buttons, time_ns() - int(waited * 1e9))
+            elif last is not None:
+                flags = HEARTBEAT
+            if last is None:
+                continue
+
+            sequence = (sequence + 1) & 0xFFFFFFFF
+            try:
+                sock.sendto(encode_state(session, sequence, last[1], last[0], flags), address)
+                sent += 1
+            except OSError:
+                # e.g. the receiver's host is unreachable for now; the next state will try again
+                errors += 1
+
+            # pick up the receiver's reports without waiting for them
+            while select.select([sock], [], [], 0)[0]:
+                try:
+                    data = sock.recv(64)
+                except OSError:
+                    break
+                if len(data) == REPORT.size and data[:2] == REPORT_MAGIC_NUMBER:
+                    _, report_session, received, lost, reordered, p50, p99 = REPORT.unpack(data)
+                    if report_session == session:
+                        last_report = {"received": received, "lost": lost, "reordered": reordered, "p50_us": p50, "p99_us": p99}
+        except KeyboardInterrupt:
+            quit = True
+
+    print()
+    print("Exiting...")
+    conn.close()
+    sock.close()
+
+    counters = conn.stats()
+    print("Packets:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in counters.items()))
+    print(f"Sent {sent} states, {errors} send errors")
+    if last_report is not None:
+        print("Receiver:", ", ".join(f"{k.replace('_', ' ')}: {v}" for k, v in last_report.items()))
+    else:
+        print("Receiver: no reports received")
+    return last_report
+
+
+def run_sender(board_id: str, destination: str, baud: int = comm.DEFAULT_BAUD, negotiate: bool = False):
+    """ Connects to the Arduino and sends its states to a receiver until ^C
+
+        :param board_id:
+            The board's VID:PID, as in n64.py's vid_pid table
+
+        :param destination:
+            The receiver, as "host" or "host:port"
+
+        :param baud:
+            The serial baud rate
+
+        :param negotiate:
+            Whether to ask the Arduino to switch to baud
+    """
+    send(lambda: comm.open_connection(board_id, baud, negotiate), parse_address(destination))
+
+
+class UDPConnection:
+    """ Stands in for a serial connection, delivering the states sent by a sender as v2 frames
+
+        Each read waits for a datagram, then takes everything waiting and returns only the newest state.
+        A heartbeat only produces a frame if it holds a different state from the last one delivered (i.e. the
+        state it repeats was lost), so a held stick doesn't move the mouse again with each heartbeat.
+        If the sender goes quiet after sending, reads fail as if the board had been unplugged, so the driver
+        releases everything until it returns
+    """
+
+    def __init__(self, port=DEFAULT_PORT, host="", stream_stats=None, timeout=0.5):
+        """ Binds the socket
+
+            :param port:
+                The UDP port to listen on
+
+            :param host:
+                The address to listen on; all addresses by default
+
+            :param stream_stats:
+                The StreamStats to record into, which may be shared across connections; one is made if not given
+
+            :param timeout:
+                The longest a read waits, in seconds
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.stats = stream_stats if stream_stats is not None else StreamStats()
+        self.timeout = timeout
+
+        self.sender = None          # the address states last came from
+        self._last_state = None     # the (mask, x, y) of the last state delivered
+        self._sequence = 0          # the v2 frame sequence number
+        self._last_arrival = None
+        self._next_report = monotonic() + REPORT_INTERVAL
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        """ Waits for states, and returns the newest as a v2 frame (regardless of size), or b"" if none arrived
+
+            :raises serial.SerialException:
+                If the sender has gone quiet
+        """
+        newest = None
+        wait = self.timeout
+        while select.select([self.sock], [], [], wait)[0]:
+            # once something has arrived, only take what is already waiting
+            wait = 0
+            try:
+                data, address = self.sock.recvfrom(64)
+            except OSError:
+                # e.g. our last report was refused by a sender that has gone away
+                continue
+            arrived = time_ns()
+            try:
+                session, sequence, timestamp_ns, buttons, flags = decode_state(data)
+            except serial_packet.PacketError:
+                self.stats.invalid += 1
+                continue
+
+            self.sender = address
+            self._last_arrival = monotonic()
+            heartbeat = bool(flags & HEARTBEAT)
+            if self.stats.record(session, sequence, timestamp_ns, arrived, heartbeat):
+                if not heartbeat or (buttons.mask, buttons.x_axis, buttons.y_axis) != self._last_state:
+                    newest = buttons
+                else:
+                    # a newer datagram with the state we already have supersedes anything older in this read
+                    newest = None
+
+        now = monotonic()
+        if self.sender is not None and now >= self._next_report:
+            self._next_report = now + REPORT_INTERVAL
+            try:
+                self.sock.sendto(self.stats.encode(), self.sender)
+            except OSError:
+                pass
+
+        if newest is None:
+            if self._last_arrival is not None and now - self._last_arrival > RELEASE_TIMEOUT:
+                raise serial.SerialException("the sender went quiet")
+            return b""
+
+        self._last_state = (newest.mask, newest.x_axis, newest.y_axis)
+        self._sequence = (self._sequence + 1) & 0xFF
+        body = bytes([self._sequence]) + newest.mask.to_bytes(2, "little") + bytes([newest.x_axis & 0xFF, newest.y_axis & 0xFF])
+        return serial_packet.SerialPacket.V2_MAGIC_NUMBER + body + bytes([serial_packet.crc8(body)])
+
+    def write(self, data):
+        # the board's LEDs are on the sender's end
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+
+def receive(config, update_keys, update_mouse, port: int = DEFAULT_PORT, use_absolute: bool = False, host: str = "",
+        move_mouse=None, mouse_rate: int = 0, mouse_speed: float = motion.DEFAULT_SPEED, stop=None,
+        probes=None, stats_interval: float = 0, stats_json: str = None, watcher=None, stick_filter=None,
+        record: str = None, publish: str = None):
+    """ The receiver: drives the output backends with the states from a sender, until ^C
+
+        :param port:
+            The UDP port to listen on
+
+        :param host:
+            The address to listen on; all addresses by default
+
+        :param record:
+            If given, the path of a session log to record the received states into, as the frames they are rebuilt
+            into (see session_log.py)
+
+        :param publish:
+            If given, the path of a file to publish the latest controller state into, for other processes to read
+            (see shared_state.py)
+
+        See comm.drive() for the remaining parameters
+
+        :returns:
+            The StreamStats
+    """
+    stream_stats = StreamStats()
+
+    def connect():
+        connection = UDPConnection(port, host, stream_stats)
+        print(f"Listening on UDP port {port}.")
+        return connection
+
+    writer = None
+    if record is not None:
+        writer = session_log.SessionWriter(record)
+        print(f"Recording to {record}")
+        listen = connect
+        connect = lambda: session_log.RecordingConnection(listen(), writer)
+
+    publisher = None
+    if publish is not None:
+        publisher = shared_state.StatePublisher(publish)
+        print(f"Publishing the controller state to {publish}")
+
+    try:
+        comm.drive(
+            connect, config, update_keys, update_mouse, use_absolute, move_mouse, mouse_rate, mouse_speed, stop=stop,
+            probes=probes, stats_interval=stats_interval, stats_json=stats_json, watcher=watcher,
+            stick_filter=stick_filter, publisher=publisher
+        )
+    finally:
+        if publisher is not None:
+            publisher.close()
+        if writer is not None:
+            writer.close()
+            print(f"Recorded {writer.records} reads to {record}")
+    print("Network:", stream_stats.report())
+    return stream_stats
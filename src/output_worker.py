@@ -0,0 +1,92 @@
+"""
+N64 Converter
+output_worker.py
+Copyright 2020 Riley Lannon
+
+A long-lived thread that drives an output function (such as update_keys or update_mouse).
+Work is handed over with latest-value-wins semantics: if the output falls behind, older submissions are
+replaced by the newest rather than queueing up, so the output never lags behind the controller.
+Where older submissions still matter (such as relative mouse movements), they can be merged into the newest instead.
+"""
+
+import threading
+
+
+class OutputWorker(threading.Thread):
+    """ Calls a target function on a persistent thread with the most recently submitted arguments """
+
+    def __init__(self, target, name=None, merge=None):
+        """ Creates the worker; call start() to begin handling submissions
+
+            :param target:
+                The function to call
+
+            :param name:
+                The name of the thread
+
+            :param merge:
+                A function combining the pending arguments with newer ones into a single set of arguments;
+                if not given, the newer arguments replace the pending ones
+        """
+        super().__init__(name=name, daemon=True)
+        self.target = target
+        self.merge = merge
+
+        # statistics
+        self.handled = 0        # calls made to the target
+        self.superseded = 0     # submissions replaced by (or merged into) a newer one before they were handled
+
+        self._condition = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self._running = True
+
+    def submit(self, *args):
+        """ Hands the worker a new set of arguments, replacing any that haven't been handled yet """
+        with self._condition:
+            if self._pending is not None:
+                self.superseded += 1
+                if self.merge is not None:
+                    args = self.merge(self._pending, args)
+            self._pending = args
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and self._running:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                args = self._pending
+                self._pending = None
+                self._busy = True
+
+            try:
+                self.target(*args)
+            except Exception as e:
+                print(f"An error occurred in {self.name}:", e)
+
+            with self._condition:
+                self.handled += 1
+                self._busy = False
+                self._condition.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """ Waits until every submission has been handled
+
+            :param timeout:
+                The maximum time to wait, in seconds; None waits forever
+
+            :returns:
+                Whether the worker is idle
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def stop(self):
+        """ Finishes any pending submission and stops the thread """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self.join(timeout=1)
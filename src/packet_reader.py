@@ -0,0 +1,142 @@
+"""
+N64 Converter
+packet_reader.py
+Copyright 2020 Riley Lannon
+
+A dedicated serial reader thread.
+The thread blocks on the serial connection, reading whatever is available in bulk, and frames the
+incoming bytes into SerialPackets. Packets are placed into a fixed-size ring buffer, and the output
+stage only ever consumes the most recent one.
+"""
+
+import threading
+from time import perf_counter
+
+import frame_parser
+
+
+class PacketReader(threading.Thread):
+    """ Reads packets from a serial connection on a background thread
+
+        The ring buffer has a single writer (this thread) and a single reader (the driver loop).
+        The writer fills a slot before publishing it by incrementing the write count, so the reader
+        never needs to take a lock; assignment of a list slot and an int is atomic in CPython.
+    """
+
+    def __init__(self, con, capacity=16, probes=None):
+        """ Creates the reader; call start() to begin reading
+
+            :param con:
+                The serial connection
+
+            :param capacity:
+                The number of packets held in the ring buffer
+
+            :param probes:
+                The stats.Probes to record read and validation times into, if any
+        """
+        super().__init__(name="PacketReader", daemon=True)
+        self.con = con
+        self.capacity = capacity
+        self.ring = [None] * capacity
+        self.probes = probes
+
+        # the number of packets written and consumed so far
+        self.written = 0
+        self.consumed = 0
+
+        # statistics
+        # packets superseded by a newer packet before they were consumed
+        # each counter has a single writer, so they are kept separately; see the dropped property
+        self._superseded_on_read = 0
+        self._superseded_on_consume = 0
+        self.stale = 0      # times the consumer asked for a packet and nothing new had arrived
+
+        # frames the packets from the raw byte stream, keeping its own resync/checksum statistics
+        self.parser = frame_parser.FrameParser()
+
+        # the error that stopped the thread, if any
+        self.error = None
+
+        self._available = threading.Event()
+        self._running = True
+
+    def run(self):
+        try:
+            while self._running:
+                # block until at least one byte arrives, then take everything that is waiting
+                waiting = self.con.in_waiting
+                start = perf_counter()
+                data = self.con.read(max(1, waiting))
+                received = perf_counter()
+                if not data:
+                    continue
+                packets = self.parser.feed(data)
+
+                if self.probes is not None:
+                    # a read that had to wait for data measures the link, not the read
+                    if waiting:
+                        self.probes.record("read", received - start)
+                    if packets:
+                        self.probes.record("validate", perf_counter() - received)
+
+                if packets:
+                    packets[-1].received = received
+                    self._publish(packets[-1], len(packets) - 1)
+        except Exception as e:
+            self.error = e
+            self._available.set()
+
+    def _publish(self, packet, superseded=0):
+        """ Places a packet into the ring buffer and wakes the consumer
+
+            :param packet:
+                The packet to publish
+
+            :param superseded:
+                The number of older packets from the same read that are never published
+        """
+        self._superseded_on_read += superseded
+        self.ring[self.written % self.capacity] = packet
+        self.written += 1
+        self._available.set()
+
+    def latest(self, timeout=None):
+        """ Gets the most recent packet, waiting for one to arrive if necessary
+
+            :param timeout:
+                The maximum time to wait, in seconds; None waits forever
+
+            :raises Exception:
+                If the reader thread stopped because of an error
+
+            :returns:
+                The newest SerialPacket, or None if no new packet arrived in time
+        """
+        if self.written == self.consumed:
+            self._available.clear()
+            # check again in case a packet was published before we cleared the event
+            if self.written == self.consumed:
+                self._available.wait(timeout)
+
+        if self.error is not None:
+            raise self.error
+
+        written = self.written
+        if written == self.consumed:
+            self.stale += 1
+            return None
+
+        self._superseded_on_consume += written - self.consumed - 1
+        self.consumed = written
+        return self.ring[(written - 1) % self.capacity]
+
+    @property
+    def dropped(self):
+        """ The number of packets that were superseded by a newer packet before they were consumed """
+        return self._superseded_on_read + self._superseded_on_consume
+
+    def stop(self):
+        """ Stops the reader thread """
+        self._running = False
+        self.join(timeout=1)
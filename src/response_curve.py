@@ -0,0 +1,154 @@
+"""
+N64 Converter
+response_curve.py
+Copyright 2020 Riley Lannon
+
+Stick response curves.
+A curve combines a deadzone (axial or radial), a shape (an exponent or a cubic bezier), and per-axis sensitivity.
+Curves are compiled once into lookup tables indexed directly by the raw axis bytes, so converting a stick position
+costs a single table lookup per packet rather than any branching or arithmetic.
+"""
+
+import math
+
+
+# The largest magnitude an axis can report; inputs are normalized against this
+MAX_AXIS = 128
+
+# The fields accepted in a curve's JSON configuration
+CONFIG_FIELDS = ("deadzone", "radial", "exponent", "bezier", "sensitivity")
+
+
+def _bezier_shape(x1, y1, x2, y2):
+    """ Creates a shape function from a cubic bezier running from (0, 0) to (1, 1), with control points (x1, y1) and (x2, y2)
+
+        The control points are given the same way as CSS easing curves. The x coordinates must lie within [0, 1]
+        so the curve is a function of x.
+    """
+    def coordinate(t, p1, p2):
+        return 3 * (1 - t) ** 2 * t * p1 + 3 * (1 - t) * t ** 2 * p2 + t ** 3
+
+    def shape(x):
+        # find the bezier parameter for this x by bisection; x(t) is increasing on [0, 1]
+        low = 0.0
+        high = 1.0
+        for _ in range(40):
+            middle = (low + high) / 2
+            if coordinate(middle, x1, x2) < x:
+                low = middle
+            else:
+                high = middle
+        return coordinate((low + high) / 2, y1, y2)
+
+    return shape
+
+
+class ResponseCurve:
+    """ A compiled stick response curve
+
+        lookup(x, y) converts a joystick position into an (x, y) mouse movement, with y flipped to screen coordinates
+    """
+
+    def __init__(self, deadzone=0, radial=False, exponent=1.0, bezier=None, sensitivity=(1.0, 1.0)):
+        """ Creates and compiles a curve
+
+            :param deadzone:
+                Stick magnitudes at or below this are treated as zero
+
+            :param radial:
+                Whether the deadzone and shape apply to the stick's distance from center (True),
+                or to each axis separately (False)
+
+            :param exponent:
+                The shape of the curve, as a power applied to the normalized magnitude; 1 is linear
+
+            :param bezier:
+                If given, a cubic bezier [x1, y1, x2, y2] used as the shape instead of the exponent
+
+            :param sensitivity:
+                A multiplier for the output, either one number or an (x, y) pair
+        """
+        if isinstance(sensitivity, (int, float)):
+            sensitivity = (sensitivity, sensitivity)
+        if len(sensitivity) != 2:
+            raise Exception("Curve sensitivity must be a number or an [x, y] pair")
+        if deadzone < 0 or exponent <= 0:
+            raise Exception("Curve deadzone must not be negative, and the exponent must be positive")
+
+        self.deadzone = deadzone
+        self.radial = radial
+        self.exponent = exponent
+        self.bezier = bezier
+        self.sensitivity = tuple(sensitivity)
+
+        if bezier is not None:
+            if len(bezier) != 4 or not (0 <= bezier[0] <= 1 and 0 <= bezier[2] <= 1):
+                raise Exception("Curve bezier must be [x1, y1, x2, y2] with x1 and x2 between 0 and 1")
+            self.shape = _bezier_shape(*bezier)
+        else:
+            self.shape = lambda t: t ** exponent
+
+        self._compile()
+
+    def _scale(self, magnitude):
+        """ Gets the output magnitude for an input magnitude, before sensitivity """
+        if magnitude <= self.deadzone:
+            return 0.0
+        return self.shape(min(magnitude / MAX_AXIS, 1.0)) * MAX_AXIS
+
+    def _compile(self):
+        """ Builds the lookup tables """
+        # the table index for a value is its byte, i.e. value & 0xFF
+        values = [byte - 256 if byte > 127 else byte for byte in range(256)]
+
+        if self.radial:
+            # one entry per (x byte, y byte) pair
+            # many positions share a distance from center, so each distance is only shaped once
+            factors = {}
+            table = []
+            for x in values:
+                for y in values:
+                    squared = x * x + y * y
+                    factor = factors.get(squared)
+                    if factor is None:
+                        magnitude = math.sqrt(squared)
+                        factor = self._scale(magnitude) / magnitude if magnitude else 0.0
+                        factors[squared] = factor
+                    table.append((int(x * factor * self.sensitivity[0]), -int(y * factor * self.sensitivity[1])))
+            self.table = tuple(table)
+            self.lookup = self._lookup_radial
+        else:
+            # signs are reapplied after shaping; y is flipped since screen coordinates grow downwards
+            self.x_table = tuple(int(math.copysign(self._scale(abs(v)), v) * self.sensitivity[0]) for v in values)
+            self.y_table = tuple(-int(math.copysign(self._scale(abs(v)), v) * self.sensitivity[1]) for v in values)
+            self.lookup = self._lookup_axial
+
+    def _lookup_axial(self, x, y):
+        return (self.x_table[x & 0xFF], self.y_table[y & 0xFF])
+
+    def _lookup_radial(self, x, y):
+        return self.table[((x & 0xFF) << 8) | (y & 0xFF)]
+
+
+def from_config(data, default=None):
+    """ Creates a curve from its JSON configuration
+
+        :param data:
+            A dictionary holding any of the CONFIG_FIELDS, or None
+
+        :param default:
+            The curve to return if no configuration was given
+
+        :raises Exception:
+            If the configuration contains an unknown field
+
+        :returns:
+            The compiled ResponseCurve
+    """
+    if data is None:
+        return default
+
+    for k in data.keys():
+        if k not in CONFIG_FIELDS:
+            raise Exception(f"Unknown curve setting '{k}'")
+    return ResponseCurve(**data)
@@ -6,102 +6,231 @@ Copyright 2020 Riley Lannon
 The SerialPacket class, which holds data for serial packets (and allows us to handle them)
 """
 
+import sys
+from array import array
+
+# The order buttons are packed into a button mask, from bit 0 upwards
+# This matches the packet order with the two axes removed
+BUTTON_NAMES = ("l", "r", "z", "d_up", "d_down", "d_left", "d_right",
+    "a", "b", "c_up", "c_down", "c_left", "c_right", "start")
+
+# The index of each button (by mask bit) within the 16-item packet data, which also holds the axes at 7 and 8
+# This is also the index of the button's key in a configuration list
+PACKET_INDICES = (0, 1, 2, 3, 4, 5, 6, 9, 10, 11, 12, 13, 14, 15)
+
+# Maps every byte to the ASCII digit '0' if it is zero and '1' otherwise, so a run of button bytes can be parsed as binary
+_TO_BINARY_DIGIT = bytes([ord("0")] + [ord("1")] * 255)
+
+
+def _button_property(bit):
+    """ Creates a property exposing one bit of the button mask as a bool """
+    flag = 1 << bit
+
+    def getter(self):
+        return bool(self.mask & flag)
+
+    def setter(self, value):
+        if value:
+            self.mask |= flag
+        else:
+            self.mask &= ~flag
+
+    return property(getter, setter)
+
+
 class Buttons:
-    def __init__(self):
-        self.l = False
-        self.r = False
-        self.z = False
-        self.d_up = False
-        self.d_down = False
-        self.d_left = False
-        self.d_right = False
-        self.x_axis = 0
-        self.y_axis = 0
-        self.a = False
-        self.b = False
-        self.c_up = False
-        self.c_down = False
-        self.c_left = False
-        self.c_right = False
-        self.start = False
+    """ The state of the controller, packed into a button mask and the two joystick axes
+
+        Each button is also available as a bool attribute (l, r, z, d_up, ...), backed by its bit in the mask
+    """
+    __slots__ = ("mask", "x_axis", "y_axis")
+
+    def __init__(self, mask=0, x_axis=0, y_axis=0):
+        self.mask = mask
+        self.x_axis = x_axis
+        self.y_axis = y_axis
     
     def update(self, packet):
-        self.l = bool(packet[0])
-        self.r = bool(packet[1])
-        self.z = bool(packet[2])
-        self.d_up = bool(packet[3])
-        self.d_down = bool(packet[4])
-        self.d_left = bool(packet[5])
-        self.d_right = bool(packet[6])
-        self.x_axis = int.from_bytes([packet[7]], byteorder="big", signed=True) if type(packet) == bytes else packet[7]
-        self.y_axis = int.from_bytes([packet[8]], byteorder="big", signed=True) if type(packet) == bytes else packet[8]
-        self.a = bool(packet[9])
-        self.b = bool(packet[10])
-        self.c_up = bool(packet[11])
-        self.c_down = bool(packet[12])
-        self.c_left = bool(packet[13])
-        self.c_right = bool(packet[14])
-        self.start = bool(packet[15])
+        """ Updates the state from the 16 data values of a packet (as bytes or a sequence of values) """
+        if isinstance(packet, (bytes, bytearray)):
+            # the buttons are read most-significant first, so reverse them before parsing the digits
+            digits = (packet[0:7] + packet[9:16]).translate(_TO_BINARY_DIGIT)
+            self.mask = int(digits[::-1], 2)
+            self.x_axis = packet[7] - 256 if packet[7] > 127 else packet[7]
+            self.y_axis = packet[8] - 256 if packet[8] > 127 else packet[8]
+        else:
+            mask = 0
+            for bit, index in enumerate(PACKET_INDICES):
+                if packet[index]:
+                    mask |= 1 << bit
+            self.mask = mask
+            self.x_axis = packet[7]
+            self.y_axis = packet[8]
+
+    def set_state(self, mask, x_axis, y_axis):
+        """ Sets the state directly from a button mask and axes """
+        self.mask = mask
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+
+    def copy_from(self, other):
+        """ Copies the state of another Buttons object """
+        self.mask = other.mask
+        self.x_axis = other.x_axis
+        self.y_axis = other.y_axis
     
     def __iter__(self):
-        yield self.l
-        yield self.r
-        yield self.z
-        yield self.d_up
-        yield self.d_down
-        yield self.d_left
-        yield self.d_right
+        mask = self.mask
+        for bit in range(7):
+            yield bool(mask & (1 << bit))
         yield self.x_axis
         yield self.y_axis
-        yield self.a
-        yield self.b
-        yield self.c_up
-        yield self.c_down
-        yield self.c_left
-        yield self.c_right
-        yield self.start
+        for bit in range(7, 14):
+            yield bool(mask & (1 << bit))
     
     def __list__(self):
-        return [self.l, self.r, self.z, self.d_up, self.d_down, self.d_left, \
-            self.d_right, self.x_axis, self.y_axis, self.a, self.b, self.c_up, \
-                self.c_down, self.c_left, self.c_right, self.start]
+        return list(self.__iter__())
+
+
+for _bit, _name in enumerate(BUTTON_NAMES):
+    setattr(Buttons, _name, _button_property(_bit))
+
+
+class PacketError(Exception):
+    """ Raised when a packet's data is unusable """
+    pass
+
+
+class InvalidHeaderError(PacketError):
+    """ Raised when a packet doesn't begin with the magic number """
+    pass
+
+
+class InvalidChecksumError(PacketError):
+    """ Raised when a packet's data doesn't match its checksum """
+    pass
+
+
+def _crc8_table():
+    """ Builds the lookup table for CRC-8 (polynomial 0x07, as used by SMBus) """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    """ Computes the CRC-8 of some bytes, as the Arduino does for v2 frames
+
+        :param data:
+            The bytes to check
+
+        :returns:
+            The CRC, as an int
+    """
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
 
 
 class SerialPacket:
+    """ A frame sent by the Arduino
+
+        Two wire formats are understood, told apart by the second byte of the magic number:
+          * v1 (0x23 0xC0, 20 bytes): one byte per button and axis, and a 2-byte count of the non-zero bytes
+          * v2 (0x23 0xC2, 8 bytes): a sequence number, the button mask (2 bytes, little-endian),
+            the two axes, and a CRC-8 of the bytes between the magic number and the CRC
+    """
     # Static members
     MAGIC_NUMBER_LOW_INDEX = 0
     MAGIC_NUMBER_HIGH_INDEX = 1
     MAGIC_NUMBER_WIDTH = 2
+    MAGIC_NUMBER = b"\x23\xC0"
     DATA_BEGIN_INDEX = 2
     CHECKSUM_HIGH_INDEX = 18
     CHECKSUM_LOW_INDEX = 19
     CHECKSUM_WIDTH = 2
     PACKET_WIDTH = 20
 
+    # v2 frames
+    V2_MAGIC_NUMBER = b"\x23\xC2"
+    V2_SEQUENCE_INDEX = 2
+    V2_BUTTONS_INDEX = 3
+    V2_X_AXIS_INDEX = 5
+    V2_Y_AXIS_INDEX = 6
+    V2_CRC_INDEX = 7
+    V2_PACKET_WIDTH = 8
+
+    # The width of a frame, by the second byte of its magic number
+    FRAME_WIDTHS = {
+        MAGIC_NUMBER[1]: PACKET_WIDTH,
+        V2_MAGIC_NUMBER[1]: V2_PACKET_WIDTH,
+    }
+
     def __init__(self):
         self.data = Buttons()
+        self.version = 1
+        # only v2 frames carry a sequence number
+        self.sequence = None
+        # the perf_counter() time its data was read, if known
+        self.received = None
     
     def update(self, packet):
+        if len(packet) < self.MAGIC_NUMBER_WIDTH:
+            raise PacketError("Invalid packet length")
+
+        # v2 frames are decoded separately
+        if packet[self.MAGIC_NUMBER_LOW_INDEX] == self.V2_MAGIC_NUMBER[0] and packet[self.MAGIC_NUMBER_HIGH_INDEX] == self.V2_MAGIC_NUMBER[1]:
+            self._update_v2(packet)
+            return
+
+        if len(packet) < self.PACKET_WIDTH:
+            raise PacketError("Invalid packet length")
+
         # get the header and checksum; make sure the data is usable
         header = [packet[self.MAGIC_NUMBER_LOW_INDEX], packet[self.MAGIC_NUMBER_HIGH_INDEX]]
         checksum = int.from_bytes([packet[self.CHECKSUM_HIGH_INDEX], packet[self.CHECKSUM_LOW_INDEX]], byteorder="little")
 
-        # todo: turn the thrown headers into specific exception classes so they may be handled better
-
         if header != [0x23, 0xC0]:
-            raise Exception("Invalid header")
+            raise InvalidHeaderError("Invalid header")
         
         data_sum = 0
         for i in range(self.DATA_BEGIN_INDEX, len(packet) - self.CHECKSUM_WIDTH):
             data_sum += 0 if packet[i] == 0 else 1
         
         if data_sum != checksum:
-            print("found: ", data_sum)
-            print("checksum: ", checksum)
-            raise Exception("Invalid checksum")
+            raise InvalidChecksumError(f"Invalid checksum (found {data_sum}, expected {checksum})")
 
         # update the packet
         self.buttons.update(packet[self.DATA_BEGIN_INDEX:self.CHECKSUM_HIGH_INDEX])
+        self.version = 1
+        self.sequence = None
+
+    def _update_v2(self, packet):
+        """ Validates and decodes a v2 frame """
+        if len(packet) != self.V2_PACKET_WIDTH:
+            raise PacketError("Invalid packet length")
+
+        crc = crc8(packet[self.V2_SEQUENCE_INDEX:self.V2_CRC_INDEX])
+        if crc != packet[self.V2_CRC_INDEX]:
+            raise InvalidChecksumError(f"Invalid CRC (found {crc}, expected {packet[self.V2_CRC_INDEX]})")
+
+        x_axis = packet[self.V2_X_AXIS_INDEX]
+        y_axis = packet[self.V2_Y_AXIS_INDEX]
+        self.buttons.set_state(
+            packet[self.V2_BUTTONS_INDEX] | (packet[self.V2_BUTTONS_INDEX + 1] << 8),
+            x_axis - 256 if x_axis > 127 else x_axis,
+            y_axis - 256 if y_axis > 127 else y_axis
+        )
+        self.version = 2
+        self.sequence = packet[self.V2_SEQUENCE_INDEX]
     
     @property
     def buttons(self):
@@ -114,3 +243,122 @@ class SerialPacket:
     @staticmethod
     def magic_number_size():
         return SerialPacket.MAGIC_NUMBER_WIDTH
+
+
+class FrameBatch:
+    """ Holds the decoded states of many frames in compact arrays, rather than one Buttons object per frame
+
+        masks[i] holds the button mask of frame i (see BUTTON_NAMES for the bit order),
+        and x_axes[i] and y_axes[i] hold its signed joystick position
+    """
+    __slots__ = ("masks", "x_axes", "y_axes", "invalid")
+
+    def __init__(self, masks, x_axes, y_axes, invalid):
+        self.masks = masks
+        self.x_axes = x_axes
+        self.y_axes = y_axes
+        self.invalid = invalid
+
+    def __len__(self):
+        return len(self.masks)
+
+
+# Maps every byte to 1 if it is non-zero, for counting set bytes in bulk
+_NONZERO = bytes([0] + [1] * 255)
+
+# The CRC-8 table as a translation table, for advancing the CRCs of many frames at once
+_CRC8_BYTES = bytes(_CRC8_TABLE)
+
+# The offset of each button's byte within a frame, in button mask order
+_BUTTON_OFFSETS = tuple(SerialPacket.DATA_BEGIN_INDEX + index for index in PACKET_INDICES)
+
+
+def decode_frames(data):
+    """ Validates and decodes many concatenated frames at once
+
+        Rather than looping over each frame, every byte position is sliced out of the buffer as a column
+        (one byte per frame) and the columns are combined as big integers, one byte per frame.
+        Since each per-frame value stays below 256, the bytes never carry into their neighbours,
+        so the header check, checksum and button mask for every frame are computed in a handful of C-level operations.
+        For v2 frames, the CRC is advanced a column at a time: XOR never carries, and bytes.translate looks up
+        every frame's next CRC in the table at once.
+
+        :param data:
+            A bytes-like object containing N back-to-back frames, all in the wire format of the first
+            (frames of the other format are counted as invalid); any trailing partial frame is ignored
+
+        :returns:
+            A FrameBatch containing the frames that passed validation
+    """
+    view = memoryview(data).cast("B")
+    version = 2 if bytes(view[:SerialPacket.MAGIC_NUMBER_WIDTH]) == SerialPacket.V2_MAGIC_NUMBER else 1
+    width = SerialPacket.V2_PACKET_WIDTH if version == 2 else SerialPacket.PACKET_WIDTH
+    count = len(view) // width
+    view = view[:count * width]
+
+    def column(offset):
+        return bytes(view[offset::width])
+
+    def as_int(column_bytes):
+        return int.from_bytes(column_bytes, "little")
+
+    if version == 2:
+        crcs = bytes(count)
+        for offset in range(SerialPacket.V2_SEQUENCE_INDEX, SerialPacket.V2_CRC_INDEX):
+            crcs = (as_int(crcs) ^ as_int(column(offset))).to_bytes(count, "little").translate(_CRC8_BYTES)
+
+        # a frame is bad if any of these differ; XOR and OR never carry, so each byte holds one frame's result
+        bad = (as_int(column(SerialPacket.MAGIC_NUMBER_LOW_INDEX)) ^ as_int(SerialPacket.V2_MAGIC_NUMBER[:1] * count)) \
+            | (as_int(column(SerialPacket.MAGIC_NUMBER_HIGH_INDEX)) ^ as_int(SerialPacket.V2_MAGIC_NUMBER[1:] * count)) \
+            | (as_int(crcs) ^ as_int(column(SerialPacket.V2_CRC_INDEX)))
+
+        # the mask is already packed, little-endian
+        mask_bytes = bytearray(count * 2)
+        mask_bytes[0::2] = column(SerialPacket.V2_BUTTONS_INDEX)
+        mask_bytes[1::2] = column(SerialPacket.V2_BUTTONS_INDEX + 1)
+        x_offset, y_offset = SerialPacket.V2_X_AXIS_INDEX, SerialPacket.V2_Y_AXIS_INDEX
+    else:
+        # the checksum is the number of non-zero data bytes in the frame
+        data_sum = 0
+        for offset in range(SerialPacket.DATA_BEGIN_INDEX, SerialPacket.CHECKSUM_HIGH_INDEX):
+            data_sum += as_int(column(offset).translate(_NONZERO))
+
+        # the checksum is little-endian, so its first byte (CHECKSUM_HIGH_INDEX) holds the sum and the second must be 0
+        # a frame is bad if any of these differ; XOR and OR never carry, so each byte holds one frame's result
+        bad = (as_int(column(SerialPacket.MAGIC_NUMBER_LOW_INDEX)) ^ as_int(b"\x23" * count)) \
+            | (as_int(column(SerialPacket.MAGIC_NUMBER_HIGH_INDEX)) ^ as_int(b"\xC0" * count)) \
+            | (data_sum ^ as_int(column(SerialPacket.CHECKSUM_HIGH_INDEX))) \
+            | as_int(column(SerialPacket.CHECKSUM_LOW_INDEX))
+
+        # assemble the button masks; the low and high halves are built separately so each stays within a byte
+        low = 0
+        high = 0
+        for bit, offset in enumerate(_BUTTON_OFFSETS):
+            flags = as_int(column(offset).translate(_NONZERO))
+            if bit < 8:
+                low |= flags << bit
+            else:
+                high |= flags << (bit - 8)
+
+        mask_bytes = bytearray(count * 2)
+        mask_bytes[0::2] = low.to_bytes(count, "little")
+        mask_bytes[1::2] = high.to_bytes(count, "little")
+        x_offset, y_offset = 9, 10
+
+    masks = array("H", mask_bytes)
+    if sys.byteorder != "little":
+        masks.byteswap()
+
+    x_axes = array("b", column(x_offset))
+    y_axes = array("b", column(y_offset))
+
+    # only filter when something was actually wrong
+    invalid = 0
+    if bad:
+        keep = [i for i, b in enumerate(bad.to_bytes(count, "little")) if b == 0]
+        invalid = count - len(keep)
+        masks = array("H", [masks[i] for i in keep])
+        x_axes = array("b", [x_axes[i] for i in keep])
+        y_axes = array("b", [y_axes[i] for i in keep])
+
+    return FrameBatch(masks, x_axes, y_axes, invalid)
@@ -0,0 +1,225 @@
+"""
+N64 Converter
+session_log.py
+Copyright 2020 Riley Lannon
+
+Recording and replay of raw serial sessions.
+A recording holds every chunk of bytes read from the board, each with the time it arrived, so a session can be
+replayed through the same framing and decoding path without a controller attached.
+
+The log format is a short header followed by fixed-width records, so an uncompressed log can be mmapped and
+walked without parsing:
+    header: LOG_MAGIC (8 bytes)
+    record: time since the start of the recording in microseconds (8 bytes), length (2 bytes), little-endian;
+            followed by the raw bytes
+A log whose name ends in '.gz' is gzip-compressed.
+"""
+
+import gzip
+import mmap
+import struct
+import threading
+from time import perf_counter, sleep
+
+import serial
+
+LOG_MAGIC = b"N64LOG\x01\x00"
+RECORD_HEADER = struct.Struct("<QH")
+
+# The most bytes held in a single record
+MAX_RECORD = 0xFFFF
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class SessionWriter:
+    """ Writes a session log """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = _open(path, "wb")
+        self.file.write(LOG_MAGIC)
+        self.records = 0
+        self._start = perf_counter()
+        self._lock = threading.Lock()
+
+    def write(self, data, timestamp=None):
+        """ Appends a chunk of raw serial data
+
+            :param data:
+                The bytes read
+
+            :param timestamp:
+                The time the bytes arrived, in seconds since the recording started; defaults to now
+        """
+        if timestamp is None:
+            timestamp = perf_counter() - self._start
+        microseconds = int(timestamp * 1000000)
+        with self._lock:
+            for offset in range(0, len(data), MAX_RECORD):
+                chunk = data[offset:offset + MAX_RECORD]
+                self.file.write(RECORD_HEADER.pack(microseconds, len(chunk)))
+                self.file.write(chunk)
+                self.records += 1
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def read_log(path):
+    """ Reads a session log
+
+        :param path:
+            The log's path
+
+        :raises Exception:
+            If the file is not a session log
+
+        :returns:
+            A list of (timestamp in seconds, bytes) tuples, in order
+    """
+    with _open(path, "rb") as f:
+        if path.endswith(".gz"):
+            data = f.read()
+        else:
+            # the header is fixed-width, so the records can be walked in place
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        if data[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise Exception(f"'{path}' is not a session log")
+
+        records = []
+        offset = len(LOG_MAGIC)
+        while offset + RECORD_HEADER.size <= len(data):
+            microseconds, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            records.append((microseconds / 1000000, bytes(data[offset:offset + length])))
+            offset += length
+        return records
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+class RecordingConnection:
+    """ Wraps a serial connection, recording everything read from it """
+
+    def __init__(self, con, writer):
+        """ Creates the wrapper
+
+            :param con:
+                The serial connection
+
+            :param writer:
+                The SessionWriter to record into
+        """
+        self.con = con
+        self.writer = writer
+
+    def read(self, size=1):
+        data = self.con.read(size)
+        if data:
+            self.writer.write(data)
+        return data
+
+    def __getattr__(self, name):
+        # everything else goes straight to the connection
+        return getattr(self.con, name)
+
+    def __setattr__(self, name, value):
+        if name in ("con", "writer"):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.con, name, value)
+
+
+class ReplayConnection:
+    """ Stands in for a serial connection, delivering a recorded session
+
+        Once the recording is exhausted, reads fail as if the board had been unplugged
+    """
+
+    def __init__(self, records, realtime=True):
+        """ Creates the connection
+
+            :param records:
+                The recorded (timestamp, bytes) tuples, as from read_log
+
+            :param realtime:
+                Whether to deliver the data at the pace it was recorded, rather than as fast as it is read
+        """
+        self.records = records
+        self.realtime = realtime
+        self.timeout = 3
+        self.baudrate = 0
+        self.is_open = True
+        self.written = bytearray()
+        self._index = 0
+        self._pending = b""
+        self._start = None
+
+    def _due(self):
+        """ Gets the index of the first record that hasn't arrived yet """
+        if not self.realtime:
+            # at maximum speed, the next record arrives as soon as the previous one has been read,
+            # so reads are still chunked the way they were recorded
+            return min(self._index + (0 if self._pending else 1), len(self.records))
+        if self._start is None:
+            self._start = perf_counter() - (self.records[0][0] if self.records else 0)
+        elapsed = perf_counter() - self._start
+        index = self._index
+        while index < len(self.records) and self.records[index][0] <= elapsed:
+            index += 1
+        return index
+
+    def _take(self, limit):
+        """ Moves records that have arrived into the pending data, up to at least limit bytes if possible """
+        due = self._due()
+        while self._index < due and len(self._pending) < limit:
+            self._pending += self.records[self._index][1]
+            self._index += 1
+
+    @property
+    def in_waiting(self):
+        self._take(MAX_RECORD)
+        return len(self._pending)
+
+    def read(self, size=1):
+        self._take(size)
+        if not self._pending:
+            if self._index >= len(self.records):
+                raise serial.SerialException("end of recording")
+
+            # in real time, wait for the next record to arrive, as a blocking read would
+            delay = self.records[self._index][0] - (perf_counter() - self._start)
+            if self.timeout is not None and delay > self.timeout:
+                sleep(self.timeout)
+                return b""
+            sleep(max(delay, 0))
+            self._take(size)
+
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,163 @@
+"""
+N64 Converter
+shared_state.py
+Copyright 2020 Riley Lannon
+
+Publishes the latest controller state to other processes through a small memory-mapped file.
+The driver writes each decoded state into the file, and any number of local consumers (overlays, input recorders,
+emulator plugins) can map the same file and read it whenever they like, without the driver knowing they exist.
+
+The file has a fixed little-endian layout:
+    offset  0   4 bytes     magic number, b"N64S"
+    offset  4   uint16      layout version (1)
+    offset  6   uint16      reserved
+    offset  8   uint64      seqlock counter; odd while a state is being written
+    offset 16   uint64      state sequence number, counting up from 1 with each state published (0 before any)
+    offset 24   uint64      when the state was published, in nanoseconds of the monotonic clock
+                            (CLOCK_MONOTONIC on Linux, so it can be compared with time.monotonic_ns() in another process)
+    offset 32   uint16      button mask (see serial_packet.BUTTON_NAMES for the bit order)
+    offset 34   int8        x axis
+    offset 35   int8        y axis
+    offset 36   4 bytes     padding, to 40 bytes
+
+There is a single writer, so no lock is needed; readers retry if the seqlock counter was odd, or changed while they
+were reading.
+"""
+
+import collections
+import mmap
+import os
+import struct
+import tempfile
+from time import monotonic, monotonic_ns, sleep
+
+import serial_packet
+
+MAGIC_NUMBER = b"N64S"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH")
+COUNTER = struct.Struct("<Q")
+STATE = struct.Struct("<QQHbb")
+
+COUNTER_OFFSET = HEADER.size
+STATE_OFFSET = COUNTER_OFFSET + COUNTER.size
+SIZE = 40
+
+# Where the state is published by default; /dev/shm keeps it in memory on Linux
+if os.path.isdir("/dev/shm"):
+    DEFAULT_PATH = "/dev/shm/n64-converter"
+else:
+    DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "n64-converter.state")
+
+# The longest a reader waits for a state that is being written, in seconds, before assuming the writer died mid-write
+MAX_WAIT = 0.1
+
+# A published controller state
+State = collections.namedtuple("State", ("sequence", "timestamp_ns", "mask", "x_axis", "y_axis"))
+
+
+class StatePublisher:
+    """ Writes controller states into the shared file """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """ Creates (or reuses) the shared file
+
+            Readers that already have the file mapped keep working if the driver is restarted
+
+            :param path:
+                The path of the file to publish to
+        """
+        self.path = path
+        self.sequence = 0
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self._fd, SIZE)
+        self._map = mmap.mmap(self._fd, SIZE)
+        HEADER.pack_into(self._map, 0, MAGIC_NUMBER, VERSION, 0)
+
+        # carry on from whatever the last publisher left, so readers see the counters keep rising
+        counter = COUNTER.unpack_from(self._map, COUNTER_OFFSET)[0]
+        self._counter = counter + (counter & 1)
+        self.sequence = STATE.unpack_from(self._map, STATE_OFFSET)[0]
+
+    def publish(self, buttons, timestamp_ns=None):
+        """ Publishes a state
+
+            :param buttons:
+                The decoded Buttons
+
+            :param timestamp_ns:
+                When the state was received, in nanoseconds of time.monotonic_ns(); defaults to now
+        """
+        if timestamp_ns is None:
+            timestamp_ns = monotonic_ns()
+        self.sequence += 1
+
+        # the counter is odd while the state is inconsistent
+        self._counter += 1
+        COUNTER.pack_into(self._map, COUNTER_OFFSET, self._counter)
+        STATE.pack_into(self._map, STATE_OFFSET, self.sequence, timestamp_ns, buttons.mask, buttons.x_axis, buttons.y_axis)
+        self._counter += 1
+        COUNTER.pack_into(self._map, COUNTER_OFFSET, self._counter)
+
+    def close(self):
+        """ Stops publishing; the last state is left in the file """
+        self._map.close()
+        os.close(self._fd)
+
+
+class StateReader:
+    """ Reads controller states from the shared file """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """ Maps the shared file
+
+            :param path:
+                The path the driver publishes to
+
+            :raises Exception:
+                If the file isn't a controller state file
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), SIZE, access=mmap.ACCESS_READ)
+
+        magic, version, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC_NUMBER or version != VERSION:
+            self._map.close()
+            raise Exception(f"'{path}' is not a controller state file this reader supports")
+
+    def read(self):
+        """ Reads the latest state
+
+            :raises Exception:
+                If a consistent state couldn't be read, which means the writer is stuck partway through a write
+
+            :returns:
+                The State, or None if nothing has been published yet
+        """
+        deadline = None
+        while True:
+            before = COUNTER.unpack_from(self._map, COUNTER_OFFSET)[0]
+            if not before & 1:
+                state = STATE.unpack_from(self._map, STATE_OFFSET)
+                if COUNTER.unpack_from(self._map, COUNTER_OFFSET)[0] == before:
+                    return State(*state) if state[0] else None
+
+            # the writer is partway through; let it finish
+            if deadline is None:
+                deadline = monotonic() + MAX_WAIT
+            elif monotonic() > deadline:
+                raise Exception("Could not read a consistent controller state")
+            sleep(0)
+
+    def buttons(self):
+        """ Reads the latest state as a Buttons object, or None if nothing has been published yet """
+        state = self.read()
+        if state is None:
+            return None
+        return serial_packet.Buttons(state.mask, state.x_axis, state.y_axis)
+
+    def close(self):
+        self._map.close()
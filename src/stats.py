@@ -0,0 +1,130 @@
+"""
+N64 Converter
+stats.py
+Copyright 2020 Riley Lannon
+
+Latency probes for the driver pipeline.
+Each stage (serial read, frame validation, stick filtering, state diff, key injection, mouse injection, and end-to-end) records
+into its own histogram. Like an HDR histogram, values are kept to a fixed number of significant bits rather than
+stored individually, so memory stays bounded over a long session while percentiles stay within about 1%.
+"""
+
+import json
+import threading
+from time import monotonic
+
+# The number of significant bits kept for each value; 7 bits is within 1%
+SIGNIFICANT_BITS = 7
+
+# The pipeline stages, in order
+STAGES = ("read", "validate", "filter", "diff", "keys", "mouse", "end_to_end")
+
+
+class Histogram:
+    """ A latency histogram, in microseconds
+
+        Each histogram has a single writer, so record() takes no lock
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.max = 0
+
+    def record(self, seconds):
+        """ Adds a sample, given in seconds """
+        value = int(seconds * 1000000)
+        if value > self.max:
+            self.max = value
+
+        # drop the bits below the significant ones, so each power of two has a fixed number of buckets
+        shift = value.bit_length() - SIGNIFICANT_BITS
+        if shift > 0:
+            value = (value >> shift) << shift
+        self.counts[value] = self.counts.get(value, 0) + 1
+        self.count += 1
+
+    def percentiles(self, *fractions):
+        """ Gets the values at the given fractions of the samples (e.g. 0.5 for the median), in microseconds """
+        counts = sorted(list(self.counts.items()))
+        total = sum(count for _, count in counts)
+        results = []
+        for fraction in fractions:
+            target = max(1, int(total * fraction + 0.5))
+            seen = 0
+            value = 0
+            for value, count in counts:
+                seen += count
+                if seen >= target:
+                    break
+            results.append(value)
+        return results
+
+    def summary(self):
+        """ Gets the count, p50, p99 and max as a dictionary """
+        p50, p99 = self.percentiles(0.5, 0.99)
+        return {"count": self.count, "p50_us": p50, "p99_us": p99, "max_us": self.max}
+
+
+class Probes:
+    """ The histograms for every stage of the pipeline, plus the packet counters """
+
+    def __init__(self):
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.started = monotonic()
+
+        # the packet counters as of the last report, for rates
+        self._last_report = (self.started, 0)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """ Adds a sample to a stage's histogram """
+        self.histograms[stage].record(seconds)
+
+    def snapshot(self, counters=None):
+        """ Gets every stage's statistics, along with any packet counters
+
+            :param counters:
+                The connection statistics (as from ConnectionSupervisor.stats), if any
+
+            :returns:
+                A dictionary that can be written as JSON
+        """
+        elapsed = monotonic() - self.started
+        snapshot = {
+            "elapsed": elapsed,
+            "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items() if histogram.count},
+        }
+        if counters is not None:
+            snapshot["counters"] = dict(counters)
+            snapshot["packets_per_sec"] = counters.get("packets", 0) / max(elapsed, 1e-9)
+        return snapshot
+
+    def line(self, counters):
+        """ Gets a one-line report of the packet rate since the last report, drops, and each stage's latency
+
+            :param counters:
+                The connection statistics (as from ConnectionSupervisor.stats)
+        """
+        now = monotonic()
+        packets = counters.get("packets", 0)
+        with self._lock:
+            last_time, last_packets = self._last_report
+            self._last_report = (now, packets)
+        rate = (packets - last_packets) / max(now - last_time, 1e-9)
+
+        parts = [
+            f"{rate:.0f} packets/sec",
+            f"dropped {counters.get('dropped', 0)}",
+            f"lost {counters.get('frames_lost', 0)}",
+        ]
+        for stage, histogram in self.histograms.items():
+            if histogram.count:
+                p50, p99 = histogram.percentiles(0.5, 0.99)
+                parts.append(f"{stage} {p50}/{p99}/{histogram.max} us")
+        return " | ".join(parts)
+
+    def dump(self, path, counters=None):
+        """ Writes a snapshot to a JSON file """
+        with open(path, "w") as f:
+            json.dump(self.snapshot(counters), f, indent=4)
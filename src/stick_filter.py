@@ -0,0 +1,161 @@
+"""
+N64 Converter
+stick_filter.py
+Copyright 2020 Riley Lannon
+
+An adaptive filter for the joystick, applied between decoding and output.
+The stick's sensor jitters by a unit or two around wherever it rests, and every jitter would otherwise become a
+mouse event. This is a One Euro filter (Casiez et al., 2012): a low-pass filter whose cutoff frequency rises with
+the stick's speed, so a resting stick is smoothed heavily, while a moving stick passes through with little lag.
+"""
+
+import math
+
+import serial_packet
+
+# The settings accepted in a configuration file's "FILTER"
+CONFIG_FIELDS = ("min_cutoff", "beta", "d_cutoff")
+
+# The shortest time step used, in seconds, so packets decoded from the same read don't divide by zero
+MIN_STEP = 0.0001
+
+
+def _smoothing(cutoff, step):
+    """ Gets the weight of a new sample in an exponential low-pass filter with the given cutoff (in Hz) """
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / step)
+
+
+class OneEuroFilter:
+    """ A One Euro filter for a single value """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        """ Creates the filter
+
+            :param min_cutoff:
+                The cutoff frequency when the value is at rest, in Hz; lower removes more jitter
+
+            :param beta:
+                How much the cutoff rises with speed (in Hz per unit/sec); higher reduces lag when moving
+
+            :param d_cutoff:
+                The cutoff frequency used to smooth the speed, in Hz
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        """ Forgets the filter's history, so the next value passes through unchanged """
+        self.value = None
+        self.speed = 0.0
+        self.timestamp = None
+
+    def __call__(self, value, timestamp):
+        """ Filters a value
+
+            :param value:
+                The new raw value
+
+            :param timestamp:
+                When the value was measured, in seconds
+
+            :returns:
+                The filtered value
+        """
+        if self.value is None:
+            self.value = float(value)
+            self.timestamp = timestamp
+            return self.value
+
+        step = max(timestamp - self.timestamp, MIN_STEP)
+        self.timestamp = timestamp
+
+        # smooth the speed, then use it to choose the cutoff for the value itself
+        speed = (value - self.value) / step
+        self.speed += _smoothing(self.d_cutoff, step) * (speed - self.speed)
+        cutoff = self.min_cutoff + self.beta * abs(self.speed)
+        self.value += _smoothing(cutoff, step) * (value - self.value)
+        return self.value
+
+
+class StickFilter:
+    """ Filters both axes of the joystick """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        """ Creates the filter; see OneEuroFilter for the parameters
+
+            :raises Exception:
+                If a parameter is out of range
+        """
+        if min_cutoff <= 0 or d_cutoff <= 0 or beta < 0:
+            raise Exception("Filter cutoffs must be positive, and beta must not be negative")
+
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.x_filter = OneEuroFilter(min_cutoff, beta, d_cutoff)
+        self.y_filter = OneEuroFilter(min_cutoff, beta, d_cutoff)
+
+    def reset(self):
+        self.x_filter.reset()
+        self.y_filter.reset()
+
+    def filter(self, x, y, timestamp):
+        """ Filters a stick position
+
+            :param x:
+                The raw x axis
+
+            :param y:
+                The raw y axis
+
+            :param timestamp:
+                When the position was received, in seconds
+
+            :returns:
+                The filtered (x, y), rounded back to whole axis values
+        """
+        return (round(self.x_filter(x, timestamp)), round(self.y_filter(y, timestamp)))
+
+    def apply(self, buttons, timestamp):
+        """ Filters the stick position of a Buttons object
+
+            :param buttons:
+                The decoded Buttons
+
+            :param timestamp:
+                When the packet was received, in seconds
+
+            :returns:
+                The same Buttons if the filter didn't change the stick, or new Buttons holding the filtered position
+        """
+        x, y = self.filter(buttons.x_axis, buttons.y_axis, timestamp)
+        if x == buttons.x_axis and y == buttons.y_axis:
+            return buttons
+        return serial_packet.Buttons(buttons.mask, x, y)
+
+
+def from_config(data, default=None):
+    """ Creates a filter from its JSON configuration
+
+        :param data:
+            A dictionary holding any of the CONFIG_FIELDS, or None
+
+        :param default:
+            The filter to return if no configuration was given
+
+        :raises Exception:
+            If the configuration contains an unknown field
+
+        :returns:
+            The StickFilter
+    """
+    if data is None:
+        return default
+
+    for k in data.keys():
+        if k not in CONFIG_FIELDS:
+            raise Exception(f"Unknown filter setting '{k}'")
+    return StickFilter(**data)
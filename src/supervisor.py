@@ -0,0 +1,143 @@
+"""
+N64 Converter
+supervisor.py
+Copyright 2020 Riley Lannon
+
+A connection supervisor, which owns the serial connection and its reader thread.
+If the board is unplugged (or the connection otherwise fails), the supervisor lets the driver release anything
+it is holding, then re-discovers and reopens the board and carries on, without restarting the process.
+"""
+
+from time import monotonic, sleep
+
+import packet_reader
+
+# How long to wait before retrying a board that was found but could not be opened, in seconds
+RETRY_INTERVAL = 0.1
+
+
+class ConnectionSupervisor:
+    """ Keeps a serial connection (and its PacketReader) alive across disconnects """
+
+    def __init__(self, connect, on_disconnect=None, probes=None):
+        """ Creates the supervisor; call open() to make the first connection
+
+            :param connect:
+                A function that finds the board and returns an open serial connection, waiting if necessary
+
+            :param on_disconnect:
+                A function called when the connection is lost, before reconnecting
+
+            :param probes:
+                The stats.Probes each PacketReader records into, if any
+        """
+        self.connect = connect
+        self.on_disconnect = on_disconnect
+        self.probes = probes
+        self.conn = None
+        self.reader = None
+
+        # statistics
+        self.reconnects = 0
+        self.reconnect_latencies = []   # seconds from detecting a disconnect to being connected again
+
+        # the statistics of readers from earlier connections
+        self._totals = {}
+
+    def open(self):
+        """ Connects to the board and starts reading packets """
+        while True:
+            try:
+                self.conn = self.connect()
+                break
+            except Exception as e:
+                # the device node may exist before it is ready to be opened
+                print("Could not connect:", e)
+                sleep(RETRY_INTERVAL)
+
+        self.reader = packet_reader.PacketReader(self.conn, probes=self.probes)
+        self.reader.start()
+
+    def latest(self, timeout=None):
+        """ Gets the most recent packet, reconnecting if the connection was lost
+
+            :param timeout:
+                The maximum time to wait for a packet, in seconds; None waits forever
+
+            :returns:
+                The newest SerialPacket, or None if no new packet arrived in time (or we had to reconnect)
+        """
+        try:
+            return self.reader.latest(timeout)
+        except Exception as e:
+            print("Connection lost:", e)
+            self.reconnect()
+            return None
+
+    def reconnect(self):
+        """ Releases the old connection, and blocks until the board is connected again """
+        detected = monotonic()
+        if self.on_disconnect is not None:
+            try:
+                self.on_disconnect()
+            except Exception as e:
+                print("An error occurred when handling the disconnect:", e)
+
+        self._close_connection()
+        print("Waiting for the Arduino to reconnect...")
+        self.open()
+
+        latency = monotonic() - detected
+        self.reconnects += 1
+        self.reconnect_latencies.append(latency)
+        print(f"Reconnected in {latency * 1000:.0f} ms.")
+
+    def write(self, data):
+        """ Writes to the board; errors are ignored, since a lost connection is picked up by the reader """
+        try:
+            self.conn.write(data)
+        except Exception:
+            pass
+
+    def stats(self):
+        """ Gets the packet statistics, over every connection made so far
+
+            :returns:
+                A dictionary of the counters
+        """
+        totals = dict(self._totals)
+        for k, v in self._reader_stats().items():
+            totals[k] = totals.get(k, 0) + v
+        totals["reconnects"] = self.reconnects
+        return totals
+
+    def _reader_stats(self):
+        """ Gets the statistics of the current reader and its parser """
+        if self.reader is None:
+            return {}
+        stats = {
+            "packets": self.reader.written,
+            "dropped": self.reader.dropped,
+            "stale": self.reader.stale,
+        }
+        stats.update(self.reader.parser.stats())
+        return stats
+
+    def _close_connection(self):
+        """ Stops the reader and closes the connection, keeping their statistics """
+        for k, v in self._reader_stats().items():
+            self._totals[k] = self._totals.get(k, 0) + v
+
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def close(self):
+        """ Stops reading and closes the connection """
+        self._close_connection()
@@ -0,0 +1,181 @@
+# uinput_functions.py
+# Implementations of the mouse/keyboard functions for linux systems using a persistent uinput device
+
+# utilize python-evdev to write to /dev/uinput
+# unlike xdotool, the device is opened once and every update is written straight to the kernel
+from evdev import UInput, ecodes
+import mouse_pos
+
+
+# Keysym names that don't map onto an evdev KEY_* name by simply upper-casing them
+keysym_to_evdev = {
+    "Control": "KEY_LEFTCTRL",
+    "Shift": "KEY_LEFTSHIFT",
+    "Alt": "KEY_LEFTALT",
+    "Control_L": "KEY_LEFTCTRL",
+    "Shift_L": "KEY_LEFTSHIFT",
+    "Alt_L": "KEY_LEFTALT",
+    "Control_R": "KEY_RIGHTCTRL",
+    "Shift_R": "KEY_RIGHTSHIFT",
+    "Alt_R": "KEY_RIGHTALT",
+    "Return": "KEY_ENTER",
+    "Space": "KEY_SPACE",
+    "space": "KEY_SPACE",
+    "Tab": "KEY_TAB",
+    "Escape": "KEY_ESC",
+    "BackSpace": "KEY_BACKSPACE",
+    "Up": "KEY_UP",
+    "Down": "KEY_DOWN",
+    "Left": "KEY_LEFT",
+    "Right": "KEY_RIGHT",
+}
+
+# The device is created on first use and kept open for the lifetime of the process
+_device = None
+
+# The translated key codes, so each keysym is only looked up once
+_key_codes = {}
+
+# The last position we moved the cursor to in absolute mode
+# uinput only gives us a relative pointer, so absolute positions are driven as deltas from here
+_last_pos = None
+
+
+def keysym_to_code(keysym):
+    """ Converts a keysym name (as used by xdotool and the config files) into an evdev key code
+
+        :param keysym:
+            The keysym name, such as 'x' or 'Shift_L'
+
+        :raises Exception:
+            If the keysym has no evdev equivalent
+
+        :returns:
+            The evdev key code
+    """
+    if keysym not in _key_codes:
+        name = keysym_to_evdev.get(keysym, "KEY_" + str(keysym).upper())
+        if name not in ecodes.ecodes:
+            raise Exception(f"Unsupported key '{keysym}'")
+        _key_codes[keysym] = ecodes.ecodes[name]
+
+    return _key_codes[keysym]
+
+
+def resolve_key(key):
+    """ Converts a key name from the configuration into what update_keys sends
+
+        :param key:
+            The keysym name
+
+        :returns:
+            The evdev key code, or None if there is no equivalent
+    """
+    try:
+        return keysym_to_code(key)
+    except Exception:
+        return None
+
+
+def get_device():
+    """ Gets the virtual keyboard/mouse device, creating it if necessary
+
+        :returns:
+            The UInput device
+    """
+    global _device
+    if _device is None:
+        # advertise the whole regular keyboard range so any configured key can be sent,
+        # plus the mouse buttons so the desktop treats the device as a pointer
+        capabilities = {
+            ecodes.EV_KEY: list(range(ecodes.KEY_ESC, ecodes.KEY_MICMUTE + 1)) + [ecodes.BTN_LEFT, ecodes.BTN_RIGHT],
+            ecodes.EV_REL: [ecodes.REL_X, ecodes.REL_Y],
+        }
+        _device = UInput(capabilities, name="N64 Converter")
+    return _device
+
+
+def close():
+    """ Closes the virtual device, if it was opened """
+    global _device
+    if _device is not None:
+        _device.close()
+        _device = None
+
+
+def update_keys(pressed_buttons, packet, config):
+    """ Updates key presses
+
+        All changes in the packet are written as a single batch, followed by one syn
+
+        :param pressed_buttons:
+            The Buttons object containing *currently* pressed keys
+
+        :param packet:
+            The incoming data
+
+        :param config:
+            The input configuration, compiled into a dispatch.DispatchTable with resolve_key
+    """
+    # only the buttons that changed since the last update (or are repeating) produce events
+    events = config.edges(pressed_buttons.mask, packet.mask)
+    if not events:
+        return
+
+    device = get_device()
+    for code, pressed in events:
+        device.write(ecodes.EV_KEY, code, 1 if pressed else 0)
+    device.syn()
+
+    return
+
+
+def update_mouse(incoming, use_absolute=False, base_pos=(0, 0)):
+    """ Updates the mouse position
+
+        :param incoming:
+            The incoming data (a Buttons object)
+
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position
+
+        :param base_pos:
+            The calibrated zero point, used in absolute mode
+    """
+    global _last_pos
+
+    new_x_coord = incoming.x_axis
+    new_y_coord = incoming.y_axis
+
+    if use_absolute:
+        if _last_pos is None:
+            _last_pos = tuple(base_pos)
+        target = mouse_pos.get_absolute_pos(new_x_coord, new_y_coord, base_pos)
+        tup = (target[0] - _last_pos[0], target[1] - _last_pos[1])
+        _last_pos = target
+    else:
+        tup = mouse_pos.get_mouse_pos(new_x_coord, new_y_coord)
+
+    move_mouse(tup[0], tup[1])
+
+    return
+
+
+def move_mouse(x_change, y_change):
+    """ Moves the mouse relative to its current position
+
+        :param x_change:
+            The number of pixels to move right
+
+        :param y_change:
+            The number of pixels to move down
+    """
+    if x_change == 0 and y_change == 0:
+        return
+
+    device = get_device()
+    if x_change != 0:
+        device.write(ecodes.EV_REL, ecodes.REL_X, x_change)
+    if y_change != 0:
+        device.write(ecodes.EV_REL, ecodes.REL_Y, y_change)
+    device.syn()
@@ -1,6 +1,10 @@
 # win_functions.py
 # Implementations of the mouse/kbd functions for Windows
 
+import ctypes
+from ctypes import wintypes
+
+import controller_config
 import mouse_pos
 
 # win32 input modules
@@ -10,6 +14,76 @@ import win32api, win32con   # included in pypiwin32
 # set pydirectinput's failsafe to false; we aren't using it to drive the mouse
 pydirectinput.FAILSAFE = False
 
+# SendInput constants, from <winuser.h>
+INPUT_KEYBOARD = 1
+KEYEVENTF_EXTENDEDKEY = 0x0001
+KEYEVENTF_KEYUP = 0x0002
+KEYEVENTF_SCANCODE = 0x0008
+
+# The keys that need the extended key flag, as in pydirectinput
+EXTENDED_KEYS = ("up", "down", "left", "right")
+
+
+class _KEYBDINPUT(ctypes.Structure):
+    _fields_ = [
+        ("wVk", wintypes.WORD),
+        ("wScan", wintypes.WORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    ]
+
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [
+        ("dx", wintypes.LONG),
+        ("dy", wintypes.LONG),
+        ("mouseData", wintypes.DWORD),
+        ("dwFlags", wintypes.DWORD),
+        ("time", wintypes.DWORD),
+        ("dwExtraInfo", ctypes.c_size_t),
+    ]
+
+
+class _INPUTUNION(ctypes.Union):
+    # the mouse input is the largest member, so it must be here for INPUT to have the right size
+    _fields_ = [("ki", _KEYBDINPUT), ("mi", _MOUSEINPUT)]
+
+
+class _INPUT(ctypes.Structure):
+    _fields_ = [("type", wintypes.DWORD), ("union", _INPUTUNION)]
+
+
+# The INPUT array reused for every update; it grows if a packet ever produces more events than it holds
+_key_inputs = (_INPUT * 32)()
+for _entry in _key_inputs:
+    _entry.type = INPUT_KEYBOARD
+
+
+def _send_input(inputs, count):
+    """ Injects the first count entries of an INPUT array in one call """
+    ctypes.windll.user32.SendInput(count, inputs, ctypes.sizeof(_INPUT))
+
+
+def resolve_key(key):
+    """ Converts a key name from the configuration into what update_keys sends
+
+        :param key:
+            The key name, either a keysym or a pydirectinput name
+
+        :returns:
+            A tuple of the scan code and the SendInput flags for pressing it, or None if pydirectinput has no scan code
+    """
+    key = controller_config.keysym_to_windows.get(key, key)
+    scan_code = pydirectinput.KEYBOARD_MAPPING.get(key)
+    if scan_code is None:
+        return None
+
+    flags = KEYEVENTF_SCANCODE
+    if key in EXTENDED_KEYS:
+        flags |= KEYEVENTF_EXTENDEDKEY
+    return (scan_code, flags)
+
 
 def update_keys(pressed_buttons, packet, config):
     """ Updates key presses
@@ -21,29 +95,28 @@ def update_keys(pressed_buttons, packet, config):
             The packet of data we are handling
         
         :param config:
-            The input configuration
+            The input configuration, compiled into a dispatch.DispatchTable with resolve_key
     """
+    global _key_inputs
 
-    incoming = list(packet)
-    pressed = list(pressed_buttons)
-
-    i = 0
-    while i < incoming.__len__():
-        # we only need to make a change if the data aren't the same
-        if pressed[i] != incoming[i]:
-            # we will drive the mouse separately; skip these
-            if i == 7 or i == 8:
-                pass
-            else:
-                if pressed[i]:
-                    # print(config[i], ": RELEASE", sep="") # for debug
-                    pydirectinput.keyUp(config[i])
-                else:
-                    # print(config[i], ": PRESS", sep="")   # for debug
-                    pydirectinput.keyDown(config[i])
-        
-        # increment the index
-        i += 1
+    # only the buttons that changed since the last update (or are repeating) produce events
+    # they are all collected into one SendInput call, rather than one call (and pydirectinput pause) per key
+    events = config.edges(pressed_buttons.mask, packet.mask)
+    if not events:
+        return
+
+    if len(events) > len(_key_inputs):
+        _key_inputs = (_INPUT * len(events))()
+        for entry in _key_inputs:
+            entry.type = INPUT_KEYBOARD
+
+    for index, (code, pressed) in enumerate(events):
+        # print(code, ": PRESS" if pressed else ": RELEASE", sep="")   # for debug
+        entry = _key_inputs[index].union.ki
+        entry.wScan = code[0]
+        entry.dwFlags = code[1] if pressed else code[1] | KEYEVENTF_KEYUP
+
+    _send_input(_key_inputs, len(events))
 
 
 def update_mouse(incoming, use_absolute, base_pos):
@@ -53,12 +126,9 @@ def update_mouse(incoming, use_absolute, base_pos):
             The incoming data we are handling (a Buttons object)
     """
 
-    # cast to list type
-    incoming = list(incoming)
-
     # get the joystick positions
-    new_x_coord = incoming[7]
-    new_y_coord = incoming[8]
+    new_x_coord = incoming.x_axis
+    new_y_coord = incoming.y_axis
 
     # act based on the mode
     tup = base_pos
@@ -72,3 +142,15 @@ def update_mouse(incoming, use_absolute, base_pos):
     
     # use the win32api to move the mouse position with a direct input event
     win32api.mouse_event(WIN32FLAGS, tup[0], tup[1], 0)
+
+
+def move_mouse(x_change, y_change):
+    """ Moves the mouse relative to its current position with a direct input event
+
+        :param x_change:
+            The number of pixels to move right
+
+        :param y_change:
+            The number of pixels to move down
+    """
+    win32api.mouse_event(win32con.MOUSEEVENTF_MOVE, x_change, y_change, 0)
@@ -0,0 +1,151 @@
+# xtest_functions.py
+# Implementations of the mouse/keyboard functions for linux systems using a persistent X11 connection
+
+# utilize python-xlib's XTest extension
+# unlike xdotool, the X server connection is opened once, and the screen geometry is read once;
+# each update queues its events and flushes them to the server together
+import Xlib.threaded  # the key and mouse workers share the connection
+from Xlib import X, XK, display
+from Xlib.ext import xtest
+
+import mouse_pos
+
+
+# The connection is opened on first use and kept open for the lifetime of the process
+_display = None
+
+# The root window, and the screen's (width, height), read when the connection is opened
+_root = None
+_screen_size = None
+
+
+def get_display():
+    """ Gets the X server connection, opening it if necessary
+
+        :raises Exception:
+            If the X server doesn't support XTest
+
+        :returns:
+            The Display
+    """
+    global _display, _root, _screen_size
+    if _display is None:
+        connection = display.Display()
+        if not connection.has_extension("XTEST"):
+            connection.close()
+            raise Exception("The X server does not support the XTEST extension")
+
+        screen = connection.screen()
+        _root = screen.root
+        _screen_size = (screen.width_in_pixels, screen.height_in_pixels)
+        _display = connection
+    return _display
+
+
+def close():
+    """ Closes the X server connection, if it was opened """
+    global _display, _root, _screen_size
+    if _display is not None:
+        _display.close()
+        _display = None
+        _root = None
+        _screen_size = None
+
+
+def resolve_key(key):
+    """ Converts a key name from the configuration into what update_keys sends
+
+        :param key:
+            The keysym name
+
+        :returns:
+            The X keycode, or None if the keysym is unknown or not on the keyboard map
+    """
+    keysym = XK.string_to_keysym(key)
+    if keysym == X.NoSymbol:
+        return None
+    keycode = get_display().keysym_to_keycode(keysym)
+    return keycode or None
+
+
+def read_mouse_position():
+    """ Reads the current mouse position over the existing connection, for calibration
+
+        :returns:
+            A tuple with the (x, y) coordinates of the cursor
+    """
+    get_display()
+    pointer = _root.query_pointer()
+    return (pointer.root_x, pointer.root_y)
+
+
+def update_keys(pressed_buttons, packet, config):
+    """ Updates key presses
+
+        All changes in the packet are queued, then flushed to the server together
+
+        :param pressed_buttons:
+            The Buttons object containing *currently* pressed keys
+
+        :param packet:
+            The incoming data
+
+        :param config:
+            The input configuration, compiled into a dispatch.DispatchTable with resolve_key
+    """
+    # only the buttons that changed since the last update (or are repeating) produce events
+    events = config.edges(pressed_buttons.mask, packet.mask)
+    if not events:
+        return
+
+    connection = get_display()
+    for keycode, pressed in events:
+        xtest.fake_input(connection, X.KeyPress if pressed else X.KeyRelease, keycode)
+    connection.flush()
+
+    return
+
+
+def update_mouse(incoming, use_absolute=False, base_pos=(0, 0)):
+    """ Updates the mouse position
+
+        :param incoming:
+            The incoming data
+
+        :param use_absolute:
+            Whether the joystick drives the absolute mouse position
+
+        :param base_pos:
+            The calibrated zero point, used in absolute mode
+    """
+    if use_absolute:
+        connection = get_display()
+        target = mouse_pos.get_absolute_pos(incoming.x_axis, incoming.y_axis, base_pos)
+        # keep the target on the screen, using the geometry read when we connected
+        x = min(max(target[0], 0), _screen_size[0] - 1)
+        y = min(max(target[1], 0), _screen_size[1] - 1)
+        xtest.fake_input(connection, X.MotionNotify, root=_root, x=x, y=y)
+        connection.flush()
+    else:
+        tup = mouse_pos.get_mouse_pos(incoming.x_axis, incoming.y_axis)
+        move_mouse(tup[0], tup[1])
+
+    return
+
+
+def move_mouse(x_change, y_change):
+    """ Moves the mouse relative to its current position
+
+        :param x_change:
+            The number of pixels to move right
+
+        :param y_change:
+            The number of pixels to move down
+    """
+    if x_change == 0 and y_change == 0:
+        return
+
+    connection = get_display()
+    # a true detail makes the motion relative
+    xtest.fake_input(connection, X.MotionNotify, detail=True, x=x_change, y=y_change)
+    connection.flush()